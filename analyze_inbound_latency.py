@@ -0,0 +1,310 @@
+"""Break down how long inbound SMS take to reach Principle, stage by stage.
+
+An inbound message goes through SmsReceivedHandler and PrincipleInboundSmsWriter:
+
+    SMSReceived                        the provider hands the reply to the bridge
+    PrincipleInboundResolve (store)    looked up in the outbound store (after the received file is saved)
+    PrincipleInboundResolve (search)   zero or more patient searches against the Principle API
+    PrincipleInboundSmsCreated         written to Principle, or
+    PrincipleInboundSmsUnmatched       no patient found, or
+    PrincipleInboundSmsFailed          the Principle API threw
+
+SMSReceived and the outcome events carry the inbound message ID, but the resolve events only
+name the sender's number, so they are matched to the waiting messages from that number at the
+same site: a store lookup to the oldest one not yet looked up, a search to the newest one that has.
+"""
+import argparse
+import os
+import re
+import sys
+from collections import defaultdict, deque
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from sms_log_reader import get_message_id, merge_log_sources, parse_site
+
+OUTCOME_EVENTS = {
+    'PrincipleInboundSmsCreated': 'Created',
+    'PrincipleInboundSmsUnmatched': 'Unmatched',
+    'PrincipleInboundSmsFailed': 'Failed',
+}
+WEBHOOK_EVENTS = {'PrincipleWebhook', 'PrincipleOutboundSmsQueued'}
+
+STAGES = ['store_lookup', 'patient_search', 'write', 'total']
+PERCENTILES = [0.5, 0.9, 0.95, 0.99]
+
+FROM_PATTERN = re.compile(r'From: (.*?), Contact: ')
+STORE_LOOKUP_PATTERN = re.compile(r'Store lookup for (.*?): found=')
+SEARCH_PATTERN = re.compile(r'Searching Principle API for (.*?) in practices: |Search practice=.*? phone=(.*?): \d+ matches')
+
+def trace_inbound_messages(log_dirs):
+    """Follow every inbound message through the pipeline, returning one row per message.
+
+    Entries are read as one time-ordered stream across all sites, so the lookups used to match
+    resolve and outcome events only hold the messages still waiting for an outcome. The rows
+    returned, one per message, are all kept.
+    """
+    messages = []
+    waiting = {}  # message_id -> row
+    by_sender = defaultdict(deque)  # (site, number) -> rows waiting for an outcome, oldest first
+    webhooks = []
+
+    for timestamp, site, log_entry in merge_log_sources(log_dirs):
+        event_type = log_entry.get('EventType', '')
+        details = log_entry.get('Details', '')
+
+        if event_type == 'SMSReceived':
+            match = FROM_PATTERN.match(details)
+            row = {
+                'message_id': get_message_id(log_entry),
+                'site': site,
+                'provider': log_entry.get('Provider', ''),
+                'phone_number': match.group(1) if match else 'Unknown',
+                'received_at': timestamp,
+                'lookup_at': None,
+                'last_resolve_at': None,
+                'searches': 0,
+                'finished_at': None,
+                'outcome': None,
+            }
+            messages.append(row)
+            # A message logged with the empty GUID is still traced through resolution, but its outcome cannot be matched
+            if row['message_id']:
+                waiting[row['message_id']] = row
+            by_sender[(site, row['phone_number'])].append(row)
+
+        elif event_type == 'PrincipleInboundResolve':
+            match = STORE_LOOKUP_PATTERN.match(details)
+            if match:
+                # The store lookup starts resolution, so it belongs to the oldest message not yet looked up
+                queue = by_sender.get((site, match.group(1)), ())
+                row = next((r for r in queue if r['lookup_at'] is None), None)
+                if row is not None:
+                    row['lookup_at'] = row['last_resolve_at'] = timestamp
+                continue
+
+            match = SEARCH_PATTERN.match(details)
+            if match:
+                # Searches continue the resolution of the newest message that has started one
+                queue = by_sender.get((site, match.group(1) or match.group(2)), ())
+                row = next((r for r in reversed(queue) if r['lookup_at'] is not None), None)
+                if row is not None:
+                    row['last_resolve_at'] = timestamp
+                    if details.startswith('Search practice='):
+                        row['searches'] += 1
+
+        elif event_type in OUTCOME_EVENTS:
+            row = waiting.pop(get_message_id(log_entry), None)
+            if row is None:
+                continue  # Received before the first log file, or logged with the empty GUID
+            row['finished_at'] = timestamp
+            row['outcome'] = OUTCOME_EVENTS[event_type]
+            queue = by_sender[(site, row['phone_number'])]
+            queue.remove(row)
+            if not queue:
+                del by_sender[(site, row['phone_number'])]
+
+        elif event_type in WEBHOOK_EVENTS:
+            if event_type == 'PrincipleOutboundSmsQueued':
+                kind = 'queued'
+            elif details.startswith('Principle webhook received from'):
+                kind = 'received'
+            elif 'integration is disabled' in details:
+                kind = 'disabled'
+            elif 'duplicate' in details:
+                kind = 'duplicate'
+            elif 'skipped' in details:
+                kind = 'skipped'
+            else:
+                kind = 'rejected'
+            webhooks.append({'timestamp': timestamp, 'site': site, 'kind': kind})
+
+    df = pd.DataFrame(messages, columns=[
+        'message_id', 'site', 'provider', 'phone_number', 'received_at', 'lookup_at',
+        'last_resolve_at', 'searches', 'finished_at', 'outcome'
+    ])
+    df['outcome'] = df['outcome'].fillna('No outcome logged')
+    return df, pd.DataFrame(webhooks, columns=['timestamp', 'site', 'kind'])
+
+def stage_latencies(df):
+    """Add the seconds spent in each stage. Stages a message never reached are left empty."""
+    def seconds(start, end):
+        return (utc(df[end]) - utc(df[start])).dt.total_seconds()
+
+    df = df.copy()
+    df['store_lookup'] = seconds('received_at', 'lookup_at')
+    df['patient_search'] = seconds('lookup_at', 'last_resolve_at')
+    df['write'] = seconds('last_resolve_at', 'finished_at')
+    df['total'] = seconds('received_at', 'finished_at')
+    # Only a created message made the write call; an unmatched one logs straight after resolving
+    df.loc[df['outcome'] != 'Created', 'write'] = np.nan
+    # Sites may be in different time zones, so hours are taken from each message's own offset
+    df['hour'] = [t.hour for t in df['received_at']]
+    return df
+
+def utc(timestamps):
+    """Convert a column of offset-aware timestamps, possibly from several zones, to naive UTC."""
+    return pd.to_datetime(timestamps, utc=True).dt.tz_localize(None)
+
+def inbound_in_progress(df):
+    """Return how many inbound messages of the same site were unfinished when each message arrived."""
+    in_progress = pd.Series(0, index=df.index)
+    for site, site_df in df.groupby('site'):
+        times = utc(site_df['received_at']).to_numpy()
+        arrivals = np.sort(times)
+        finished = np.sort(utc(site_df['finished_at'].dropna()).to_numpy())
+        # Messages received at or before this one minus those finished before it, including itself
+        in_progress[site_df.index] = (np.searchsorted(arrivals, times, side='right')
+                                      - np.searchsorted(finished, times, side='left'))
+    return in_progress
+
+def percentile_table(df, by=None):
+    """Count, mean and percentiles of every stage, optionally grouped."""
+    rows = {}
+    groups = [(None, df)] if by is None else df.groupby(by)
+    for key, group in groups:
+        for stage in [stage for stage in STAGES if stage in group]:
+            values = group[stage].dropna()
+            if len(values) == 0:
+                continue
+            row = {'count': len(values), 'mean': values.mean()}
+            for q in PERCENTILES:
+                row[f'p{int(q * 100)}'] = values.quantile(q)
+            row['max'] = values.max()
+            rows[stage if key is None else (key, stage)] = row
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+def analyze_inbound(df):
+    """Print the stage breakdown of inbound processing time."""
+    print("\n===== INBOUND PIPELINE LATENCY =====")
+    print(f"Inbound messages received: {len(df)}")
+    if len(df) == 0:
+        return
+
+    outcomes = df['outcome'].value_counts()
+    for outcome, count in outcomes.items():
+        print(f"{outcome}: {count} ({100 * count / len(df):.2f}%)")
+    if df['lookup_at'].isna().all():
+        print("No PrincipleInboundResolve events found; Principle integration may be disabled for these logs")
+
+    print("\nStage Latency (seconds):")
+    print("store_lookup = received -> store lookup, patient_search = store lookup -> last search,")
+    print("write = last search -> created in Principle, total = received -> outcome")
+    print(percentile_table(df).round(3))
+
+    finished = df.dropna(subset=['total'])
+    if len(finished) > 0:
+        print("\nTotal Latency by Outcome (seconds):")
+        print(percentile_table(finished[['outcome', 'total']], by='outcome').round(3))
+
+        shares = finished[['store_lookup', 'patient_search', 'write']].fillna(0).sum()
+        print("\nShare of Total Inbound Processing Time:")
+        for stage, seconds in shares.items():
+            print(f"{stage}: {100 * seconds / shares.sum():.1f}%")
+
+        searched = finished[finished['searches'] > 0]
+        print(f"\nMessages needing a Principle patient search: {len(searched)} ({100 * len(searched) / len(finished):.2f}%)")
+        if len(searched) > 0:
+            per_search = searched['patient_search'] / searched['searches']
+            print(f"Searches per message: mean {searched['searches'].mean():.2f}, max {searched['searches'].max()}")
+            print(f"Time per search: median {per_search.median():.3f}s, p95 {per_search.quantile(0.95):.3f}s")
+
+    if len(df['site'].unique()) > 1:
+        print("\nTotal Latency by Site (seconds):")
+        print(percentile_table(df[['site', 'total']], by='site').round(3))
+
+def analyze_inbound_by_hour(df, webhooks):
+    """Print throughput, outcome rates and latency per hour of day."""
+    print("\n===== INBOUND PIPELINE BY HOUR =====")
+    hourly = df.groupby('hour').agg(
+        received=('message_id', 'size'),
+        created=('outcome', lambda s: (s == 'Created').sum()),
+        unmatched=('outcome', lambda s: (s == 'Unmatched').sum()),
+        failed=('outcome', lambda s: (s == 'Failed').sum()),
+        median_total=('total', 'median'),
+        p95_total=('total', lambda s: s.quantile(0.95)),
+        mean_store_lookup=('store_lookup', 'mean'),
+        mean_patient_search=('patient_search', 'mean'),
+        mean_write=('write', 'mean'),
+    )
+    hourly['unmatched_rate'] = hourly['unmatched'] / hourly['received']
+    hourly['failure_rate'] = hourly['failed'] / hourly['received']
+
+    # Peak throughput is the busiest single clock hour, not the average over all days
+    clock_hour = utc(df['received_at']).dt.floor('h')
+    hourly['peak_received'] = df.groupby([clock_hour, 'hour']).size().groupby(level='hour').max()
+
+    # Principle webhooks share the bridge with inbound processing, so show how busy they kept it
+    received = webhooks[webhooks['kind'] == 'received']
+    webhook_hours = pd.Series([t.hour for t in received['timestamp']], dtype=int).value_counts()
+    hourly['webhooks'] = webhook_hours.reindex(hourly.index, fill_value=0)
+
+    print(hourly.round(3).to_string())
+    return hourly
+
+def analyze_inbound_under_load(df):
+    """Relate total inbound latency to how many inbound messages were in progress on arrival."""
+    finished = df.dropna(subset=['total'])
+    if len(finished) == 0:
+        return
+
+    print("\n===== INBOUND LATENCY VS LOAD =====")
+    bins = [0, 1, 2, 3, 5, 10, float('inf')]
+    labels = ['1', '2', '3', '4-5', '6-10', '>10']
+    buckets = pd.cut(finished['in_progress'], bins=bins, labels=labels)
+    stats = finished.groupby(buckets, observed=True)[STAGES].median()
+    stats.insert(0, 'count', finished.groupby(buckets, observed=True).size())
+    print("Median Stage Latency by Inbound Messages In Progress at Arrival (seconds):")
+    print(stats.round(3))
+
+    if finished['in_progress'].nunique() > 1:
+        corr = np.corrcoef(finished['in_progress'], finished['total'])[0, 1]
+        print(f"\nCorrelation between inbound messages in progress and total latency: {corr:.4f}")
+
+def plot_stages_by_hour(hourly, output_dir):
+    """Save a stacked bar chart of the mean time spent in each stage per hour."""
+    stages = hourly[['mean_store_lookup', 'mean_patient_search', 'mean_write']].fillna(0)
+    stages.columns = ['Store lookup', 'Patient search', 'Write to Principle']
+    stages.plot(kind='bar', stacked=True, figsize=(12, 6))
+    plt.title('Mean Inbound Processing Time by Stage and Hour')
+    plt.xlabel('Hour of Day')
+    plt.ylabel('Seconds')
+    path = os.path.join(output_dir, 'inbound_stage_latency_by_hour.png')
+    plt.savefig(path)
+    print(f"Saved {path}")
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Analyze SMS logs for inbound pipeline latency")
+    parser.add_argument("--log-dir", nargs="+", default=["od_logs"], help="Directories containing SMS log files, one per site, optionally as site=path")
+    parser.add_argument("--output-dir", default=".", help="Directory to save output files")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    for site, log_dir in map(parse_site, args.log_dir):
+        if not os.path.isdir(log_dir):
+            print(f"Error: Log directory '{log_dir}' not found.")
+            sys.exit(1)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    df, webhooks = trace_inbound_messages(args.log_dir)
+    if len(df) == 0:
+        print("No SMSReceived events found in the logs")
+        sys.exit(0)
+
+    df = stage_latencies(df)
+    df['in_progress'] = inbound_in_progress(df)
+
+    analyze_inbound(df)
+    hourly = analyze_inbound_by_hour(df, webhooks)
+    analyze_inbound_under_load(df)
+    plot_stages_by_hour(hourly, args.output_dir)
+
+    messages_path = os.path.join(args.output_dir, 'inbound_messages.csv')
+    df.to_csv(messages_path, index=False)
+    print(f"Saved per-message stages to {messages_path}")
@@ -1,109 +1,133 @@
 import os
-import json
 import re
 import datetime
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-from pathlib import Path
 import numpy as np
 import argparse
+import csv
+import heapq
 import sys
+from collections import OrderedDict
+import sms_log_reader
+from sms_log_reader import MAX_IN_FLIGHT_SECONDS, extract_template, get_message_id, iter_log_entries, list_log_files, merge_log_sources, parse_site
+from sms_report_cache import Report, ReportCache, fingerprint_files, source_hash
 
-def parse_log_file(file_path):
-    """Parse a single log file and extract delivery time information."""
+# pandas, matplotlib and seaborn take most of a second to import, so the functions that use them
+# import them when called, and a report served entirely from the cache never loads them
+
+# Event types that mark a point in an outbound message's life: queued, handed to the provider, finished
+LIFECYCLE_EVENTS = {
+    'MessageQueued', 'SendAttempt', 'SendSuccess', 'MessageSent',
+    'SendFailure', 'SendFailed', 'SendException', 'DeliveryStatus', 'Timeout'
+}
+
+def parse_log_entries(log_entries, site=''):
+    """Extract delivery time, timeout, error and lifecycle records from decoded log entries."""
     results = []
     timeouts = []
     errors = []
+    events = []
     
-    with open(file_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
+    for log_entry in log_entries:
+        try:
+            # Extract timestamp for all entries; every record is placed in time, so entries without one are skipped
+            if 'Timestamp' not in log_entry:
                 continue
+            timestamp = datetime.datetime.fromisoformat(log_entry['Timestamp'].split('+')[0])
+            date = timestamp.date()
+            time_of_day = timestamp.time()
+            hour = timestamp.hour
+            
+            # Extract message ID
+            message_id = get_message_id(log_entry)
+            
+            # Keep the lifecycle events so queue and in-flight depth can be reconstructed
+            if log_entry.get('EventType') in LIFECYCLE_EVENTS and message_id:
+                status_match = re.search(r'Status: (\w+)', log_entry.get('Details', ''))
+                phone_match = re.search(r'(?:Number: |queued for |sent to )(\+?\d+)', log_entry.get('Details', ''))
+                events.append({
+                    'timestamp': timestamp,
+                    'message_id': message_id,
+                    'event_type': log_entry['EventType'],
+                    'status': status_match.group(1) if status_match else '',
+                    'phone_number': phone_match.group(1) if phone_match else '',
+                    'site': site
+                })
+            
+            # Check if this is a delivery status message with timing info
+            if (log_entry.get('EventType') == 'DeliveryStatus' and 
+                'Details' in log_entry and 
+                'Status: Delivered' in log_entry['Details']):
                 
-            try:
-                # Parse the JSON log entry
-                log_entry = json.loads(line)
+                # Extract phone number
+                phone_match = re.search(r'Number: (\+?\d+)', log_entry['Details'])
+                phone_number = phone_match.group(1) if phone_match else 'Unknown'
                 
-                # Extract timestamp for all entries
-                if 'Timestamp' in log_entry:
-                    timestamp = datetime.datetime.fromisoformat(log_entry['Timestamp'].split('+')[0])
-                    date = timestamp.date()
-                    time_of_day = timestamp.time()
-                    hour = timestamp.hour
-                    
-                    # Extract message ID
-                    message_id = log_entry.get('MessageId', '')
-                
-                # Check if this is a delivery status message with timing info
-                if (log_entry.get('EventType') == 'DeliveryStatus' and 
-                    'Details' in log_entry and 
-                    'Status: Delivered' in log_entry['Details']):
-                    
-                    # Extract phone number
-                    phone_match = re.search(r'Number: (\+?\d+)', log_entry['Details'])
-                    phone_number = phone_match.group(1) if phone_match else 'Unknown'
+                # Extract delivery time
+                delivery_time_match = re.search(r'Delivery Time: (\d+\.\d+|\d+)', log_entry['Details'])
+                if delivery_time_match:
+                    delivery_time = float(delivery_time_match.group(1))
                     
-                    # Extract delivery time
-                    delivery_time_match = re.search(r'Delivery Time: (\d+\.\d+|\d+)', log_entry['Details'])
-                    if delivery_time_match:
-                        delivery_time = float(delivery_time_match.group(1))
-                        
-                        results.append({
-                            'timestamp': timestamp,
-                            'date': date,
-                            'time': time_of_day,
-                            'hour': hour,
-                            'message_id': message_id,
-                            'phone_number': phone_number,
-                            'delivery_time': delivery_time
-                        })
-                
-                # Check for timeout messages
-                elif 'timeout' in log_entry.get('Details', '').lower() or 'Timeout' in log_entry.get('EventType', ''):
-                    provider = log_entry.get('Provider', 'Unknown')
-                    details = log_entry.get('Details', '')
-                    
-                    timeouts.append({
+                    results.append({
                         'timestamp': timestamp,
                         'date': date,
                         'time': time_of_day,
                         'hour': hour,
                         'message_id': message_id,
-                        'provider': provider,
-                        'details': details
+                        'phone_number': phone_number,
+                        'delivery_time': delivery_time,
+                        'site': site
                     })
+            
+            # Check for timeout messages
+            elif 'timeout' in log_entry.get('Details', '').lower() or 'Timeout' in log_entry.get('EventType', ''):
+                provider = log_entry.get('Provider', 'Unknown')
+                details = log_entry.get('Details', '')
                 
-                # Check for error messages
-                elif (log_entry.get('Level') == 'ERROR' or 
-                      'error' in log_entry.get('Details', '').lower() or
-                      'failed' in log_entry.get('Details', '').lower() or
-                      'fail' in log_entry.get('EventType', '').lower()):
-                    
-                    provider = log_entry.get('Provider', 'Unknown')
-                    details = log_entry.get('Details', '')
-                    level = log_entry.get('Level', '')
-                    event_type = log_entry.get('EventType', '')
-                    
-                    errors.append({
-                        'timestamp': timestamp,
-                        'date': date,
-                        'time': time_of_day,
-                        'hour': hour,
-                        'message_id': message_id,
-                        'provider': provider,
-                        'level': level,
-                        'event_type': event_type,
-                        'details': details
-                    })
-                    
-            except (json.JSONDecodeError, KeyError, ValueError) as e:
-                continue  # Skip malformed lines
+                timeouts.append({
+                    'timestamp': timestamp,
+                    'date': date,
+                    'time': time_of_day,
+                    'hour': hour,
+                    'message_id': message_id,
+                    'provider': provider,
+                    'details': details,
+                    'site': site
+                })
+            
+            # Check for error messages
+            elif (log_entry.get('Level') == 'ERROR' or 
+                  'error' in log_entry.get('Details', '').lower() or
+                  'failed' in log_entry.get('Details', '').lower() or
+                  'fail' in log_entry.get('EventType', '').lower()):
+                
+                provider = log_entry.get('Provider', 'Unknown')
+                details = log_entry.get('Details', '')
+                level = log_entry.get('Level', '')
+                event_type = log_entry.get('EventType', '')
+                
+                errors.append({
+                    'timestamp': timestamp,
+                    'date': date,
+                    'time': time_of_day,
+                    'hour': hour,
+                    'message_id': message_id,
+                    'provider': provider,
+                    'level': level,
+                    'event_type': event_type,
+                    'details': details,
+                    'site': site
+                })
                 
-    return results, timeouts, errors
+        except (KeyError, ValueError) as e:
+            continue  # Skip malformed lines
+            
+    return results, timeouts, errors, events
 
-def find_missing_deliveries(log_dir):
+def parse_log_file(file_path, site=''):
+    """Parse a single log file and extract delivery time information."""
+    return parse_log_entries(iter_log_entries(file_path), site)
+
+def find_missing_deliveries(log_dirs):
     """Find messages that were sent but have no corresponding delivery status record."""
     print("\n===== MISSING DELIVERY ANALYSIS =====")
     
@@ -111,47 +135,34 @@ def find_missing_deliveries(log_dir):
     sent_messages = {}  # message_id -> details
     delivered_messages = set()  # set of message IDs
     
-    # Process all log files
-    log_files = [f for f in os.listdir(log_dir) if f.startswith('SMS_Log_')]
-    
-    for log_file in log_files:
-        file_path = os.path.join(log_dir, log_file)
-        
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                try:
-                    # Parse JSON log entry
-                    log_entry = json.loads(line)
+    # Process all log files of every site
+    for site, log_dir in map(parse_site, log_dirs):
+        for file_path in list_log_files(log_dir):
+            log_file = os.path.basename(file_path)
+            
+            for log_entry in iter_log_entries(file_path):
+                # Track sent messages
+                if log_entry.get('EventType') == 'SendSuccess':
+                    message_id = get_message_id(log_entry)
+                    timestamp = log_entry.get('Timestamp', '')
+                    details = log_entry.get('Details', '')
                     
-                    # Track sent messages
-                    if log_entry.get('EventType') == 'SendSuccess':
-                        message_id = log_entry.get('MessageId', '')
-                        timestamp = log_entry.get('Timestamp', '')
-                        details = log_entry.get('Details', '')
-                        
-                        # Extract phone number
-                        phone_match = re.search(r'PhoneNumber: (\+?\d+)', details)
-                        phone = phone_match.group(1) if phone_match else 'Unknown'
-                        
-                        if message_id:
-                            sent_messages[message_id] = {
-                                'timestamp': timestamp,
-                                'phone': phone,
-                                'file': log_file
-                            }
+                    # Extract phone number
+                    phone_match = re.search(r'PhoneNumber: (\+?\d+)', details)
+                    phone = phone_match.group(1) if phone_match else 'Unknown'
                     
-                    # Track delivered messages
-                    elif log_entry.get('EventType') == 'DeliveryStatus' and 'Status: Delivered' in log_entry.get('Details', ''):
-                        message_id = log_entry.get('MessageId', '')
-                        if message_id:
-                            delivered_messages.add(message_id)
+                    if message_id:
+                        sent_messages[message_id] = {
+                            'timestamp': timestamp,
+                            'phone': phone,
+                            'file': log_file
+                        }
                 
-                except (json.JSONDecodeError, KeyError):
-                    continue
+                # Track delivered messages
+                elif log_entry.get('EventType') == 'DeliveryStatus' and 'Status: Delivered' in log_entry.get('Details', ''):
+                    message_id = get_message_id(log_entry)
+                    if message_id:
+                        delivered_messages.add(message_id)
     
     # Find messages sent but not delivered
     missing_deliveries = {msg_id: details for msg_id, details in sent_messages.items() 
@@ -172,67 +183,241 @@ def find_missing_deliveries(log_dir):
     
     return missing_deliveries
 
-def analyze_logs(log_dir):
-    """Process all log files in the directory and analyze delivery times."""
+def stream_missing_deliveries(log_dirs, watermark_hours, output_path, remember_emitted=100_000):
+    """Find sends with no delivery confirmation in one time-ordered pass with a watermark.
+
+    Sends wait in an insertion-ordered dict, oldest first. Once the log stream has moved more
+    than watermark_hours past a send without seeing it delivered, the send is written to
+    output_path as missing and forgotten, so memory is bounded by the sends inside the window
+    rather than the whole history. Sends still inside the window at the end of the logs are
+    written as pending. Several sites are merged into one time-ordered stream.
+
+    The IDs of the last remember_emitted sends written out are kept, so a SendSuccess logged
+    again for a message already reported missing is not counted or reported a second time.
+    """
+    print(f"\n===== MISSING DELIVERY ANALYSIS (STREAMING, {watermark_hours:g}h WATERMARK) =====")
+    
+    watermark = datetime.timedelta(hours=watermark_hours)
+    pending = OrderedDict()  # message_id -> (sent time, details), oldest send first
+    emitted = OrderedDict()  # message IDs already written as missing, oldest first
+    total_sent = 0
+    delivered_count = 0
+    unmatched_deliveries = 0
+    repeated_sends = 0
+    missing_count = 0
+    samples = []
+    
+    # Line buffered, so missing messages reach the file as they are found
+    with open(output_path, 'w', newline='', encoding='utf-8', buffering=1) as out:
+        writer = csv.writer(out)
+        writer.writerow(['message_id', 'timestamp', 'phone', 'site', 'status'])
+        
+        def emit(message_id, details, status):
+            writer.writerow([message_id, details['timestamp'], details['phone'], details['site'], status])
+            if len(samples) < 10 and status == 'missing':
+                samples.append((message_id, details))
+        
+        for now, site, log_entry in merge_log_sources(log_dirs):
+            # Everything sent before the watermark has had its chance to be delivered
+            while pending:
+                oldest_id, (sent_at, details) = next(iter(pending.items()))
+                if now - sent_at <= watermark:
+                    break
+                pending.popitem(last=False)
+                emit(oldest_id, details, 'missing')
+                missing_count += 1
+                emitted[oldest_id] = None
+                if len(emitted) > remember_emitted:
+                    emitted.popitem(last=False)
+            
+            message_id = get_message_id(log_entry)
+            if not message_id:
+                continue
+            
+            if log_entry.get('EventType') == 'SendSuccess':
+                if message_id in emitted:
+                    repeated_sends += 1
+                elif message_id not in pending:
+                    phone_match = re.search(r'PhoneNumber: (\+?\d+)', log_entry.get('Details', ''))
+                    pending[message_id] = (now, {
+                        'timestamp': log_entry['Timestamp'],
+                        'phone': phone_match.group(1) if phone_match else 'Unknown',
+                        'site': site
+                    })
+                    total_sent += 1
+            
+            elif log_entry.get('EventType') == 'DeliveryStatus' and 'Status: Delivered' in log_entry.get('Details', ''):
+                if pending.pop(message_id, None) is not None:
+                    delivered_count += 1
+                else:
+                    # Delivered after its send passed the watermark, or sent before the first log
+                    unmatched_deliveries += 1
+        
+        for message_id, (sent_at, details) in pending.items():
+            emit(message_id, details, 'pending')
+    
+    print(f"Total messages sent: {total_sent}")
+    print(f"Messages with delivery confirmation inside the watermark: {delivered_count}")
+    if total_sent:
+        print(f"Messages missing delivery confirmation: {missing_count} ({100 * missing_count / total_sent:.2f}% of sent messages)")
+    print(f"Messages still inside the watermark at the end of the logs: {len(pending)}")
+    print(f"Deliveries with no pending send (late or sent before the first log): {unmatched_deliveries}")
+    if repeated_sends:
+        print(f"Sends logged again after being reported missing (not counted twice): {repeated_sends}")
+    print(f"Missing and pending messages written to {output_path}")
+    
+    if samples:
+        print("\nSample of Messages Missing Delivery Confirmation:")
+        for msg_id, details in samples:
+            print(f"ID: {msg_id}, Timestamp: {details['timestamp']}, Phone: {details['phone']}, Site: {details['site']}")
+    
+    return missing_count
+
+def load_log_data(log_dirs, cache=None):
+    """Parse every log file of every site into delivery, timeout, error and lifecycle event frames.
+
+    With a ReportCache, each day's parsed entries are kept under that file's fingerprint, so only
+    days whose log changed since the last run, usually just today, are parsed again.
+    """
+    import pandas as pd
+    parser_hash = source_hash([sms_log_reader, parse_log_file, parse_log_entries]) if cache else None
     all_results = []
     all_timeouts = []
     all_errors = []
+    all_events = []
     
-    # Find all SMS log files
-    log_files = [f for f in os.listdir(log_dir) if f.startswith('SMS_Log_')]
-    
-    if not log_files:
-        print(f"No SMS log files found in {log_dir}")
-        return None, None, None
-    
-    print(f"Found {len(log_files)} SMS log files to process")
-    
-    # Parse each log file
-    for log_file in log_files:
-        file_path = os.path.join(log_dir, log_file)
-        results, timeouts, errors = parse_log_file(file_path)
+    for site, log_dir in map(parse_site, log_dirs):
+        # Find all SMS log files
+        log_files = list_log_files(log_dir)
         
-        # Extract date from filename (SMS_Log_YYYYMMDD.log)
-        date_match = re.search(r'SMS_Log_(\d{8})', log_file)
-        log_date = date_match.group(1) if date_match else "Unknown"
+        if not log_files:
+            print(f"No SMS log files found in {log_dir}")
+            continue
         
-        all_results.extend(results)
-        all_timeouts.extend(timeouts)
-        all_errors.extend(errors)
+        print(f"Found {len(log_files)} SMS log files to process for {site}")
         
-        print(f"Processed {log_file} ({log_date}): {len(results)} delivery records, {len(timeouts)} timeouts, {len(errors)} errors")
-    
-    # Process delivery times
-    if all_results:
-        df_deliveries = pd.DataFrame(all_results)
+        # Parse each log file
+        for file_path in log_files:
+            log_file = os.path.basename(file_path)
+            key = fingerprint_files([file_path], site, os.path.abspath(log_dir), parser_hash) if cache else None
+            parsed = cache.get(key) if cache else None
+            if parsed is None:
+                parsed = parse_log_file(file_path, site)
+                if cache:
+                    cache.put(key, parsed)
+            results, timeouts, errors, events = parsed
+            
+            # Extract date from filename (SMS_Log_YYYYMMDD.log)
+            date_match = re.search(r'SMS_Log_(\d{8})', log_file)
+            log_date = date_match.group(1) if date_match else "Unknown"
+            
+            all_results.extend(results)
+            all_timeouts.extend(timeouts)
+            all_errors.extend(errors)
+            all_events.extend(events)
+            
+            print(f"Processed {log_file} ({log_date}): {len(results)} delivery records, {len(timeouts)} timeouts, {len(errors)} errors")
+    
+    # Lifecycle events feed the timestamp-derived latencies and the load and recipient analyses
+    df_events = pd.DataFrame(all_events) if all_events else None
+    df_deliveries = pd.DataFrame(all_results) if all_results else None
+    df_deliveries = derive_delivery_latencies(df_deliveries, df_events)
+    if df_deliveries is not None and len(df_deliveries) == 0:
+        df_deliveries = None
+    df_timeouts = pd.DataFrame(all_timeouts) if all_timeouts else None
+    df_errors = pd.DataFrame(all_errors) if all_errors else None
+    return df_deliveries, df_timeouts, df_errors, df_events
+
+def report_delivery_times(df_deliveries):
+    """Analyze delivery times, or say there were none."""
+    if df_deliveries is not None:
         analyze_delivery_times(df_deliveries)
     else:
         print("No delivery time data found in the logs")
-        df_deliveries = None
-    
-    # Process timeouts
-    if all_timeouts:
-        df_timeouts = pd.DataFrame(all_timeouts)
+
+def report_timeouts(df_timeouts):
+    """Analyze timeouts, or say there were none."""
+    if df_timeouts is not None:
         analyze_timeouts(df_timeouts)
     else:
         print("No timeouts found in the logs")
-        df_timeouts = None
-    
-    # Process errors
-    if all_errors:
-        df_errors = pd.DataFrame(all_errors)
-        analyze_errors(df_errors)
+
+def report_errors(df_errors, output_dir="."):
+    """Analyze errors, or say there were none."""
+    if df_errors is not None:
+        analyze_errors(df_errors, output_dir)
     else:
         print("No errors found in the logs")
-        df_errors = None
-    
-    return df_deliveries, df_timeouts, df_errors
+
+def analyze_logs(log_dirs, output_dir="."):
+    """Process all log files in the directories and analyze delivery times."""
+    df_deliveries, df_timeouts, df_errors, df_events = load_log_data(log_dirs)
+    if all(df is None for df in (df_deliveries, df_timeouts, df_errors, df_events)):
+        return None, None, None, None
+    
+    report_delivery_times(df_deliveries)
+    report_timeouts(df_timeouts)
+    report_errors(df_errors, output_dir)
+    return df_deliveries, df_timeouts, df_errors, df_events
+
+def derive_delivery_latencies(df_deliveries, df_events):
+    """Time deliveries whose Details carry no Delivery Time from their send and delivery events.
+
+    Sends (SendSuccess/MessageSent) and Delivered statuses are joined on message ID as whole
+    columns, so this stays vectorized over millions of rows. Every row gets a latency_source:
+    'details' when the provider logged the delivery time, 'timestamps' when it was derived here.
+    """
+    import pandas as pd
+    if df_deliveries is not None:
+        df_deliveries['latency_source'] = 'details'
+    if df_events is None or len(df_events) == 0:
+        return df_deliveries
+    
+    sends = df_events[df_events['event_type'].isin(['SendSuccess', 'MessageSent'])]
+    sent_at = sends.groupby('message_id')['timestamp'].min().rename('sent_at')
+    
+    delivered = df_events[(df_events['event_type'] == 'DeliveryStatus') & (df_events['status'] == 'Delivered')]
+    delivered = delivered.groupby('message_id').agg(timestamp=('timestamp', 'min'), phone_number=('phone_number', 'first'), site=('site', 'first'))
+    
+    joined = delivered.join(sent_at, how='inner')
+    if df_deliveries is not None:
+        joined = joined[~joined.index.isin(df_deliveries['message_id'])]
+    joined['delivery_time'] = (joined['timestamp'] - joined['sent_at']).dt.total_seconds()
+    joined = joined[joined['delivery_time'] >= 0]
+    if len(joined) == 0:
+        return df_deliveries
+    
+    timestamps = joined['timestamp']
+    derived = pd.DataFrame({
+        'timestamp': timestamps,
+        'date': timestamps.dt.date,
+        'time': timestamps.dt.time,
+        'hour': timestamps.dt.hour,
+        'message_id': joined.index,
+        'phone_number': joined['phone_number'].replace('', 'Unknown'),
+        'delivery_time': joined['delivery_time'],
+        'site': joined['site'],
+        'latency_source': 'timestamps'
+    }).reset_index(drop=True)
+    
+    if df_deliveries is None:
+        return derived
+    return pd.concat([df_deliveries, derived], ignore_index=True)
 
 def analyze_delivery_times(df):
     """Analyze the distribution of delivery times."""
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     print("\n===== DELIVERY TIME ANALYSIS =====")
     print(f"Total messages analyzed: {len(df)}")
     
+    # Where each latency value came from: the Details text or the send/delivery timestamps
+    if 'latency_source' in df.columns:
+        print("\nLatency Source:")
+        for source, count in df['latency_source'].value_counts().items():
+            print(f"{source}: {count} messages ({100 * count / len(df):.2f}%)")
+    
     # Basic statistics
     print("\nDelivery Time Statistics:")
     print(f"Mean delivery time: {df['delivery_time'].mean():.2f} seconds")
@@ -293,12 +478,11 @@ def analyze_delivery_times(df):
         
         # Check if specific phone numbers have consistently slow deliveries
         print("\nPhone Numbers with Multiple Slow Deliveries:")
-        phone_counts = tail_df['phone_number'].value_counts()
-        multiple_slow = phone_counts[phone_counts > 1]
-        for phone, count in multiple_slow.items():
-            percentage = 100 * count / len(tail_df)
-            avg_time = tail_df[tail_df['phone_number'] == phone]['delivery_time'].mean()
-            print(f"Phone {phone}: {count} slow deliveries ({percentage:.2f}% of slow deliveries), avg time: {avg_time:.2f}s")
+        slow_by_phone = tail_df.groupby('phone_number')['delivery_time'].agg(['count', 'mean'])
+        multiple_slow = slow_by_phone[slow_by_phone['count'] > 1].sort_values('count', ascending=False)
+        for phone, row in multiple_slow.iterrows():
+            percentage = 100 * row['count'] / len(tail_df)
+            print(f"Phone {phone}: {int(row['count'])} slow deliveries ({percentage:.2f}% of slow deliveries), avg time: {row['mean']:.2f}s")
     
     # Create visualizations
     plt.figure(figsize=(10, 6))
@@ -342,6 +526,8 @@ def analyze_delivery_times(df):
 
 def analyze_timeouts(df):
     """Analyze timeout messages."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     print("\n===== TIMEOUT ANALYSIS =====")
     print(f"Total timeouts found: {len(df)}")
     
@@ -380,8 +566,10 @@ def analyze_timeouts(df):
     plt.ylabel('Number of Timeouts')
     plt.savefig('timeouts_by_hour.png')
 
-def analyze_errors(df):
+def analyze_errors(df, output_dir="."):
     """Analyze error messages."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     print("\n===== ERROR ANALYSIS =====")
     print(f"Total errors found: {len(df)}")
     
@@ -419,6 +607,17 @@ def analyze_errors(df):
     for _, row in samples.iterrows():
         print(f"[{row['timestamp']}] [{row['level']}] {row['event_type']}: {row['details']}")
     
+    # Recurring failure modes, with the variable parts of Details masked out
+    signatures = mine_error_signatures(df)
+    print(f"\nError Signatures ({len(signatures)} distinct):")
+    for _, row in signatures.head(15).iterrows():
+        percentage = 100 * row['count'] / len(df)
+        print(f"{row['count']} errors ({percentage:.2f}%), {row['first_seen']} to {row['last_seen']}: {row['signature']}")
+        print(f"    e.g. {row['examples'][0]}")
+    signatures_path = os.path.join(output_dir, 'error_signatures.csv')
+    signatures.to_csv(signatures_path, index=False)
+    print(f"Saved error signatures to {signatures_path}")
+    
     # Visualize errors by hour
     plt.figure(figsize=(12, 6))
     sns.countplot(x='hour', data=df)
@@ -427,8 +626,41 @@ def analyze_errors(df):
     plt.ylabel('Number of Errors')
     plt.savefig('errors_by_hour.png')
 
+def mine_error_signatures(df, max_signatures=1000, examples_per_signature=3):
+    """Group error Details into signatures in one pass over the rows.
+
+    A signature is the event type plus the Details template with numbers, phone numbers, IDs
+    and GUIDs masked out. Memory is bounded: at most max_signatures are tracked, each with a
+    few example lines, and anything new beyond that is counted under a single overflow row.
+    """
+    import pandas as pd
+    overflow_key = '<other signatures>'
+    signatures = {}
+    
+    for timestamp, event_type, details in zip(df['timestamp'], df['event_type'], df['details']):
+        template, _ = extract_template(details)
+        key = f"{event_type}: {template}"
+        signature = signatures.get(key)
+        if signature is None:
+            if len(signatures) >= max_signatures:
+                key = overflow_key
+                signature = signatures.get(key)
+            if signature is None:
+                signature = signatures[key] = {'count': 0, 'first_seen': timestamp, 'last_seen': timestamp, 'examples': []}
+        
+        signature['count'] += 1
+        signature['first_seen'] = min(signature['first_seen'], timestamp)
+        signature['last_seen'] = max(signature['last_seen'], timestamp)
+        if len(signature['examples']) < examples_per_signature and details not in signature['examples']:
+            signature['examples'].append(details)
+    
+    rows = [{'signature': key, **stats} for key, stats in signatures.items()]
+    return pd.DataFrame(rows, columns=['signature', 'count', 'first_seen', 'last_seen', 'examples']).sort_values('count', ascending=False)
+
 def check_for_correlations(df_deliveries):
     """Check for correlations between delivery time and other factors."""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
     if df_deliveries is None or len(df_deliveries) == 0:
         return
     
@@ -473,13 +705,215 @@ def check_for_correlations(df_deliveries):
     plt.ylabel('Delivery Time (seconds)')
     plt.savefig('delivery_time_vs_hour_regplot.png')
 
+def summarise_message_lifecycles(df_events):
+    """Collapse lifecycle events into one row per message with its queued, sent and finished times."""
+    import pandas as pd
+    first_seen = df_events.groupby(['message_id', 'event_type'])['timestamp'].min().unstack()
+
+    def first_of(*event_types):
+        columns = [c for c in event_types if c in first_seen.columns]
+        if not columns:
+            return pd.Series(pd.NaT, index=first_seen.index, dtype='datetime64[ns]')
+        return first_seen[columns].min(axis=1)
+
+    lifecycles = pd.DataFrame(index=first_seen.index)
+    lifecycles['queued_at'] = first_of('MessageQueued')
+    lifecycles['dequeued_at'] = first_of('SendAttempt', 'SendSuccess', 'MessageSent', 'SendFailure', 'SendFailed', 'SendException')
+    lifecycles['sent_at'] = first_of('SendSuccess', 'MessageSent')
+    lifecycles['finished_at'] = first_of('DeliveryStatus', 'Timeout')
+
+    phones = df_events[df_events['phone_number'] != ''].groupby('message_id')['phone_number'].first()
+    lifecycles['phone_number'] = phones.reindex(lifecycles.index).fillna('Unknown')
+    lifecycles['site'] = df_events.groupby('message_id')['site'].first()
+
+    # Same outcome rules as logs/analyse_delivery_logs.py: no final status means we gave up
+    status_events = df_events[df_events['event_type'] == 'DeliveryStatus']
+    delivered = lifecycles.index.isin(status_events.loc[status_events['status'] == 'Delivered', 'message_id'])
+    failed = lifecycles.index.isin(pd.concat([
+        status_events.loc[status_events['status'] == 'Failed', 'message_id'],
+        df_events.loc[df_events['event_type'].isin(['SendFailure', 'SendFailed', 'SendException']), 'message_id']
+    ]))
+    lifecycles['outcome'] = np.select([delivered, failed], ['Delivered', 'Failed'], 'Gave up trying')
+    return lifecycles
+
+def reconstruct_load(lifecycles, max_in_flight_seconds=MAX_IN_FLIGHT_SECONDS):
+    """Sweep over the queued and in-flight intervals of every message.
+
+    Each interval contributes a +1 at its start and a -1 at its end. Sorting all the
+    boundaries once and taking running sums gives the queued and in-flight depth after
+    every event in O(n log n). Intervals that never close are capped at
+    max_in_flight_seconds, which is when the provider would have given up.
+    """
+    import pandas as pd
+    cap = pd.Timedelta(seconds=max_in_flight_seconds)
+
+    queued = lifecycles.dropna(subset=['queued_at'])
+    queued_start = queued['queued_at']
+    queued_end = queued['dequeued_at'].fillna(queued_start + cap).clip(lower=queued_start)
+
+    in_flight = lifecycles.dropna(subset=['sent_at'])
+    flight_start = in_flight['sent_at']
+    flight_end = in_flight['finished_at'].fillna(flight_start + cap).clip(lower=flight_start)
+
+    nq, nf = len(queued), len(in_flight)
+    times = np.concatenate([
+        queued_start.to_numpy(dtype='datetime64[ns]'), queued_end.to_numpy(dtype='datetime64[ns]'),
+        flight_start.to_numpy(dtype='datetime64[ns]'), flight_end.to_numpy(dtype='datetime64[ns]')
+    ])
+    queued_delta = np.concatenate([np.ones(nq), -np.ones(nq), np.zeros(2 * nf)]).astype(int)
+    flight_delta = np.concatenate([np.zeros(2 * nq), np.ones(nf), -np.ones(nf)]).astype(int)
+
+    # Sort by time, and at equal times let intervals close before new ones open
+    is_start = (queued_delta + flight_delta) > 0
+    order = np.lexsort((is_start, times))
+
+    return pd.DataFrame({
+        'queued': np.cumsum(queued_delta[order]),
+        'in_flight': np.cumsum(flight_delta[order])
+    }, index=pd.DatetimeIndex(times[order], name='timestamp'))
+
+def depth_at(load, times):
+    """Look up the queued and in-flight depth in effect at each of the given times."""
+    positions = np.searchsorted(load.index.to_numpy(), np.asarray(times, dtype='datetime64[ns]'), side='right') - 1
+    depth = load.iloc[np.clip(positions, 0, None)].reset_index(drop=True)
+    depth.loc[positions < 0, :] = 0
+    return depth
+
+def analyze_latency_vs_load(df_deliveries, df_events):
+    """Relate delivery time to the number of messages queued and in flight when each message was sent."""
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if df_deliveries is None or len(df_deliveries) == 0 or df_events is None or len(df_events) == 0:
+        print("No lifecycle events found for the load analysis")
+        return None
+
+    print("\n===== LATENCY VS LOAD ANALYSIS =====")
+
+    lifecycles = summarise_message_lifecycles(df_events)
+    print(f"Messages with lifecycle events: {len(lifecycles)}")
+
+    # Join each delivery to its send time, falling back to delivery timestamp minus delivery time
+    df = df_deliveries[['message_id', 'timestamp', 'delivery_time', 'site']].copy()
+    sent_at = df['message_id'].map(lifecycles['sent_at'])
+    fallback = pd.to_datetime(df['timestamp']) - pd.to_timedelta(df['delivery_time'], unit='s')
+    df['sent_at'] = sent_at.fillna(fallback)
+    df['queued_at_send'] = 0
+    df['in_flight_at_send'] = 0
+
+    # Each site runs its own bridge and queue, so its load is reconstructed separately
+    for site, site_lifecycles in lifecycles.groupby('site'):
+        load = reconstruct_load(site_lifecycles)
+        label = f" for {site}" if site else ""
+        print(f"Peak queue depth{label}: {load['queued'].max()} (at {load['queued'].idxmax()})")
+        print(f"Peak in-flight depth{label}: {load['in_flight'].max()} (at {load['in_flight'].idxmax()})")
+
+        rows = df['site'] == site
+        depth = depth_at(load, df.loc[rows, 'sent_at'])
+        df.loc[rows, 'queued_at_send'] = depth['queued'].to_numpy()
+        df.loc[rows, 'in_flight_at_send'] = depth['in_flight'].to_numpy()
+
+    # Depth at send time includes the message itself
+    bins = [0, 1, 2, 3, 5, 10, 20, 50, float('inf')]
+    labels = ['1', '2', '3', '4-5', '6-10', '11-20', '21-50', '>50']
+    df['in_flight_bucket'] = pd.cut(df['in_flight_at_send'], bins=bins, labels=labels)
+    df['queued_bucket'] = pd.cut(df['queued_at_send'], bins=[-1] + bins, labels=['0'] + labels)
+
+    def latency_stats(column):
+        stats = df.groupby(column, observed=True)['delivery_time'].agg(['count', 'mean', 'median'])
+        stats['p95'] = df.groupby(column, observed=True)['delivery_time'].quantile(0.95)
+        return stats
+
+    print("\nDelivery Time by Messages In Flight at Send Time:")
+    print(latency_stats('in_flight_bucket'))
+
+    print("\nDelivery Time by Queue Depth at Send Time:")
+    print(latency_stats('queued_bucket'))
+
+    if df['in_flight_at_send'].nunique() > 1:
+        flight_corr = np.corrcoef(df['in_flight_at_send'], df['delivery_time'])[0, 1]
+        print(f"\nCorrelation between in-flight depth and delivery time: {flight_corr:.4f}")
+    if df['queued_at_send'].nunique() > 1:
+        queued_corr = np.corrcoef(df['queued_at_send'], df['delivery_time'])[0, 1]
+        print(f"Correlation between queue depth and delivery time: {queued_corr:.4f}")
+
+    plt.figure(figsize=(12, 6))
+    sns.boxplot(x='in_flight_bucket', y='delivery_time', data=df)
+    plt.title('Delivery Time by Messages In Flight at Send Time')
+    plt.xlabel('Messages In Flight')
+    plt.ylabel('Delivery Time (seconds)')
+    plt.savefig('delivery_time_vs_load.png')
+
+    return df
+
+def build_recipient_profiles(df_deliveries, lifecycles, tail_threshold):
+    """Build one latency and outcome profile row per recipient phone number in a single grouped pass."""
+    latency = df_deliveries.groupby('phone_number')['delivery_time']
+    profiles = latency.agg(deliveries='count', mean='mean', p50='median')
+    profiles['p95'] = latency.quantile(0.95)
+    profiles['slow'] = (df_deliveries['delivery_time'] >= tail_threshold).groupby(df_deliveries['phone_number']).sum()
+    profiles['slow_share'] = profiles['slow'] / profiles['deliveries']
+
+    if lifecycles is not None:
+        outcomes = lifecycles.groupby(['phone_number', 'outcome']).size().unstack(fill_value=0)
+        outcomes = outcomes.reindex(columns=['Delivered', 'Failed', 'Gave up trying'], fill_value=0)
+        outcomes.columns = ['delivered', 'failed', 'gave_up']
+        profiles = profiles.join(outcomes, how='outer')
+
+    profiles = profiles.drop(index='Unknown', errors='ignore')
+    count_columns = [c for c in ['deliveries', 'slow', 'delivered', 'failed', 'gave_up'] if c in profiles.columns]
+    profiles[count_columns] = profiles[count_columns].fillna(0).astype(int)
+    for column in ['failed', 'gave_up']:
+        if column not in profiles.columns:
+            profiles[column] = 0
+    profiles.index.name = 'phone_number'
+    return profiles
+
+def worst_recipients(profiles, k):
+    """Pick the k recipients with the most problems (slow, failed or gave up), worst p95 first on ties."""
+    def badness(row):
+        p95 = row.p95 if row.p95 == row.p95 else 0.0  # NaN when nothing was delivered
+        return (row.slow + row.failed + row.gave_up, p95)
+
+    return heapq.nlargest(k, profiles.itertuples(), key=badness)
+
+def analyze_recipients(df_deliveries, df_events, output_dir=".", top_k=20, tail_percent=5.0):
+    """Print per-recipient latency profiles and the worst recipients.
+
+    A delivery counts as slow when it is in the slowest tail_percent of all deliveries.
+    """
+    print("\n===== RECIPIENT ANALYSIS =====")
+
+    lifecycles = summarise_message_lifecycles(df_events) if df_events is not None and len(df_events) > 0 else None
+    tail_threshold = df_deliveries['delivery_time'].quantile(1 - tail_percent / 100)
+    profiles = build_recipient_profiles(df_deliveries, lifecycles, tail_threshold)
+
+    print(f"Recipients profiled: {len(profiles)}")
+    profiles_path = os.path.join(output_dir, 'recipient_profiles.csv')
+    profiles.to_csv(profiles_path)
+    print(f"Saved full profiles to {profiles_path}")
+
+    print(f"\nWorst {top_k} Recipients (slow >= {tail_threshold:.2f}s, failed or gave up):")
+    for row in worst_recipients(profiles, top_k):
+        print(f"Phone {row.Index}: {row.deliveries} deliveries, p50 {row.p50:.2f}s, p95 {row.p95:.2f}s, "
+              f"slow {100 * row.slow_share:.1f}%, failed {row.failed}, gave up {row.gave_up}")
+
+    return profiles
+
 def parse_arguments():
     """Parse command line arguments"""
     parser = argparse.ArgumentParser(description="Analyze SMS logs for delivery time patterns")
-    parser.add_argument("--log-dir", default="od_logs", help="Directory containing SMS log files")
+    parser.add_argument("--log-dir", nargs="+", default=["od_logs"], help="Directories containing SMS log files, one per site, optionally as site=path")
     parser.add_argument("--missing-deliveries", action="store_true", help="Analyze messages sent but missing delivery confirmation")
+    parser.add_argument("--watermark-hours", type=float, help="Stream the missing delivery analysis, treating sends older than this many hours as missing")
+    parser.add_argument("--load-analysis", action="store_true", help="Relate delivery time to queue and in-flight depth at send time")
     parser.add_argument("--tail-percent", type=float, default=5.0, help="Percentile threshold for identifying the tail of slow deliveries (default: 5.0)")
     parser.add_argument("--output-dir", default=".", help="Directory to save output files")
+    parser.add_argument("--top-recipients", type=int, default=20, help="Number of worst recipients to list (default: 20)")
+    parser.add_argument("--report", default="sms_report.html", help="Name of the single-file HTML report in the output directory")
+    parser.add_argument("--cache-dir", help="Directory of memoized report sections and parsed days (default: .report_cache in the output directory)")
+    parser.add_argument("--cache-size-mb", type=float, default=1024, help="Evict the least recently used sections beyond this size (default: 1024)")
+    parser.add_argument("--no-cache", action="store_true", help="Recompute every section without reading or writing the cache")
     
     return parser.parse_args()
 
@@ -487,27 +921,72 @@ if __name__ == "__main__":
     # Parse command line arguments
     args = parse_arguments()
     
-    # Use the specified logs directory
-    log_dir = args.log_dir
+    # Use the specified logs directories
+    log_dirs = args.log_dir
     
-    # Check if directory exists
-    if not os.path.isdir(log_dir):
-        print(f"Error: Log directory '{log_dir}' not found.")
-        sys.exit(1)
+    # Check the directories exist
+    for site, log_dir in map(parse_site, log_dirs):
+        if not os.path.isdir(log_dir):
+            print(f"Error: Log directory '{log_dir}' not found.")
+            sys.exit(1)
     
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
     
+    # Sections are memoized on the log files' names, sizes and modification times plus their options,
+    # and on the source of the shared log reader that decodes them. Sites are keyed on absolute
+    # paths, so the same logs hit the cache however their directories were given.
+    cache = None if args.no_cache else ReportCache(args.cache_dir or os.path.join(args.output_dir, '.report_cache'), int(args.cache_size_mb * 1024 ** 2))
+    report = Report(cache)
+    sites = [(site, os.path.abspath(log_dir)) for site, log_dir in map(parse_site, log_dirs)]
+    log_files = [path for site, log_dir in sites for path in list_log_files(log_dir)]
+    fingerprint = fingerprint_files(log_files, sites, source_hash([sms_log_reader]))
+    
     # Check for missing deliveries if requested
     if args.missing_deliveries:
-        missing = find_missing_deliveries(log_dir)
-    
-    # Analyze delivery times
-    df_deliveries, df_timeouts, df_errors = analyze_logs(log_dir)
+        if args.watermark_hours is not None:
+            output_path = os.path.join(args.output_dir, 'missing_deliveries.csv')
+            report.section("Missing Deliveries", lambda: stream_missing_deliveries(log_dirs, args.watermark_hours, output_path),
+                           fingerprint, {'watermark_hours': args.watermark_hours}, code=[stream_missing_deliveries], outputs=[output_path])
+        else:
+            report.section("Missing Deliveries", lambda: find_missing_deliveries(log_dirs), fingerprint, code=[find_missing_deliveries])
+    
+    # The parsed frames are only loaded when a section below has to be recomputed, and then only
+    # the days whose logs changed are parsed again; the rest come from the cache a day at a time
+    parse_code = [load_log_data, parse_log_entries, derive_delivery_latencies]
+    data_fingerprint = fingerprint_files(log_files, sites, source_hash([sms_log_reader] + parse_code))
+    frames = []
+    
+    def load_frames():
+        if not frames:
+            frames.extend(load_log_data(log_dirs, cache))
+    
+    def with_deliveries(analysis, *analysis_args):
+        if frames[0] is not None:
+            analysis(frames[0], *analysis_args)
+    
+    # Analyze delivery times, timeouts and errors
+    report.section("Delivery Times", lambda: report_delivery_times(frames[0]), data_fingerprint, code=[report_delivery_times, analyze_delivery_times], prepare=load_frames,
+                   outputs=['delivery_time_distribution.png', 'delivery_time_distribution_log.png', 'delivery_time_by_hour.png', 'delivery_time_heatmap.png'])
+    report.section("Timeouts", lambda: report_timeouts(frames[1]), data_fingerprint, code=[report_timeouts, analyze_timeouts], prepare=load_frames,
+                   outputs=['timeouts_by_hour.png'])
+    report.section("Errors", lambda: report_errors(frames[2], args.output_dir), data_fingerprint, code=[report_errors, analyze_errors, mine_error_signatures], prepare=load_frames,
+                   outputs=[os.path.join(args.output_dir, 'error_signatures.csv'), 'errors_by_hour.png'])
     
     # Additional correlation analysis if we have delivery data
-    if df_deliveries is not None and len(df_deliveries) > 0:
-        check_for_correlations(df_deliveries)
-    
-    print("\nAnalysis complete. Visualizations saved to disk.")
-    print("Detailed data available in the returned DataFrames.") 
\ No newline at end of file
+    report.section("Correlations", lambda: with_deliveries(check_for_correlations), data_fingerprint, code=[check_for_correlations], prepare=load_frames,
+                   outputs=['delivery_time_vs_hour_scatter.png', 'delivery_time_vs_hour_regplot.png'])
+    report.section("Recipients", lambda: with_deliveries(analyze_recipients, frames[3], args.output_dir, args.top_recipients, args.tail_percent), data_fingerprint,
+                   {'top_k': args.top_recipients, 'tail_percent': args.tail_percent},
+                   code=[analyze_recipients, summarise_message_lifecycles, build_recipient_profiles, worst_recipients], prepare=load_frames,
+                   outputs=[os.path.join(args.output_dir, 'recipient_profiles.csv')])
+    if args.load_analysis:
+        report.section("Latency vs Load", lambda: with_deliveries(analyze_latency_vs_load, frames[3]), data_fingerprint,
+                       code=[analyze_latency_vs_load, summarise_message_lifecycles, reconstruct_load, depth_at], prepare=load_frames,
+                       outputs=['delivery_time_vs_load.png'])
+    
+    report_path = os.path.join(args.output_dir, args.report)
+    report.write_html(report_path, "SMS Log Analysis")
+    
+    print(f"\nAnalysis complete. Visualizations saved to disk, {report.summary()}.")
+    print(f"HTML report saved to {report_path}")
@@ -0,0 +1,284 @@
+"""Measure how much of the bridge's work and logging goes into delivery status polling.
+
+Open Dental polls GET /sms-status/{id} until a message reaches a final status, and every poll
+logs a StatusCheck (or StatusCheckFailed/StatusCheckException) line. For Diafaan each poll that
+misses the cached status is also a GET /status call to the provider. This script reports polls
+per message, the interval between polls and polls made after the status was already final, then
+replays every message's observed delivery time under alternative polling schedules to estimate
+how many requests and log bytes each would save.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from sms_log_reader import MAX_IN_FLIGHT_SECONDS, get_message_id, iter_log_lines, list_log_files, parse_site
+
+POLL_EVENTS = {'StatusCheck', 'StatusCheckFailed', 'StatusCheckException'}
+SEND_EVENTS = {'SendSuccess', 'MessageSent'}
+SEND_FAILURE_EVENTS = {'SendFailure', 'SendFailed', 'SendException'}
+# Providers whose status checks call out to the provider rather than reading local state
+REMOTE_STATUS_PROVIDERS = {'Diafaan', 'ETxt'}
+# Logged before any request is made
+NO_REQUEST_DETAILS = 'No provider message ID found'
+
+DEFAULT_SCHEDULES = ['fixed:5', 'fixed:15', 'fixed:30', 'fixed:60', 'backoff:5,2,60', 'backoff:10,1.5,120']
+
+def collect_polling_events(log_dirs):
+    """Read every site's logs into poll rows, per-message milestones and per-provider log volume."""
+    polls = []
+    sent = {}  # message_id -> first send timestamp
+    final = {}  # message_id -> (first final timestamp, how it ended)
+    volume = Counter()  # (provider, event_type) -> lines
+    volume_bytes = Counter()  # (provider, event_type) -> bytes
+    send_attempts = Counter()
+
+    for site, log_dir in map(parse_site, log_dirs):
+        for file_path in list_log_files(log_dir):
+            for line in iter_log_lines(file_path):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    log_entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                provider = log_entry.get('Provider', '')
+                event_type = log_entry.get('EventType', '')
+                timestamp = log_entry.get('Timestamp', '')
+                details = log_entry.get('Details', '')
+                # The serializer escapes everything outside ASCII, so characters are bytes
+                volume[(provider, event_type)] += 1
+                volume_bytes[(provider, event_type)] += len(line) + 2
+
+                message_id = get_message_id(log_entry)
+                if event_type in POLL_EVENTS:
+                    remote = provider in REMOTE_STATUS_PROVIDERS and not details.startswith(NO_REQUEST_DETAILS)
+                    polls.append((message_id, site, provider, timestamp, event_type, remote, len(line) + 2))
+                    if details in ('Status: Delivered', 'Status: Failed'):
+                        final.setdefault(message_id, (timestamp, details[len('Status: '):]))
+                elif event_type == 'SendAttempt':
+                    send_attempts[provider] += 1
+                elif event_type in SEND_EVENTS:
+                    sent.setdefault(message_id, timestamp)
+                elif event_type == 'DeliveryStatus':
+                    final.setdefault(message_id, (timestamp, 'Failed' if 'Status: Failed' in details else 'Delivered'))
+                elif event_type == 'Timeout':
+                    final.setdefault(message_id, (timestamp, 'Timeout'))
+                elif event_type in SEND_FAILURE_EVENTS:
+                    final.setdefault(message_id, (timestamp, 'Send failed'))
+
+    df_polls = pd.DataFrame(polls, columns=['message_id', 'site', 'provider', 'timestamp', 'event_type', 'remote', 'bytes'])
+    # Polls without a readable timestamp cannot be placed in time, so they are skipped
+    wall_clock = pd.to_datetime(df_polls['timestamp'].str[:19], format='%Y-%m-%dT%H:%M:%S', errors='coerce')
+    df_polls = df_polls[wall_clock.notna()].copy()
+    df_polls['hour'] = wall_clock.dropna().dt.hour
+    df_polls['timestamp'] = pd.to_datetime(df_polls['timestamp'], utc=True, format='ISO8601')
+
+    milestones = pd.DataFrame({
+        'sent_at': pd.Series(sent, dtype=object),
+        'final_at': pd.Series({k: v[0] for k, v in final.items()}, dtype=object),
+        'outcome': pd.Series({k: v[1] for k, v in final.items()}, dtype=object),
+    })
+    for column in ('sent_at', 'final_at'):
+        milestones[column] = pd.to_datetime(milestones[column], utc=True, format='ISO8601')
+
+    df_volume = pd.DataFrame({'lines': pd.Series(volume), 'bytes': pd.Series(volume_bytes)})
+    df_volume.index.names = ['provider', 'event_type']
+    return df_polls, milestones, df_volume, pd.Series(send_attempts, dtype=int)
+
+def summarise_polled_messages(df_polls, milestones):
+    """Return one row per polled message: poll counts, wasted polls and the delay to notice the final status."""
+    df = df_polls.join(milestones, on='message_id')
+
+    grouped = df.groupby('message_id')
+    messages = grouped.agg(
+        provider=('provider', 'first'),
+        site=('site', 'first'),
+        polls=('timestamp', 'size'),
+        remote_polls=('remote', 'sum'),
+        wasted_polls=('after_final', 'sum'),
+        first_poll=('timestamp', 'min'),
+        poll_bytes=('bytes', 'sum'),
+    ).join(milestones)
+
+    # The poll that noticed the final status is the first one at or after it
+    noticed = df[df['timestamp'] >= df['final_at']].groupby('message_id')['timestamp'].min()
+    messages['noticed_after'] = (noticed - messages['final_at']).dt.total_seconds()
+    messages['final_after'] = (messages['final_at'] - messages['sent_at']).dt.total_seconds()
+    messages['first_poll_after'] = (messages['first_poll'] - messages['sent_at']).dt.total_seconds()
+    return messages
+
+def poll_intervals(df_polls):
+    """Return the seconds between consecutive polls of the same message."""
+    ordered = df_polls.sort_values(['message_id', 'timestamp'])
+    gaps = ordered.groupby('message_id')['timestamp'].diff().dt.total_seconds()
+    return ordered.assign(interval=gaps).dropna(subset=['interval'])
+
+def parse_schedule(text):
+    """Parse 'fixed:<seconds>' or 'backoff:<first>,<factor>,<cap>' into (label, poll offsets from send)."""
+    kind, _, params = text.partition(':')
+    values = [float(v) for v in params.split(',')] if params else []
+    horizon = MAX_IN_FLIGHT_SECONDS + 1
+
+    if kind == 'fixed' and len(values) == 1 and values[0] > 0:
+        offsets = np.arange(values[0], horizon + values[0], values[0])
+        return f"every {values[0]:g}s", offsets
+    if kind == 'backoff' and len(values) == 3 and values[0] > 0 and values[1] >= 1:
+        first, factor, cap = values
+        offsets = []
+        t, interval = 0.0, first
+        while t < horizon:
+            t += interval
+            offsets.append(t)
+            interval = min(interval * factor, cap)
+        return f"{first:g}s x{factor:g} up to {cap:g}s", np.array(offsets)
+    raise argparse.ArgumentTypeError(f"Invalid schedule '{text}': use fixed:<seconds> or backoff:<first>,<factor>,<cap>")
+
+def replay_schedule(final_after, offsets):
+    """Return the polls each message would need, and how late its final status would be noticed."""
+    # Polling stops at the first poll at or after the final status; messages that never
+    # reached one are polled until the bridge gives up on them
+    final_after = np.minimum(np.nan_to_num(final_after, nan=MAX_IN_FLIGHT_SECONDS), MAX_IN_FLIGHT_SECONDS)
+    final_after = np.maximum(final_after, 0)
+    needed = np.searchsorted(offsets, final_after, side='left')
+    needed = np.minimum(needed, len(offsets) - 1)
+    return needed + 1, offsets[needed] - final_after
+
+def analyze_polling(messages, intervals, df_volume, send_attempts):
+    """Print polls per message, poll intervals, wasted polls and polling's share of requests and logs."""
+    print("\n===== STATUS POLLING ANALYSIS =====")
+    total_polls = int(messages['polls'].sum())
+    print(f"Messages polled: {len(messages)}")
+    print(f"Status checks: {total_polls}")
+
+    print("\nStatus Checks per Message:")
+    print(messages.groupby('provider')['polls'].describe(percentiles=[0.5, 0.9, 0.99]).round(2))
+
+    print("\nSeconds Between Polls of the Same Message:")
+    print(intervals.groupby('provider')['interval'].describe(percentiles=[0.1, 0.5, 0.9]).round(2))
+    bins = [0, 1, 5, 10, 30, 60, 300, float('inf')]
+    labels = ['<1s', '1-5s', '5-10s', '10-30s', '30-60s', '1-5m', '>5m']
+    buckets = pd.cut(intervals['interval'], bins=bins, labels=labels, right=False)
+    print(buckets.value_counts(normalize=True).reindex(labels).mul(100).round(1).rename('% of intervals'))
+
+    print(f"\nFirst poll after send: median {messages['first_poll_after'].median():.1f}s")
+    print(f"Final status noticed by polling after: median {messages['noticed_after'].median():.1f}s, "
+          f"p95 {messages['noticed_after'].quantile(0.95):.1f}s")
+
+    wasted = int(messages['wasted_polls'].sum())
+    print(f"\nPolls after the final status was known: {wasted} ({100 * wasted / total_polls:.2f}% of status checks)")
+    print(messages.groupby('outcome', dropna=False)['wasted_polls'].agg(['count', 'sum', 'mean', 'max']).round(2))
+
+    print("\nStatus Checks as a Share of Requests and Log Volume:")
+    lines = df_volume.groupby(level='provider').sum()
+    polling = df_volume[df_volume.index.get_level_values('event_type').isin(POLL_EVENTS)].groupby(level='provider').sum()
+    remote = messages.groupby('provider')['remote_polls'].sum()
+    for provider in lines.index:
+        provider_polls = polling['lines'].get(provider, 0)
+        if provider_polls == 0:
+            continue
+        print(f"{provider}: {100 * provider_polls / lines.loc[provider, 'lines']:.1f}% of log lines, "
+              f"{100 * polling['bytes'].get(provider, 0) / lines.loc[provider, 'bytes']:.1f}% of log bytes")
+        requests = remote.get(provider, 0)
+        if requests:
+            print(f"  {requests} status requests to the provider against {send_attempts.get(provider, 0)} send attempts "
+                  f"({100 * requests / (requests + send_attempts.get(provider, 0)):.1f}% of provider API calls)")
+        else:
+            print("  Status checks are answered from the bridge's own state and make no provider requests")
+
+def analyze_polling_by_hour(df_polls, intervals):
+    """Print polling volume, wasted polls and intervals by provider and hour of day."""
+    print("\n===== STATUS POLLING BY PROVIDER AND HOUR =====")
+    hourly = df_polls.groupby(['provider', 'hour']).agg(
+        polls=('message_id', 'size'),
+        messages=('message_id', 'nunique'),
+        wasted=('after_final', 'sum'),
+    )
+    hourly['polls_per_message'] = hourly['polls'] / hourly['messages']
+    hourly['wasted_share'] = hourly['wasted'] / hourly['polls']
+    hourly['median_interval'] = intervals.groupby(['provider', 'hour'])['interval'].median()
+    print(hourly.round(3).to_string())
+    return hourly
+
+def compare_schedules(messages, schedules):
+    """Print the polls, requests and log bytes each schedule would need against what was observed."""
+    print("\n===== ALTERNATIVE POLLING SCHEDULES =====")
+    print("Replays each polled message's observed time to a final status; polling starts at send")
+    print(f"and stops at the first poll after the final status, or at {MAX_IN_FLIGHT_SECONDS}s.")
+
+    df = messages.dropna(subset=['sent_at'])
+    if len(df) == 0:
+        print("No polled messages have a send time to replay")
+        return None
+
+    observed_polls = df['polls'].sum()
+    observed_remote = df['remote_polls'].sum()
+    bytes_per_poll = df['poll_bytes'].sum() / observed_polls
+    remote_share = df['remote_polls'] / df['polls']
+
+    rows = [{
+        'schedule': 'observed',
+        'polls': observed_polls,
+        'provider_requests': observed_remote,
+        'log_bytes': df['poll_bytes'].sum(),
+        'median_notice_delay': df['noticed_after'].median(),
+        'p95_notice_delay': df['noticed_after'].quantile(0.95),
+    }]
+    for label, offsets in schedules:
+        polls, delay = replay_schedule(df['final_after'].to_numpy(dtype=float), offsets)
+        rows.append({
+            'schedule': label,
+            'polls': polls.sum(),
+            'provider_requests': (polls * remote_share.to_numpy()).sum(),
+            'log_bytes': polls.sum() * bytes_per_poll,
+            'median_notice_delay': np.median(delay),
+            'p95_notice_delay': np.quantile(delay, 0.95),
+        })
+
+    table = pd.DataFrame(rows).set_index('schedule')
+    table['polls_saved'] = 1 - table['polls'] / observed_polls
+    table['log_mb_saved'] = (table.loc['observed', 'log_bytes'] - table['log_bytes']) / 1e6
+    print(table.round(3).to_string())
+    return table
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Analyze SMS logs for status polling volume and waste")
+    parser.add_argument("--log-dir", nargs="+", default=["od_logs"], help="Directories containing SMS log files, one per site, optionally as site=path")
+    parser.add_argument("--schedule", action="append", type=parse_schedule,
+                        help="Polling schedule to compare, as fixed:<seconds> or backoff:<first>,<factor>,<cap> (repeatable)")
+    parser.add_argument("--output-dir", default=".", help="Directory to save output files")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    for site, log_dir in map(parse_site, args.log_dir):
+        if not os.path.isdir(log_dir):
+            print(f"Error: Log directory '{log_dir}' not found.")
+            sys.exit(1)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    df_polls, milestones, df_volume, send_attempts = collect_polling_events(args.log_dir)
+    if len(df_polls) == 0:
+        print("No status check events found in the logs")
+        sys.exit(0)
+
+    df_polls['after_final'] = df_polls['timestamp'] > df_polls['message_id'].map(milestones['final_at'])
+    messages = summarise_polled_messages(df_polls, milestones)
+    intervals = poll_intervals(df_polls)
+
+    analyze_polling(messages, intervals, df_volume, send_attempts)
+    analyze_polling_by_hour(df_polls, intervals)
+    compare_schedules(messages, args.schedule or [parse_schedule(s) for s in DEFAULT_SCHEDULES])
+
+    messages_path = os.path.join(args.output_dir, 'status_polling_by_message.csv')
+    messages.to_csv(messages_path)
+    print(f"\nSaved per-message polling to {messages_path}")
@@ -0,0 +1,236 @@
+"""Compact closed days of SMS_Log_* files into SMS_Log_YYYYMMDD.smsa archives.
+
+Daily logs repeat the same keys, providers, event types and near-identical Details millions
+of times. An archive stores each day column by column instead:
+
+- the key order of each line is stored once as a layout, and each line refers to it
+- Level, Provider, EventType, IDs and any other fields are dictionary-encoded
+- Details are stored as a template ID plus the values masked out of the template
+- Timestamps are stored as deltas of 100ns ticks plus a dictionary-encoded UTC offset
+
+Values are kept exactly as they were escaped in the line, and any line or value that would
+not come back byte for byte is stored verbatim instead. Every archive is decoded and compared
+with the original file before the raw file is removed. sms_log_reader.py reads archives
+transparently, so the analysis scripts work on compacted days unchanged.
+"""
+import argparse
+import datetime
+import gzip
+import json
+import os
+import re
+import sys
+
+from sms_log_reader import (
+    ARCHIVE_FORMAT, ARCHIVE_SUFFIX, ARCHIVE_VERSION, INDEX_DTYPE, PARAM_SEPARATOR, TICKS_DTYPE,
+    TICKS_EPOCH, TICKS_PER_SECOND, dotnet_escape, extract_template, fill_template, format_ticks,
+    json_unescape, pack_ints, read_archive_text
+)
+
+# A log line is a flat JSON object of string values, as written by Services/Logger.cs
+FIELD_PATTERN = re.compile(r'"([^"\\]*)":"((?:[^"\\]|\\.)*)"')
+TIMESTAMP_PATTERN = re.compile(r'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)\.(\d{7})(.*)\Z')
+LOG_NAME_PATTERN = re.compile(r'SMS_Log_(\d{8})\.log\Z')
+
+def split_line(text):
+    """Return the (key, raw value) pairs of a log line, or None if they would not rebuild it exactly."""
+    fields = FIELD_PATTERN.findall(text)
+    if not fields or '{' + ','.join(f'"{key}":"{value}"' for key, value in fields) + '}' != text:
+        return None
+    return fields
+
+class ColumnEncoder:
+    """Dictionary-encodes the raw values of one field."""
+
+    def __init__(self):
+        self.values = {}
+        self.index = []
+
+    def add(self, raw):
+        self.index.append(self.values.setdefault(raw, len(self.values)))
+
+    def to_json(self):
+        return {'values': list(self.values), 'index': pack_ints(self.index, INDEX_DTYPE)}
+
+class TimestampEncoder:
+    """Delta-encodes timestamps as ticks, with the UTC offset text dictionary-encoded."""
+
+    def __init__(self):
+        self.suffixes = {}
+        self.suffix = []
+        self.delta = []
+        self.raw = []
+        self.ticks = 0
+
+    def add(self, raw):
+        match = TIMESTAMP_PATTERN.match(raw)
+        if match:
+            base = datetime.datetime.fromisoformat(match.group(1))
+            ticks = (base - TICKS_EPOCH) // datetime.timedelta(seconds=1) * TICKS_PER_SECOND + int(match.group(2))
+            if format_ticks(ticks) + match.group(3) == raw:
+                self.suffix.append(self.suffixes.setdefault(match.group(3), len(self.suffixes)))
+                self.delta.append(ticks - self.ticks)
+                self.ticks = ticks
+                return
+        self.raw.append((len(self.suffix), raw))
+        self.suffix.append(-1)
+        self.delta.append(0)
+
+    def to_json(self):
+        return {
+            'suffixes': list(self.suffixes),
+            'suffix': pack_ints(self.suffix, INDEX_DTYPE),
+            'delta': pack_ints(self.delta, TICKS_DTYPE),
+            'raw': self.raw
+        }
+
+class DetailsEncoder:
+    """Stores Details as a template ID plus the masked values, on the decoded text."""
+
+    def __init__(self):
+        self.templates = {}
+        self.template = []
+        self.params = []
+        self.raw = []
+
+    def add(self, raw):
+        try:
+            text = json_unescape(raw)
+        except json.JSONDecodeError:
+            text = None
+        if text is not None and dotnet_escape(text) == raw:
+            template, params = extract_template(text)
+            if fill_template(template, params) == text and not any(PARAM_SEPARATOR in param for param in params):
+                self.template.append(self.templates.setdefault(template, len(self.templates)))
+                self.params.extend(params)
+                return
+        self.raw.append((len(self.template), raw))
+        self.template.append(-1)
+
+    def to_json(self):
+        return {
+            'templates': list(self.templates),
+            'template': pack_ints(self.template, INDEX_DTYPE),
+            'params': PARAM_SEPARATOR.join(self.params),
+            'raw': self.raw
+        }
+
+def encode_log_text(text, source):
+    """Encode the full text of a daily log into an archive document."""
+    lines = text.splitlines(keepends=True)
+    terminators = [line[len(line.rstrip('\r\n')):] for line in lines]
+    newline = max(set(terminators), key=terminators.count) if lines else '\n'
+
+    layouts = {}
+    layout = []
+    verbatim = []
+    columns = {}
+    encoders = {'Timestamp': TimestampEncoder, 'Details': DetailsEncoder}
+
+    for row, (line, terminator) in enumerate(zip(lines, terminators)):
+        fields = split_line(line[:len(line) - len(terminator)]) if terminator == newline else None
+        if fields is None:
+            verbatim.append((row, line))
+            layout.append(-1)
+            continue
+
+        keys = tuple(key for key, _ in fields)
+        layout.append(layouts.setdefault(keys, len(layouts)))
+        for key, value in fields:
+            if key not in columns:
+                columns[key] = encoders.get(key, ColumnEncoder)()
+            columns[key].add(value)
+
+    return {
+        'format': ARCHIVE_FORMAT,
+        'version': ARCHIVE_VERSION,
+        'source': source,
+        'newline': newline,
+        'layouts': [list(keys) for keys in layouts],
+        'layout': pack_ints(layout, INDEX_DTYPE),
+        'raw': verbatim,
+        'columns': {key: encoder.to_json() for key, encoder in columns.items()}
+    }
+
+def compact_file(file_path, keep_raw=False):
+    """Archive one daily log, verify it round-trips exactly, then remove the raw file."""
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        text = f.read()
+
+    archive_path = os.path.splitext(file_path)[0] + ARCHIVE_SUFFIX
+    temp_path = archive_path + '.tmp'
+    archive = encode_log_text(text, os.path.basename(file_path))
+    try:
+        with gzip.open(temp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(archive, f, separators=(',', ':'), ensure_ascii=False)
+
+        if read_archive_text(temp_path) != text:
+            raise ValueError(f"Archive of {file_path} did not round-trip; the raw file was left alone")
+
+        os.replace(temp_path, archive_path)
+    finally:
+        # Nothing is left behind when writing or verifying the archive fails
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    if not keep_raw:
+        os.remove(file_path)
+    return archive_path
+
+def expand_file(archive_path):
+    """Write the original raw daily log back out from an archive."""
+    log_path = os.path.splitext(archive_path)[0] + '.log'
+    if os.path.exists(log_path):
+        raise FileExistsError(f"{log_path} already exists")
+    with open(log_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(read_archive_text(archive_path))
+    return log_path
+
+def closed_log_files(log_dir, today):
+    """Return the raw daily logs older than today; today's file is still being written."""
+    closed = []
+    for f in sorted(os.listdir(log_dir)):
+        match = LOG_NAME_PATTERN.match(f)
+        if match and datetime.datetime.strptime(match.group(1), '%Y%m%d').date() < today:
+            closed.append(os.path.join(log_dir, f))
+    return closed
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Compact closed days of SMS logs into archives")
+    parser.add_argument("--log-dir", default="od_logs", help="Directory containing SMS log files")
+    parser.add_argument("--keep-raw", action="store_true", help="Keep the raw log files after archiving them")
+    parser.add_argument("--expand", action="store_true", help="Write raw log files back out from the archives instead")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    if not os.path.isdir(args.log_dir):
+        print(f"Error: Log directory '{args.log_dir}' not found.")
+        sys.exit(1)
+
+    if args.expand:
+        archives = [os.path.join(args.log_dir, f) for f in sorted(os.listdir(args.log_dir)) if f.endswith(ARCHIVE_SUFFIX)]
+        for archive_path in archives:
+            try:
+                print(f"Expanded {expand_file(archive_path)}")
+            except FileExistsError as e:
+                print(f"Skipped {os.path.basename(archive_path)}: {e}")
+        sys.exit(0)
+
+    log_files = closed_log_files(args.log_dir, datetime.date.today())
+    print(f"Found {len(log_files)} closed SMS log files to compact")
+
+    failed = 0
+    for file_path in log_files:
+        try:
+            raw_size = os.path.getsize(file_path)
+            archive_path = compact_file(file_path, args.keep_raw)
+            archive_size = os.path.getsize(archive_path)
+            ratio = f" ({100 * archive_size / raw_size:.1f}%)" if raw_size else ""
+            print(f"Compacted {os.path.basename(file_path)}: {raw_size} -> {archive_size} bytes{ratio}")
+        except (UnicodeDecodeError, ValueError) as e:
+            failed += 1
+            print(f"Error: {os.path.basename(file_path)}: {e}")
+
+    sys.exit(1 if failed else 0)
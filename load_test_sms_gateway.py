@@ -0,0 +1,373 @@
+"""Load test the bridge's /smsgateway endpoints and cross-check the run against the SMS logs.
+
+Messages are sent to POST /smsgateway/send-sms at a fixed rate, with at most --concurrency HTTP
+requests in flight, and each one is then polled on GET /smsgateway/sms-status/{id} until it
+reaches a final status. Three latencies are recorded per message:
+
+    send      the HTTP round trip of POST /send-sms (the message is only queued by then)
+    ack       until the provider accepted it, i.e. SmsQueueProcessor dequeued and sent it
+    delivery  until the client saw Delivered or Failed
+
+The ack time needs the provider's view, which mock_sms_provider.py gives through --mock-url;
+with the mock, delivery is also taken from the mock when the provider's status cannot be polled
+(only JustRemotePhone supports /sms-status). Afterwards the SMS_Log_* files in --log-dir are read
+for the run's messages and their logged queue, send, status check and delivery events are
+compared with the client's timings.
+
+    python mock_sms_provider.py --delivery-median-seconds 3
+    python load_test_sms_gateway.py --messages 200 --rate 2 --concurrency 20 \
+        --mock-url http://127.0.0.1:9710 --log-dir C:\\ProgramData\\SMS_Bridge\\od_logs
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import re
+import sys
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from sms_log_reader import get_message_id, iter_log_entries, list_log_files
+
+FINAL_STATUSES = {'Delivered', 'Failed', 'TimedOut'}
+# SmsStatus is serialized as a number unless the caller reads StatusDisplay
+STATUS_NAMES = ['Pending', 'Delivered', 'Failed', 'Unknown', 'TimedOut']
+GUID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+# Log-spaced histogram bounds in seconds, from 1ms to the bridge's 630s message timeout
+HISTOGRAM_BOUNDS = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 630]
+
+class HttpError(Exception):
+    """A request that got no HTTP response at all."""
+
+async def http_request(url, method='GET', body=None, headers=None, timeout=30):
+    """Make one HTTP/1.1 request on its own connection and return (status, parsed JSON or text)."""
+    parts = urlsplit(url)
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    request_headers = {
+        'Host': parts.netloc,
+        'Connection': 'close',
+        'Accept': 'application/json',
+        'Content-Length': str(len(data)),
+        **({'Content-Type': 'application/json'} if body is not None else {}),
+        **(headers or {}),
+    }
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    head = f"{method} {path} HTTP/1.1\r\n" + ''.join(f"{k}: {v}\r\n" for k, v in request_headers.items()) + "\r\n"
+
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+        try:
+            writer.write(head.encode('latin-1') + data)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout)
+        finally:
+            writer.close()
+    except (OSError, asyncio.TimeoutError) as e:
+        raise HttpError(f"{method} {url}: {e or type(e).__name__}") from e
+
+    head, _, payload = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    if not lines[0].startswith('HTTP/'):
+        raise HttpError(f"{method} {url}: malformed response")
+    status = int(lines[0].split(' ')[1])
+    response_headers = {k.strip().lower(): v.strip() for k, _, v in (line.partition(':') for line in lines[1:])}
+    if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+        payload = decode_chunked(payload)
+    text = payload.decode('utf-8', errors='replace')
+    try:
+        return status, json.loads(text)
+    except json.JSONDecodeError:
+        return status, text
+
+def decode_chunked(payload):
+    """Join the chunks of a chunked transfer-encoded body."""
+    body = bytearray()
+    while payload:
+        size_line, _, payload = payload.partition(b'\r\n')
+        size = int(size_line.split(b';')[0], 16)
+        if size == 0:
+            break
+        body += payload[:size]
+        payload = payload[size + 2:]
+    return bytes(body)
+
+def field(response, name):
+    """Read a response field whatever casing the serializer gave it."""
+    return {k.lower(): v for k, v in response.items()}.get(name.lower())
+
+def status_name(value):
+    """Return the SmsStatus name from either its string or numeric JSON form."""
+    if isinstance(value, int) and 0 <= value < len(STATUS_NAMES):
+        return STATUS_NAMES[value]
+    return str(value)
+
+class LoadTest:
+    """Runs the senders and pollers and keeps one record per message."""
+
+    def __init__(self, args):
+        self.args = args
+        self.base_url = args.base_url.rstrip('/')
+        self.headers = {'X-API-Key': args.api_key} if args.api_key else {}
+        self.slots = asyncio.Semaphore(args.concurrency)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.records = []
+        self.polling_supported = True
+
+    async def request(self, url, method='GET', body=None):
+        async with self.slots:
+            return await http_request(url, method, body, self.headers, self.args.timeout)
+
+    async def run_message(self, seq):
+        record = {'seq': seq, 'text': f"Load test {self.run_id} #{seq}", 'sms_bridge_id': None,
+                  'send_started': time.time(), 'send_finished': None, 'http_status': None, 'error': None,
+                  'polls': 0, 'final_status': None, 'final_seen': None}
+        self.records.append(record)
+
+        try:
+            status, response = await self.request(f"{self.base_url}/send-sms", 'POST',
+                                                  {'PhoneNumber': self.args.phone_number, 'Message': record['text']})
+        except HttpError as e:
+            record['error'] = str(e)
+            return
+        record['send_finished'] = time.time()
+        record['http_status'] = status
+        if status != 200 or not isinstance(response, dict) or not field(response, 'success'):
+            record['error'] = f"HTTP {status}: {str(response)[:200]}"
+            return
+        record['sms_bridge_id'] = field(response, 'SMSBridgeID')
+
+        deadline = record['send_started'] + self.args.poll_timeout
+        while self.polling_supported and time.time() < deadline:
+            await asyncio.sleep(self.args.poll_interval)
+            try:
+                status, response = await self.request(f"{self.base_url}/sms-status/{record['sms_bridge_id']}")
+            except HttpError:
+                continue
+            record['polls'] += 1
+            if status == 400:
+                # Only JustRemotePhone serves /sms-status; the mock's view is used instead
+                self.polling_supported = False
+                break
+            if status == 200 and isinstance(response, dict):
+                current = status_name(field(response, 'StatusDisplay') or field(response, 'Status'))
+                if current in FINAL_STATUSES:
+                    record['final_status'] = current
+                    record['final_seen'] = time.time()
+                    break
+
+    async def run(self):
+        """Start messages at the target rate and wait for all of them to reach a final status."""
+        tasks = []
+        started = time.monotonic()
+        for seq in range(self.args.messages):
+            if self.args.rate > 0:
+                await asyncio.sleep(max(0, started + seq / self.args.rate - time.monotonic()))
+            tasks.append(asyncio.create_task(self.run_message(seq)))
+        await asyncio.gather(*tasks)
+        if not self.polling_supported and self.args.mock_url:
+            await self.wait_for_mock()
+
+    async def wait_for_mock(self):
+        """Without status polling, wait until the mock has received and finished every accepted message.
+
+        Messages the bridge failed to hand to the provider never arrive, so a run with send errors
+        waits out --poll-timeout.
+        """
+        texts = {record['text'] for record in self.records if record['sms_bridge_id']}
+        deadline = min(record['send_started'] for record in self.records) + self.args.poll_timeout
+        print(f"Status polling is not supported by the bridge's provider, waiting for the mock to see {len(texts)} messages")
+        while time.time() < deadline:
+            try:
+                mock = await fetch_mock_records(self.args.mock_url)
+            except HttpError:
+                mock = None
+            if mock is not None:
+                seen = mock[mock['message'].isin(texts)]
+                if len(seen) == len(texts) and seen['final_at'].max() <= time.time():
+                    return
+            await asyncio.sleep(self.args.poll_interval)
+
+async def fetch_mock_records(mock_url):
+    """Return the mock provider's record of every message it accepted."""
+    status, records = await http_request(f"{mock_url.rstrip('/')}/_mock/messages")
+    if status != 200:
+        raise HttpError(f"GET {mock_url}/_mock/messages returned {status}")
+    return pd.DataFrame(records, columns=['message_id', 'to', 'message', 'received_at', 'final_at', 'final_status', 'status_checks'])
+
+def build_results(records, mock):
+    """One row per message with its send, ack and delivery latencies in seconds."""
+    df = pd.DataFrame(records)
+    df['send_latency'] = df['send_finished'] - df['send_started']
+    df['ack_latency'] = np.nan
+    df['delivery_latency'] = df['final_seen'] - df['send_started']
+    df['delivery_source'] = np.where(df['final_seen'].notna(), 'status polling', '')
+
+    if mock is not None and len(mock) > 0:
+        by_text = mock.drop_duplicates('message').set_index('message')
+        df['provider_message_id'] = df['text'].map(by_text['message_id'])
+        df['ack_latency'] = df['text'].map(by_text['received_at']) - df['send_started']
+        mock_final = df['text'].map(by_text['final_at']) - df['send_started']
+        # The bridge only learns of a final status when someone polls, so the mock's time is a lower bound
+        use_mock = df['delivery_latency'].isna() & mock_final.notna()
+        df.loc[use_mock, 'delivery_latency'] = mock_final[use_mock]
+        df.loc[use_mock, 'final_status'] = df.loc[use_mock, 'text'].map(by_text['final_status']).str.title()
+        df.loc[use_mock, 'delivery_source'] = 'mock provider'
+    return df
+
+def print_histogram(title, values):
+    """Print percentiles and a log-bucketed text histogram of latencies in seconds."""
+    values = values.dropna()
+    print(f"\n{title}: {len(values)} samples")
+    if len(values) == 0:
+        return
+    print(f"p50 {values.quantile(0.5):.3f}s, p90 {values.quantile(0.9):.3f}s, p99 {values.quantile(0.99):.3f}s, "
+          f"max {values.max():.3f}s, mean {values.mean():.3f}s")
+    counts, _ = np.histogram(values.clip(upper=HISTOGRAM_BOUNDS[-1]), bins=[0] + HISTOGRAM_BOUNDS)
+    widest = counts.max()
+    for upper, count in zip(HISTOGRAM_BOUNDS, counts):
+        if count:
+            print(f"<= {upper:>7g}s {count:>7} {'#' * max(1, round(40 * count / widest))}")
+
+def report_run(df, args):
+    """Print throughput, errors and the latency histograms of the run."""
+    print("\n===== LOAD TEST RESULTS =====")
+    accepted = df['sms_bridge_id'].notna()
+    print(f"Messages: {len(df)} attempted, {accepted.sum()} accepted, {(~accepted).sum()} rejected or failed")
+    sending_seconds = df['send_finished'].max() - df['send_started'].min()
+    print(f"Offered rate: {args.rate:g}/s, achieved send rate: {len(df) / sending_seconds:.2f}/s over {sending_seconds:.1f}s")
+    if (~accepted).any():
+        print("Send errors:")
+        for error, count in df.loc[~accepted, 'error'].str[:120].value_counts().items():
+            print(f"  {count} x {error}")
+
+    print_histogram("Send latency (POST /send-sms round trip)", df['send_latency'])
+    print_histogram("Ack latency (until the provider accepted the message)", df['ack_latency'])
+    if df['ack_latency'].notna().sum() > 1:
+        acked = df.dropna(subset=['ack_latency']).sort_values('send_started')
+        window = acked['send_started'].iloc[-1] + acked['ack_latency'].iloc[-1] - acked['send_started'].iloc[0]
+        print(f"Provider throughput: {len(acked) / window:.2f} messages/s")
+    print_histogram("Delivery latency (until a final status)", df['delivery_latency'])
+
+    print("\nFinal Statuses:")
+    print(df['final_status'].fillna('None seen').value_counts().rename_axis(None).to_string())
+    print(f"Status polls made: {df['polls'].sum()} ({df.loc[accepted, 'polls'].mean():.1f} per accepted message)")
+    if df['delivery_source'].eq('mock provider').any():
+        print("Delivery times for messages the bridge could not report were taken from the mock provider")
+
+def read_run_events(log_dir, started, finished):
+    """Return the logged events of the days the run touched, keyed by bare SMSBridgeID."""
+    days = {datetime.date.fromtimestamp(t).strftime('%Y%m%d') for t in (started, finished)}
+    rows = []
+    for file_path in list_log_files(log_dir):
+        if re.search(r'SMS_Log_(\d{8})', os.path.basename(file_path)).group(1) not in days:
+            continue
+        for log_entry in iter_log_entries(file_path):
+            match = GUID_PATTERN.search(get_message_id(log_entry) or '')
+            if not match:
+                continue
+            try:
+                timestamp = datetime.datetime.fromisoformat(log_entry['Timestamp']).timestamp()
+            except (KeyError, ValueError):
+                continue
+            rows.append((match.group(0).lower(), log_entry.get('EventType', ''), timestamp, log_entry.get('Details', '')))
+    return pd.DataFrame(rows, columns=['sms_bridge_id', 'event_type', 'timestamp', 'details'])
+
+def cross_check_logs(df, log_dir, clock_tolerance):
+    """Compare the client's view of each message with what the bridge logged for it."""
+    print("\n===== LOG CROSS-CHECK =====")
+    accepted = df.dropna(subset=['sms_bridge_id']).copy()
+    accepted['sms_bridge_id'] = accepted['sms_bridge_id'].str.lower()
+    events = read_run_events(log_dir, df['send_started'].min(), time.time())
+    events = events[events['sms_bridge_id'].isin(accepted['sms_bridge_id'])]
+    if len(events) == 0:
+        print(f"No log entries for this run's messages in {log_dir}")
+        return None
+
+    first = events.groupby(['sms_bridge_id', 'event_type'])['timestamp'].min().unstack()
+    checks = events[events['event_type'] == 'StatusCheck'].groupby('sms_bridge_id').size()
+    delivered = events[(events['event_type'].isin(['DeliveryStatus', 'StatusCheck'])) & events['details'].str.contains('Status: Delivered')]
+    joined = accepted.set_index('sms_bridge_id').join(first).join(checks.rename('logged_status_checks'))
+
+    def column(name):
+        return joined[name] if name in joined else pd.Series(np.nan, index=joined.index)
+
+    missing = column('MessageQueued').isna()
+    print(f"Accepted messages: {len(joined)}, with a MessageQueued entry: {(~missing).sum()}, missing from the logs: {missing.sum()}")
+
+    # Same clock on the same machine, so the queue entry must fall inside the POST round trip
+    queued_offset = column('MessageQueued') - joined['send_started']
+    outside = (queued_offset < -clock_tolerance) | (column('MessageQueued') > joined['send_finished'] + clock_tolerance)
+    print(f"MessageQueued logged {queued_offset.median():.3f}s after the client sent (median); "
+          f"{outside.sum()} outside the POST round trip by more than {clock_tolerance:g}s")
+
+    sent_at = column('SendSuccess').fillna(column('MessageSent'))
+    queue_wait = (column('SendAttempt') - column('MessageQueued')).dropna()
+    if len(queue_wait):
+        print(f"Queue wait from the logs (MessageQueued -> SendAttempt): p50 {queue_wait.quantile(0.5):.2f}s, "
+              f"p90 {queue_wait.quantile(0.9):.2f}s, max {queue_wait.max():.2f}s")
+    log_ack = (sent_at - joined['send_started']).dropna()
+    if len(log_ack) and joined['ack_latency'].notna().any():
+        difference = (log_ack - joined['ack_latency']).dropna()
+        print(f"Logged send vs provider ack: median difference {difference.median():.3f}s, max {difference.abs().max():.3f}s")
+
+    polls = joined['polls'].sum()
+    logged_checks = joined['logged_status_checks'].fillna(0).sum()
+    print(f"Status polls: {polls} made by the client, {int(logged_checks)} logged as StatusCheck")
+
+    seen = joined['final_status'].eq('Delivered') & joined['delivery_source'].eq('status polling')
+    logged = joined.index.isin(delivered['sms_bridge_id'])
+    print(f"Delivered by polling: {seen.sum()}, of which logged as delivered: {(seen & logged).sum()}; "
+          f"logged as delivered but never seen by the client: {(logged & ~seen).sum()}")
+    return joined
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Load test the SMS bridge's /smsgateway endpoints")
+    parser.add_argument("--base-url", default="http://localhost:5170/smsgateway", help="Base URL of the smsgateway API")
+    parser.add_argument("--api-key", default=os.environ.get("BRIDGE_API_KEY", ""), help="X-API-Key for non-localhost bridges (default: $BRIDGE_API_KEY)")
+    parser.add_argument("--messages", type=int, default=100, help="Number of messages to send (default: 100)")
+    parser.add_argument("--rate", type=float, default=1.0, help="Messages started per second; 0 sends as fast as concurrency allows (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=20, help="Maximum HTTP requests in flight (default: 20)")
+    parser.add_argument("--phone-number", default="+6421467784", help="Recipient; with EnableDebugMode the bridge redirects others to TestingPhoneNumber")
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between status polls of a message (default: 2)")
+    parser.add_argument("--poll-timeout", type=float, default=630, help="Stop polling a message this many seconds after sending it (default: 630)")
+    parser.add_argument("--timeout", type=float, default=30, help="Timeout of each HTTP request in seconds (default: 30)")
+    parser.add_argument("--mock-url", help="URL of mock_sms_provider.py, to time acks and deliveries from the provider's side")
+    parser.add_argument("--log-dir", help="The bridge's log directory, to cross-check the run against SMS_Log_* files")
+    parser.add_argument("--clock-tolerance", type=float, default=0.5, help="Allowed skew between client and log timestamps in seconds")
+    parser.add_argument("--output-dir", default=".", help="Directory to save output files")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    if args.log_dir and not os.path.isdir(args.log_dir):
+        print(f"Error: Log directory '{args.log_dir}' not found.")
+        sys.exit(1)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    load_test = LoadTest(args)
+    print(f"Run {load_test.run_id}: {args.messages} messages at {args.rate:g}/s, concurrency {args.concurrency}, to {args.base_url}")
+    asyncio.run(load_test.run())
+
+    mock = None
+    if args.mock_url:
+        try:
+            mock = asyncio.run(fetch_mock_records(args.mock_url))
+        except HttpError as e:
+            print(f"Could not read the mock provider's records: {e}")
+
+    df = build_results(load_test.records, mock)
+    report_run(df, args)
+    if args.log_dir:
+        cross_check_logs(df, args.log_dir, args.clock_tolerance)
+
+    results_path = os.path.join(args.output_dir, f"load_test_{load_test.run_id}.csv")
+    df.to_csv(results_path, index=False)
+    print(f"\nSaved per-message results to {results_path}")
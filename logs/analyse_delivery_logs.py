@@ -1,16 +1,20 @@
 import os
-import json
+import sys
 import pandas as pd
-from datetime import date
+from datetime import date, datetime
 from pathlib import Path
 from collections import defaultdict
 
+# sms_log_reader lives next to the analysis scripts in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sms_log_reader import iter_log_entries, list_log_files
+
 # --- Config ---
 log_dir = Path(r"C:\Users\User\Downloads\od_logs")
+# One file per day, raw or compacted into an archive
 log_files = [
-    f for f in log_dir.glob("SMS_log*")
-    if any(char.isdigit() for char in f.stem)
-    and date.fromisoformat(''.join(filter(str.isdigit, f.stem))[:10]) >= date(2025, 3, 1)
+    f for f in list_log_files(log_dir)
+    if datetime.strptime(Path(f).stem[len("SMS_Log_"):], "%Y%m%d").date() >= date(2025, 3, 1)
 ]
 
 # --- Helper: Extract fields from SendAttempt ---
@@ -32,35 +36,33 @@ def extract_phone_and_message(details: str):
 message_statuses = defaultdict(list)
 send_attempt_pending = None
 
-for file_path in sorted(log_files):
-    with open(file_path, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                entry = json.loads(line.strip())
-                timestamp = pd.to_datetime(entry["Timestamp"], errors="raise")
-                entry["Timestamp_dt"] = timestamp  # Trust logs are already in NZT with tzinfo
-
-                event_type = entry.get("EventType", "")
-                msg_id = entry.get("MessageId", "")
-
-                if event_type == "SendAttempt":
-                    send_attempt_pending = entry
-
-                elif event_type == "SendSuccess" and msg_id:
-                    if send_attempt_pending:
-                        phone, message = extract_phone_and_message(send_attempt_pending["Details"])
-                        entry["ExtractedPhone"] = phone
-                        entry["ExtractedMessage"] = message
-                        send_attempt_pending = None
-                    else:
-                        entry["ExtractedPhone"] = ""
-                        entry["ExtractedMessage"] = ""
-
-                if msg_id:
-                    message_statuses[msg_id].append(entry)
-
-            except Exception as e:
-                raise RuntimeError(f"Error parsing log line: {e}")
+for file_path in log_files:
+    for entry in iter_log_entries(file_path):
+        try:
+            timestamp = pd.to_datetime(entry["Timestamp"], errors="raise")
+            entry["Timestamp_dt"] = timestamp  # Trust logs are already in NZT with tzinfo
+
+            event_type = entry.get("EventType", "")
+            msg_id = entry.get("MessageId", "")
+
+            if event_type == "SendAttempt":
+                send_attempt_pending = entry
+
+            elif event_type == "SendSuccess" and msg_id:
+                if send_attempt_pending:
+                    phone, message = extract_phone_and_message(send_attempt_pending["Details"])
+                    entry["ExtractedPhone"] = phone
+                    entry["ExtractedMessage"] = message
+                    send_attempt_pending = None
+                else:
+                    entry["ExtractedPhone"] = ""
+                    entry["ExtractedMessage"] = ""
+
+            if msg_id:
+                message_statuses[msg_id].append(entry)
+
+        except Exception as e:
+            raise RuntimeError(f"Error parsing log line: {e}")
 
 # --- Step 2: Summarise all outbound messages ---
 message_summaries = []
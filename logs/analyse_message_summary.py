@@ -1,5 +1,11 @@
 import pandas as pd
 import datetime
+import os
+import sys
+
+# sms_report_cache lives next to the analysis scripts in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sms_report_cache import Report, ReportCache, fingerprint_files
 
 # --- Data Loading ---
 def load_data(path="message_summary.csv") -> pd.DataFrame:
@@ -100,7 +106,7 @@ def classify_reminder_message(msg: str) -> str:
         return "unknown"
 
 # --- Daily Reminder Summary ---
-def daily_reminder_type_summary(df: pd.DataFrame) -> pd.DataFrame:
+def daily_reminder_type_summary(df: pd.DataFrame, output_dir: str = ".") -> pd.DataFrame:
     # Prepare a copy
     df2 = df.copy()
     # Extract date and weekday
@@ -143,20 +149,44 @@ def daily_reminder_type_summary(df: pd.DataFrame) -> pd.DataFrame:
     # Print & save
     print("\n== Daily 08:15–08:30 NZT Summary (All Days) ==")
     print(result.to_string(index=False))
-    result.to_csv("daily_reminder_summary_all_days_with_weekday.csv", index=False)
-    print("Saved daily_reminder_summary_all_days_with_weekday.csv")
+    summary_path = os.path.join(output_dir, "daily_reminder_summary_all_days_with_weekday.csv")
+    result.to_csv(summary_path, index=False)
+    print(f"Saved {summary_path}")
     return result
 
 # --- Main ---
-def main():
-    df = load_data()
-    print_outcome_summary(df)
-    ctx = analyse_gave_up_context(df)
-    print_gave_up_context_stats(ctx)
-    clust = compute_clusters(df)
-    print("\n== Cluster Analysis ==")
-    print(clust.to_string(index=False))
-    daily_reminder_type_summary(df)
+def main(path="message_summary.csv", output_dir="."):
+    if not os.path.exists(path):
+        print(f"Error: Message summary '{path}' not found.")
+        sys.exit(1)
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Each section is memoized on the summary CSV's name, size and modification time
+    report = Report(ReportCache(os.path.join(output_dir, ".report_cache")))
+    fingerprint = fingerprint_files([path])
+    frames = []
+
+    def load():
+        if not frames:
+            frames.append(load_data(path))
+
+    report.section("Outcome Summary", lambda: print_outcome_summary(frames[0]), fingerprint,
+                   code=[load_data, print_outcome_summary], prepare=load)
+    report.section("Gave Up Context", lambda: print_gave_up_context_stats(analyse_gave_up_context(frames[0])), fingerprint,
+                   code=[load_data, analyse_gave_up_context, print_gave_up_context_stats], prepare=load)
+
+    def print_clusters():
+        clust = compute_clusters(frames[0])
+        print("\n== Cluster Analysis ==")
+        print(clust.to_string(index=False))
+
+    report.section("Cluster Analysis", print_clusters, fingerprint, code=[load_data, classify_type, compute_clusters], prepare=load)
+    summary_path = os.path.join(output_dir, "daily_reminder_summary_all_days_with_weekday.csv")
+    report.section("Daily Reminder Summary", lambda: daily_reminder_type_summary(frames[0], output_dir), fingerprint,
+                   code=[load_data, classify_reminder_message, daily_reminder_type_summary], prepare=load, outputs=[summary_path])
+    report_path = os.path.join(output_dir, "message_summary_report.html")
+    report.write_html(report_path, "Message Summary")
+    print(f"\n{report.summary()}, saved {report_path}")
 
 if __name__ == "__main__":
-    main()
+    main(*sys.argv[1:3])
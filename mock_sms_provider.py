@@ -0,0 +1,138 @@
+"""A local stand-in for the Diafaan HTTP API, for load testing the bridge without sending real SMS.
+
+Point SmsSettings:Providers:diafaan:ApiUrl at it (the default http://localhost:9710 already does)
+and set SmsSettings:Provider to Diafaan. It implements the endpoints DiafaanSmsProvider calls:
+
+    POST /send          {"to", "message", "sender"} -> {"success", "message_id", "error_message"}
+    GET  /status/{id}   -> {"message_id", "status": "pending" | "delivered" | "failed"}
+    GET  /received      -> {"messages": []}
+
+Each send is answered after a configurable latency and can be made to fail, and each accepted
+message is delivered (or fails) a random time later, drawn from a log-normal distribution.
+GET /_mock/messages returns what the mock saw, with Unix timestamps, so load_test_sms_gateway.py
+can time the bridge's queue and delivery from the provider's side.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+class MockProvider:
+    """State and fault injection for the mock provider."""
+
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.messages = {}  # message_id -> record
+
+    async def delay(self, mean_ms):
+        if mean_ms > 0:
+            await asyncio.sleep(self.random.expovariate(1000 / mean_ms))
+
+    async def send(self, payload):
+        await self.delay(self.args.send_latency_ms)
+        roll = self.random.random()
+        if roll < self.args.send_error_rate:
+            return 500, {'error': 'Injected provider error'}
+        if roll < self.args.send_error_rate + self.args.send_reject_rate:
+            return 200, {'success': False, 'message_id': None, 'error_message': 'Injected rejection'}
+
+        message_id = str(uuid.uuid4())
+        received_at = time.time()
+        delivery_seconds = self.random.lognormvariate(0, self.args.delivery_sigma) * self.args.delivery_median_seconds
+        self.messages[message_id] = {
+            'message_id': message_id,
+            'to': payload.get('to'),
+            'message': payload.get('message'),
+            'received_at': received_at,
+            'final_at': received_at + delivery_seconds,
+            'final_status': 'failed' if self.random.random() < self.args.delivery_failure_rate else 'delivered',
+            'status_checks': 0,
+        }
+        return 200, {'success': True, 'message_id': message_id, 'error_message': None}
+
+    async def status(self, message_id):
+        await self.delay(self.args.status_latency_ms)
+        record = self.messages.get(message_id)
+        if record is None:
+            return 404, {'message_id': message_id, 'status': None, 'error_message': 'Unknown message'}
+        record['status_checks'] += 1
+        if self.random.random() < self.args.status_error_rate:
+            return 500, {'error': 'Injected provider error'}
+        status = record['final_status'] if time.time() >= record['final_at'] else 'pending'
+        return 200, {'message_id': message_id, 'status': status, 'error_message': None}
+
+    async def handle(self, method, path, body):
+        if method == 'POST' and path == '/send':
+            return await self.send(json.loads(body or b'{}'))
+        if method == 'GET' and path.startswith('/status/'):
+            return await self.status(path[len('/status/'):])
+        if method == 'GET' and path == '/received':
+            return 200, {'messages': []}
+        if method == 'GET' and path == '/_mock/messages':
+            return 200, list(self.messages.values())
+        return 404, {'error': f'No route for {method} {path}'}
+
+async def serve_connection(provider, reader, writer):
+    """Answer HTTP/1.1 requests on one connection until the client closes it."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            status, response = await provider.handle(method, target.split('?')[0], body)
+            data = json.dumps(response).encode('utf-8')
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            writer.write(
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+            )
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def run_server(args):
+    provider = MockProvider(args)
+    server = await asyncio.start_server(lambda r, w: serve_connection(provider, r, w), args.host, args.port)
+    print(f"Mock Diafaan provider listening on http://{args.host}:{args.port}")
+    async with server:
+        await server.serve_forever()
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Mock Diafaan SMS provider with injected latency and failures")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=9710, help="Port to listen on (default: 9710, the Diafaan ApiUrl in appsettings.json)")
+    parser.add_argument("--send-latency-ms", type=float, default=200, help="Mean latency of POST /send (default: 200)")
+    parser.add_argument("--status-latency-ms", type=float, default=50, help="Mean latency of GET /status (default: 50)")
+    parser.add_argument("--send-error-rate", type=float, default=0.0, help="Share of sends answered with HTTP 500")
+    parser.add_argument("--send-reject-rate", type=float, default=0.0, help="Share of sends answered with success=false")
+    parser.add_argument("--status-error-rate", type=float, default=0.0, help="Share of status checks answered with HTTP 500")
+    parser.add_argument("--delivery-median-seconds", type=float, default=5, help="Median time from send to final status (default: 5)")
+    parser.add_argument("--delivery-sigma", type=float, default=0.8, help="Log-normal spread of the delivery time (default: 0.8)")
+    parser.add_argument("--delivery-failure-rate", type=float, default=0.02, help="Share of accepted messages that end failed")
+    parser.add_argument("--seed", type=int, help="Random seed, for repeatable runs")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_server(parse_arguments()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,280 @@
+"""Print the SMS log entries that match a set of filters, as JSON lines or CSV.
+
+    python query_sms_logs.py --log-dir od_logs --date 2025-03-04 --level ERROR \
+        --provider JustRemotePhone --phone +6421
+
+Every filter is pushed down into the scan so a selective query reads as little as possible:
+
+  - daily files whose date is outside the time range are not opened
+  - raw lines are checked for the escaped bytes each filter needs before json.loads is called
+  - archived days are filtered on their columns: the Level, Provider, EventType and ID
+    dictionaries (an ID or value missing from a dictionary rules out the whole day), the
+    timestamp ticks and the Details parameters. Only the rows left over are decoded.
+
+Whatever passes the pushed-down checks is then matched exactly against the decoded entry. Times
+are compared with the wall-clock time the entry was logged at, ignoring its UTC offset, which is
+also how the daily files are named. A summary of how much was read goes to stderr.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+from sms_log_reader import (INDEX_DTYPE, PARAM_SEPARATOR, TICKS_EPOCH, TICKS_PER_SECOND,
+                            archive_ticks, dotnet_escape, is_archive, is_columnar, iter_archive_rows, iter_log_entries,
+                            json_unescape, list_log_files, parse_site, read_archive, template_literals, unpack_ints)
+
+CSV_COLUMNS = ['Site', 'Timestamp', 'Level', 'Provider', 'EventType', 'Details', 'SMSBridgeID', 'ProviderMessageID']
+ID_FIELDS = ['SMSBridgeID', 'ProviderMessageID', 'MessageId']
+TIMESTAMP_PREFIX = b'{"Timestamp":"'
+PHONE_PATTERN = re.compile(r'\+?\d{7,15}')
+
+class Query:
+    """The filters of one query, and how each is checked at every level of the scan."""
+
+    def __init__(self, since=None, until=None, providers=(), levels=(), event_types=(), ids=(), phones=(), contains=None, regex=None):
+        self.since = since
+        self.until = until
+        self.fields = {'Provider': set(providers), 'Level': set(levels), 'EventType': set(event_types)}
+        self.fields = {field: values for field, values in self.fields.items() if values}
+        self.ids = [i.lower() for i in ids]
+        # Phone numbers are matched as a prefix of their digits, since '+' is escaped in the raw logs
+        self.phones = [re.sub(r'\D', '', phone) for phone in phones]
+        self.contains = contains
+        self.regex = re.compile(regex) if regex else None
+
+    def file_in_range(self, file_path):
+        """Return False for a daily file that cannot hold entries inside the time range."""
+        match = re.search(r'SMS_Log_(\d{8})', os.path.basename(file_path))
+        if not match:
+            return True
+        day = datetime.datetime.strptime(match.group(1), '%Y%m%d')
+        if self.since and day + datetime.timedelta(days=1) <= self.since:
+            return False
+        return not (self.until and day >= self.until)
+
+    def line_tokens(self):
+        """Groups of bytes a raw line must contain, at least one from each group, to be worth decoding."""
+        groups = [[f'"{field}":"{dotnet_escape(value)}"'.encode('utf-8') for value in values] for field, values in self.fields.items()]
+        if self.ids:
+            groups.append([i.encode('utf-8') for i in self.ids])
+        if self.phones:
+            groups.append([digits.encode('utf-8') for digits in self.phones])
+        if self.contains:
+            groups.append([dotnet_escape(self.contains).encode('utf-8')])
+        return groups
+
+    def line_in_range(self, line):
+        """Compare the seconds of a raw line's timestamp with the time range, without decoding it."""
+        if not line.startswith(TIMESTAMP_PREFIX):
+            return True
+        seconds = line[len(TIMESTAMP_PREFIX):len(TIMESTAMP_PREFIX) + 19]
+        if self.since and seconds < self.since_bytes:
+            return False
+        return not (self.until and seconds > self.until_bytes)
+
+    def matches(self, log_entry):
+        """The exact check on a decoded entry."""
+        if self.since or self.until:
+            try:
+                logged_at = datetime.datetime.fromisoformat(log_entry['Timestamp']).replace(tzinfo=None)
+            except (KeyError, TypeError, ValueError):
+                return False
+            if (self.since and logged_at < self.since) or (self.until and logged_at >= self.until):
+                return False
+        for field, values in self.fields.items():
+            if log_entry.get(field) not in values:
+                return False
+        if self.ids:
+            logged_ids = ' '.join(str(log_entry.get(field, '')) for field in ID_FIELDS).lower()
+            if not any(i in logged_ids for i in self.ids):
+                return False
+        details = str(log_entry.get('Details', ''))
+        if self.phones:
+            numbers = PHONE_PATTERN.findall(details)
+            if not any(number.lstrip('+').startswith(digits) for digits in self.phones for number in numbers):
+                return False
+        if self.contains and self.contains not in details:
+            return False
+        return not (self.regex and not self.regex.search(details))
+
+    def prepare(self):
+        """Work out the byte forms of the filters once, before scanning."""
+        self.since_bytes = self.since.isoformat(timespec='seconds').encode('ascii') if self.since else None
+        self.until_bytes = self.until.isoformat(timespec='seconds').encode('ascii') if self.until else None
+        self.tokens = self.line_tokens()
+        return self
+
+def to_ticks(moment):
+    """Ticks since TICKS_EPOCH of a naive wall-clock time, as archives store them."""
+    return (moment - TICKS_EPOCH) // datetime.timedelta(microseconds=1) * (TICKS_PER_SECOND // 1_000_000)
+
+def archive_candidate_rows(archive, query):
+    """Return the rows of a columnar archive that may match, from its columns alone."""
+    columns = archive['columns']
+    ticks = archive_ticks(archive)
+    mask = np.ones(len(ticks), dtype=bool)
+
+    def dictionary_mask(field, wanted):
+        # Dictionary values are few, so each is unescaped and tested once rather than once per row
+        column = columns.get(field)
+        if column is None:
+            return np.zeros(len(mask), dtype=bool)
+        value_ids = [i for i, value in enumerate(column['values']) if wanted(json_unescape(value))]
+        if not value_ids:
+            return np.zeros(len(mask), dtype=bool)
+        return np.isin(unpack_ints(column['index'], INDEX_DTYPE), value_ids)
+
+    for field, values in query.fields.items():
+        mask &= dictionary_mask(field, values.__contains__)
+        if not mask.any():
+            return mask.nonzero()[0]
+
+    if query.ids:
+        id_mask = np.zeros(len(mask), dtype=bool)
+        for field in ID_FIELDS:
+            id_mask |= dictionary_mask(field, lambda value: any(i in value.lower() for i in query.ids))
+        mask &= id_mask
+        if not mask.any():
+            return mask.nonzero()[0]
+
+    if query.since or query.until:
+        in_range = np.ones(len(mask), dtype=bool)
+        if query.since:
+            in_range &= ticks >= to_ticks(query.since)
+        if query.until:
+            in_range &= ticks < to_ticks(query.until)
+        # Timestamps stored verbatim have no ticks of their own and are checked after decoding
+        in_range[[row for row, _ in columns['Timestamp']['raw']]] = True
+        mask &= in_range
+
+    if query.phones and 'Details' in columns:
+        # Masking takes every digit out of a template, so a phone number can only be in the parameters
+        details = columns['Details']
+        template_ids = unpack_ints(details['template'], INDEX_DTYPE)
+        counts = np.array([len(template_literals(t)) - 1 for t in details['templates']] + [0], dtype=np.int64)[template_ids]
+        params = details['params'].split(PARAM_SEPARATOR) if details['params'] else []
+        owners = np.repeat(np.arange(len(template_ids)), counts)
+        matching = [i for i, param in enumerate(params) if any(digits in param for digits in query.phones)]
+        phone_mask = np.zeros(len(mask), dtype=bool)
+        phone_mask[owners[matching]] = True
+        phone_mask[template_ids < 0] = True
+        mask &= phone_mask
+
+    return mask.nonzero()[0]
+
+def scan_file(file_path, query, stats):
+    """Yield the matching entries of one raw or archived daily log."""
+    stats['files'] += 1
+    stats['bytes'] += os.path.getsize(file_path)
+
+    if is_archive(file_path):
+        archive = read_archive(file_path)
+        if not is_columnar(archive):
+            # Lines with differing keys or stored verbatim: decode the whole day
+            for log_entry in iter_log_entries(file_path):
+                stats['lines'] += 1
+                stats['decoded'] += 1
+                if query.matches(log_entry):
+                    yield log_entry
+            return
+        rows = archive_candidate_rows(archive, query)
+        stats['lines'] += len(archive_ticks(archive))
+        stats['decoded'] += len(rows)
+        for log_entry in iter_archive_rows(archive, rows):
+            if query.matches(log_entry):
+                yield log_entry
+        return
+
+    with open(file_path, 'rb') as f:
+        for line in f:
+            stats['lines'] += 1
+            if (query.since or query.until) and not query.line_in_range(line):
+                continue
+            if not all(any(token in line for token in group) for group in query.tokens):
+                continue
+            stats['decoded'] += 1
+            try:
+                log_entry = json.loads(line)
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                continue  # Skip malformed lines
+            if query.matches(log_entry):
+                yield log_entry
+
+def run_query(log_dirs, query, stats):
+    """Yield matching entries of every site, tagged with their site, oldest file first."""
+    query.prepare()
+    for site, log_dir in map(parse_site, log_dirs):
+        for file_path in list_log_files(log_dir):
+            if not query.file_in_range(file_path):
+                stats['pruned'] += 1
+                continue
+            for log_entry in scan_file(file_path, query, stats):
+                log_entry['Site'] = site
+                yield log_entry
+
+def parse_time(text):
+    """Parse --since/--until, converting times with an offset to local wall-clock time."""
+    moment = datetime.datetime.fromisoformat(text)
+    return moment.astimezone().replace(tzinfo=None) if moment.tzinfo else moment
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Query SMS logs with filters pushed down into the scan")
+    parser.add_argument("--log-dir", nargs="+", default=["od_logs"], help="Directories containing SMS log files, one per site, optionally as site=path")
+    parser.add_argument("--since", type=parse_time, help="Only entries logged at or after this time, e.g. 2025-03-04T08:00")
+    parser.add_argument("--until", type=parse_time, help="Only entries logged before this time")
+    parser.add_argument("--date", type=datetime.date.fromisoformat, help="Only entries logged on this day, e.g. 2025-03-04")
+    parser.add_argument("--provider", nargs="+", default=[], help="Provider names, e.g. JustRemotePhone")
+    parser.add_argument("--level", nargs="+", default=[], help="Levels as logged, e.g. ERROR")
+    parser.add_argument("--event-type", nargs="+", default=[], help="Event types, e.g. SendFailed DeliveryStatus")
+    parser.add_argument("--id", nargs="+", default=[], help="SMSBridgeID or ProviderMessageID GUIDs, or a prefix of them")
+    parser.add_argument("--phone", nargs="+", default=[], help="Phone numbers in Details, or a prefix such as +6421")
+    parser.add_argument("--contains", help="Substring of Details")
+    parser.add_argument("--regex", help="Regular expression searched for in Details")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="Output format (default: jsonl)")
+    parser.add_argument("--output", help="Write to this file instead of stdout")
+    parser.add_argument("--limit", type=int, help="Stop after this many matching entries")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    for site, log_dir in map(parse_site, args.log_dir):
+        if not os.path.isdir(log_dir):
+            print(f"Error: Log directory '{log_dir}' not found.", file=sys.stderr)
+            sys.exit(1)
+
+    since, until = args.since, args.until
+    if args.date:
+        day = datetime.datetime.combine(args.date, datetime.time())
+        since = max(since, day) if since else day
+        until = min(until, day + datetime.timedelta(days=1)) if until else day + datetime.timedelta(days=1)
+
+    query = Query(since, until, args.provider, args.level, args.event_type, args.id, args.phone, args.contains, args.regex)
+    stats = {'files': 0, 'pruned': 0, 'bytes': 0, 'lines': 0, 'decoded': 0, 'matched': 0}
+
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        writer = csv.DictWriter(out, fieldnames=CSV_COLUMNS, extrasaction='ignore') if args.format == 'csv' else None
+        if writer:
+            writer.writeheader()
+        for log_entry in run_query(args.log_dir, query, stats):
+            if writer:
+                writer.writerow(log_entry)
+            else:
+                out.write(json.dumps(log_entry) + '\n')
+            stats['matched'] += 1
+            if args.limit and stats['matched'] >= args.limit:
+                break
+    finally:
+        if args.output:
+            out.close()
+
+    print(f"{stats['matched']} matching entries; opened {stats['files']} files ({stats['bytes'] / 1e6:.1f} MB), "
+          f"skipped {stats['pruned']} by date; decoded {stats['decoded']} of {stats['lines']} lines", file=sys.stderr)
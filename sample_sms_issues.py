@@ -6,87 +6,88 @@ import random
 import sys
 from datetime import datetime
 
+from sms_log_reader import iter_log_lines, list_log_files
+
 def extract_issues(log_dir):
     """Extract timeout and error events from logs from Feb 2025 onwards."""
     timeouts = []
     errors = []
     
-    # Find all SMS log files and filter for Feb 2025 onwards (20250201 or greater)
-    all_logs = [f for f in os.listdir(log_dir) if f.startswith('SMS_Log_')]
-    recent_logs = [f for f in all_logs if f >= 'SMS_Log_20250201.log']
+    # Find all SMS log files (raw or archived) and filter for Feb 2025 onwards (20250201 or greater)
+    all_logs = list_log_files(log_dir)
+    recent_logs = [f for f in all_logs if os.path.basename(f) >= 'SMS_Log_20250201']
     
     print(f"Found {len(all_logs)} total log files")
     print(f"Using {len(recent_logs)} log files from February 2025 onwards")
     
     # Process each log file
-    for log_file in sorted(recent_logs):
-        file_path = os.path.join(log_dir, log_file)
+    for file_path in recent_logs:
+        log_file = os.path.basename(file_path)
         
         # Extract date from filename
-        date_match = re.search(r'SMS_Log_(\d{8})\.log', log_file)
+        date_match = re.search(r'SMS_Log_(\d{8})\.', log_file)
         if date_match:
             log_date = date_match.group(1)
         else:
             continue  # Skip files that don't match the expected pattern
         
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
+        for line_num, line in enumerate(iter_log_lines(file_path), 1):
+            line = line.strip()
+            if not line:
+                continue
+                
+            try:
+                # Parse the JSON log entry
+                log_entry = json.loads(line)
+                
+                # Check for timeout events
+                if ('Timeout' in log_entry.get('EventType', '') or 
+                    'timeout' in log_entry.get('Details', '').lower()):
+                    timeouts.append({
+                        'log_file': log_file,
+                        'line_num': line_num,
+                        'raw_data': line,
+                        'date': log_date
+                    })
+                
+                # Check for error events (excluding timeouts)
+                elif ((log_entry.get('Level') == 'ERROR' or 
+                      'failed' in log_entry.get('Details', '').lower() or
+                      'Failed' in log_entry.get('Details', '') or
+                      'fail' in log_entry.get('EventType', '').lower()) and
+                      'Timeout' not in log_entry.get('EventType', '')):
                     
-                try:
-                    # Parse the JSON log entry
-                    log_entry = json.loads(line)
+                    # Extract phone number if available (for information only, not for filename)
+                    phone_match = re.search(r'Number: (\+?\d+)|PhoneNumber: (\+?\d+)', 
+                                          log_entry.get('Details', ''))
+                    # Also try to extract phone numbers without the "Number:" or "PhoneNumber:" prefix
+                    if not phone_match:
+                        phone_match = re.search(r'SMS to (\+?\d+)', log_entry.get('Details', ''))
                     
-                    # Check for timeout events
-                    if ('Timeout' in log_entry.get('EventType', '') or 
-                        'timeout' in log_entry.get('Details', '').lower()):
-                        timeouts.append({
-                            'log_file': log_file,
-                            'line_num': line_num,
-                            'raw_data': line,
-                            'date': log_date
-                        })
+                    phone = None
+                    if phone_match:
+                        for group in phone_match.groups():
+                            if group:
+                                phone = group
+                                break
                     
-                    # Check for error events (excluding timeouts)
-                    elif ((log_entry.get('Level') == 'ERROR' or 
-                          'failed' in log_entry.get('Details', '').lower() or
-                          'Failed' in log_entry.get('Details', '') or
-                          'fail' in log_entry.get('EventType', '').lower()) and
-                          'Timeout' not in log_entry.get('EventType', '')):
-                        
-                        # Extract phone number if available (for information only, not for filename)
-                        phone_match = re.search(r'Number: (\+?\d+)|PhoneNumber: (\+?\d+)', 
-                                              log_entry.get('Details', ''))
-                        # Also try to extract phone numbers without the "Number:" or "PhoneNumber:" prefix
-                        if not phone_match:
-                            phone_match = re.search(r'SMS to (\+?\d+)', log_entry.get('Details', ''))
-                        
-                        phone = None
-                        if phone_match:
-                            for group in phone_match.groups():
-                                if group:
-                                    phone = group
-                                    break
-                        
-                        if not phone:
-                            phone = 'Unknown'
-                            
-                        # Normalize phone numbers (strip '+' for consistent comparison)
-                        if phone != 'Unknown':
-                            phone = phone.lstrip('+')
+                    if not phone:
+                        phone = 'Unknown'
                         
-                        errors.append({
-                            'log_file': log_file,
-                            'line_num': line_num,
-                            'raw_data': line,
-                            'phone': phone,
-                            'date': log_date
-                        })
-                        
-                except (json.JSONDecodeError, KeyError):
-                    continue  # Skip malformed lines
+                    # Normalize phone numbers (strip '+' for consistent comparison)
+                    if phone != 'Unknown':
+                        phone = phone.lstrip('+')
+                    
+                    errors.append({
+                        'log_file': log_file,
+                        'line_num': line_num,
+                        'raw_data': line,
+                        'phone': phone,
+                        'date': log_date
+                    })
+                    
+            except (json.JSONDecodeError, KeyError):
+                continue  # Skip malformed lines
     
     return timeouts, errors
 
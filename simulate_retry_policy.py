@@ -0,0 +1,409 @@
+"""Predict what alternative timeout, retry and concurrency policies would do to outbound SMS.
+
+The recorded logs say, for messages sent in each hour, how often the send itself failed and how
+long it took from send to a final status (Delivered or Failed), or that no status ever came. This
+script fits those distributions per site and replays the recorded arrivals through a
+discrete-event model of the outbound path under every policy in a sweep, predicting the
+delivered, failed and gave-up rates and the end-to-end latency from queueing to delivery.
+
+The bridge today, the baseline policy:
+
+    SmsQueueService dequeues one message per 5s timer tick (PROCESS_INTERVAL_MS)
+    there is no limit on messages in flight
+    JustRemotePhone gives up on a message 630s after sending it (MESSAGE_TIMEOUT_MS)
+    nothing is retried
+
+A policy changes the timeout, the retries after a send failure or timeout (and optionally after
+a Failed status), the exponential backoff before each retry, the tick, the messages dequeued
+per tick and a cap on messages in flight. A retry goes back on the queue behind whatever is
+waiting when its backoff ends.
+
+Each attempt draws its outcome from the calendar hour it is sent in, falling back to the same
+hour of day across the whole period when that hour has too few sends. Outages of an hour or more
+therefore carry over to retries sent inside them, but attempts within an hour are independent,
+which flatters retries during shorter outages. A status later than the bridge's own timeout is
+only seen when it arrived late anyway, so the gain from a longer timeout is a lower bound. Every
+policy replays the same random draws, so the differences between policies are not noise.
+"""
+import argparse
+import heapq
+import itertools
+import os
+import sys
+import time
+from collections import deque, namedtuple
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from analyze_sms_logs import load_log_data, summarise_message_lifecycles
+from sms_log_reader import MAX_IN_FLIGHT_SECONDS
+
+DELIVERED, FAILED, GAVE_UP = 0, 1, 2
+OUTCOME_NAMES = ['Delivered', 'Failed', 'Gave up trying']
+NO_STATUS = np.inf  # Latency of a sent message whose final status never arrived
+
+SEND_FAILURE_EVENTS = ['SendFailure', 'SendFailed', 'SendException']
+BASELINE = dict(timeout=MAX_IN_FLIGHT_SECONDS, retries=0, backoff=(60.0, 2.0, 3600.0), tick=5.0, per_tick=1, max_in_flight=0, retry_failed=False)
+
+Policy = namedtuple('Policy', ['timeout', 'retries', 'backoff', 'tick', 'per_tick', 'max_in_flight', 'retry_failed'])
+
+class OutcomeModel:
+    """Per-hour send failure rates and send-to-status latency samples for one site.
+
+    Hours are numbered from the epoch of the naive local timestamps, so hour % 24 is the hour of
+    day. There is a pool per calendar hour, then one per hour of day and one for everything. A
+    calendar hour with fewer than min_samples attempts (or sends, for latency) uses its hour-of-day
+    pool, and a sparse hour of day the overall one.
+    """
+
+    def __init__(self, attempts, min_samples):
+        # attempts: one row per dequeued message with hour, send_failed, latency and status
+        hours = attempts['hour'].to_numpy()
+        self.first_hour = int(hours.min())
+        calendar = hours - self.first_hour
+        n_calendar = int(calendar.max()) + 1
+        hour_of_day = hours % 24
+        send_failed = attempts['send_failed'].to_numpy()
+        sent = ~send_failed
+
+        # Pool ids: calendar hours first, then the 24 hours of day, then everything
+        day_pool = n_calendar + hour_of_day
+        all_pool = n_calendar + 24
+        n_pools = all_pool + 1
+
+        def counts(pool_ids, mask):
+            return np.bincount(pool_ids[mask], minlength=n_pools)
+
+        dequeued = counts(calendar, np.ones(len(hours), bool)) + counts(day_pool, np.ones(len(hours), bool))
+        dequeued[all_pool] = len(hours)
+        failures = counts(calendar, send_failed) + counts(day_pool, send_failed)
+        failures[all_pool] = send_failed.sum()
+        sends = counts(calendar, sent) + counts(day_pool, sent)
+        sends[all_pool] = sent.sum()
+
+        def fallback(enough):
+            # Each calendar hour falls back to its hour of day, and each hour of day to everything
+            pool_of = np.arange(n_pools)
+            pool_of[n_calendar:all_pool] = np.where(enough[n_calendar:all_pool], pool_of[n_calendar:all_pool], all_pool)
+            hour_of_day_of_calendar = (np.arange(n_calendar) + self.first_hour) % 24
+            pool_of[:n_calendar] = np.where(enough[:n_calendar], pool_of[:n_calendar], pool_of[n_calendar + hour_of_day_of_calendar])
+            return pool_of
+
+        self.failure_pool = fallback(dequeued >= min_samples)
+        self.latency_pool = fallback(sends >= min_samples)
+        self.failure_rate = np.divide(failures, dequeued, out=np.zeros(n_pools), where=dequeued > 0)
+        self.n_calendar = n_calendar
+
+        # Latency samples of every pool laid end to end, so a draw is one index into flat arrays
+        latency = attempts.loc[sent, 'latency'].to_numpy()
+        status = attempts.loc[sent, 'status'].to_numpy()
+        sent_calendar = calendar[sent]
+        pools = [np.flatnonzero(sent_calendar == c) for c in range(n_calendar)]
+        pools += [np.flatnonzero(hour_of_day[sent] == h) for h in range(24)]
+        pools.append(np.arange(sent.sum()))
+        self.pool_start = np.cumsum([0] + [len(p) for p in pools[:-1]])
+        self.pool_size = np.array([len(p) for p in pools])
+        order = np.concatenate(pools) if pools else np.array([], dtype=int)
+        self.latency = latency[order].tolist()
+        self.status = status[order].tolist()
+        self.failure_pool, self.latency_pool = self.failure_pool.tolist(), self.latency_pool.tolist()
+        self.failure_rate = self.failure_rate.tolist()
+        self.pool_start, self.pool_size = self.pool_start.tolist(), self.pool_size.tolist()
+
+    def pool(self, hour):
+        """Index of the calendar hour's pool, or of its hour of day outside the recorded period."""
+        calendar = hour - self.first_hour
+        return calendar if 0 <= calendar < self.n_calendar else self.n_calendar + hour % 24
+
+    def draw(self, at, u_fail, u_pick):
+        """Outcome of a send at the given time: (send failed, latency to final status, status)."""
+        pool = self.pool(int(at // 3600))
+        if u_fail < self.failure_rate[self.failure_pool[pool]]:
+            return True, 0.0, FAILED
+        latency_pool = self.latency_pool[pool]
+        size = self.pool_size[latency_pool]
+        if size == 0:
+            return True, 0.0, FAILED  # Nothing was ever sent successfully
+        i = self.pool_start[latency_pool] + int(u_pick * size)
+        return False, self.latency[i], self.status[i]
+
+def epoch_seconds(timestamps):
+    """Seconds since 1970 of naive local timestamps, keeping the local wall clock."""
+    return (pd.to_datetime(timestamps) - pd.Timestamp(1970, 1, 1)).dt.total_seconds()
+
+def recorded_messages(df_events):
+    """One row per message with its arrival, what happened to its send and its recorded outcome."""
+    lifecycles = summarise_message_lifecycles(df_events)
+    status_events = df_events[df_events['event_type'] == 'DeliveryStatus']
+    first_status = status_events.sort_values('timestamp').groupby('message_id').first()
+    send_failed_ids = df_events.loc[df_events['event_type'].isin(SEND_FAILURE_EVENTS), 'message_id']
+
+    messages = pd.DataFrame(index=lifecycles.index)
+    messages['site'] = lifecycles['site']
+    messages['outcome'] = lifecycles['outcome']
+    messages['arrived'] = epoch_seconds(lifecycles['queued_at'].fillna(lifecycles['dequeued_at']).fillna(lifecycles['sent_at']))
+    messages['dequeued'] = epoch_seconds(lifecycles['dequeued_at'].fillna(lifecycles['sent_at']))
+    messages['sent'] = epoch_seconds(lifecycles['sent_at'])
+    messages['status_at'] = epoch_seconds(first_status['timestamp'].reindex(messages.index))
+    messages['status'] = first_status['status'].reindex(messages.index)
+    messages['send_failed'] = messages.index.isin(send_failed_ids) & messages['sent'].isna()
+    return messages.dropna(subset=['arrived'])
+
+def fit_attempts(messages, log_end):
+    """Turn recorded messages into attempt samples for OutcomeModel.
+
+    Sends still inside the bridge's timeout when the logs end have an unknown outcome and are left
+    out rather than counted as never getting a status.
+    """
+    attempts = messages.dropna(subset=['dequeued']).copy()
+    attempts = attempts[attempts['send_failed'] | attempts['sent'].notna()]
+    open_at_end = attempts['sent'].notna() & attempts['status_at'].isna() & (attempts['sent'] > log_end - MAX_IN_FLIGHT_SECONDS)
+    attempts = attempts[~open_at_end]
+
+    attempts['hour'] = (attempts['dequeued'] // 3600).astype(int)
+    attempts['latency'] = (attempts['status_at'] - attempts['sent']).clip(lower=0).fillna(NO_STATUS)
+    attempts['status'] = np.where(attempts['status'] == 'Delivered', DELIVERED, np.where(attempts['status'].notna(), FAILED, GAVE_UP))
+    return attempts[['hour', 'send_failed', 'latency', 'status']]
+
+def backoff_delay(policy, retry):
+    """Seconds to wait before the given retry (1 for the first)."""
+    base, factor, cap = policy.backoff
+    return min(base * factor ** (retry - 1), cap)
+
+def simulate(arrivals, model, policy, u_fail, u_pick):
+    """Replay sorted arrival times through the queue under a policy.
+
+    Returns per-message outcome, finish time and attempts, and how many retries were sent after a
+    timeout for a message whose original would still have been delivered (a duplicate SMS).
+    """
+    n = len(arrivals)
+    tick, per_tick, cap = policy.tick, policy.per_tick, policy.max_in_flight
+    outcome = np.full(n, GAVE_UP)
+    finished = np.full(n, np.nan)
+    attempts = np.zeros(n, dtype=int)
+    duplicates = 0
+
+    queue = deque()
+    retries = []  # (ready at, message, attempt)
+    in_flight = []  # finish times, only kept when in-flight messages are capped
+    arrivals = arrivals.tolist()
+    next_arrival = 0
+    now = -(-arrivals[0] // tick) * tick if n else 0
+
+    while next_arrival < n or queue or retries:
+        # New messages and retries join the queue in the order they became ready
+        while True:
+            arrival_ready = next_arrival < n and arrivals[next_arrival] <= now
+            retry_ready = retries and retries[0][0] <= now
+            if arrival_ready and (not retry_ready or arrivals[next_arrival] <= retries[0][0]):
+                queue.append((next_arrival, 0))
+                next_arrival += 1
+            elif retry_ready:
+                _, message, attempt = heapq.heappop(retries)
+                queue.append((message, attempt))
+            else:
+                break
+
+        if cap:
+            while in_flight and in_flight[0] <= now:
+                heapq.heappop(in_flight)
+
+        dispatched = 0
+        while queue and dispatched < per_tick and not (cap and len(in_flight) >= cap):
+            message, attempt = queue.popleft()
+            dispatched += 1
+            attempts[message] = attempt + 1
+            send_failed, latency, status = model.draw(now, u_fail[message, attempt], u_pick[message, attempt])
+
+            if send_failed:
+                result, end, retry = FAILED, now, True
+            elif status != GAVE_UP and latency <= policy.timeout:
+                result, end, retry = status, now + latency, status == FAILED and policy.retry_failed
+            else:
+                result, end, retry = GAVE_UP, now + policy.timeout, True
+            if cap and end > now:
+                heapq.heappush(in_flight, end)
+
+            if retry and attempt < policy.retries:
+                if result == GAVE_UP and status == DELIVERED:
+                    duplicates += 1
+                heapq.heappush(retries, (end + backoff_delay(policy, attempt + 1), message, attempt + 1))
+            else:
+                outcome[message] = result
+                finished[message] = end
+
+        # Tick on while work is waiting, otherwise skip ahead to the tick after the next arrival or retry
+        if queue and not (cap and len(in_flight) >= cap):
+            now += tick
+        else:
+            upcoming = [t for t in (arrivals[next_arrival] if next_arrival < n else None, retries[0][0] if retries else None,
+                                    in_flight[0] if queue and in_flight else None) if t is not None]
+            if not upcoming:
+                break
+            now = max(now + tick, -(-min(upcoming) // tick) * tick)
+
+    return outcome, finished, attempts, duplicates
+
+def summarise_run(outcomes, latencies, attempts, duplicates):
+    """Rates and percentiles of one policy over every site."""
+    outcomes = np.concatenate(outcomes)
+    latencies = np.concatenate(latencies)
+    attempts = np.concatenate(attempts)
+    delivered = latencies[outcomes == DELIVERED]
+    n = len(outcomes)
+    row = {name.lower().replace(' ', '_'): 100 * (outcomes == code).sum() / n for code, name in enumerate(OUTCOME_NAMES)}
+    row['gave_up'] = row.pop('gave_up_trying')
+    for q in (50, 90, 99):
+        row[f'p{q}'] = np.percentile(delivered, q) if len(delivered) else np.nan
+    row['attempts_per_message'] = attempts.mean()
+    row['duplicates'] = duplicates
+    return row
+
+def run_policy(sites, policy):
+    """Simulate every site under one policy and summarise the result."""
+    outcomes, latencies, all_attempts, duplicates = [], [], [], 0
+    for arrivals, model, u_fail, u_pick in sites:
+        outcome, finished, attempts, site_duplicates = simulate(arrivals, model, policy, u_fail, u_pick)
+        outcomes.append(outcome)
+        latencies.append(finished - arrivals)
+        all_attempts.append(attempts)
+        duplicates += site_duplicates
+    return summarise_run(outcomes, latencies, all_attempts, duplicates)
+
+def parse_backoff(text):
+    """Parse 'base,factor[,cap]' in seconds, e.g. 60,2,900."""
+    parts = [float(p) for p in text.split(',')]
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError(f"Backoff must be base,factor[,cap], got '{text}'")
+    return tuple(parts) if len(parts) == 3 else (parts[0], parts[1], 3600.0)
+
+def sweep_policies(args):
+    """Every combination of the swept settings; backoff only varies where something is retried."""
+    policies = []
+    retry_failed_options = [False, True] if args.retry_failed else [False]
+    for timeout, retries, tick, per_tick, max_in_flight in itertools.product(args.timeout, args.retries, args.tick, args.per_tick, args.max_in_flight):
+        for backoff, retry_failed in itertools.product(args.backoff if retries else args.backoff[:1], retry_failed_options if retries else [False]):
+            policies.append(Policy(timeout, retries, backoff, tick, per_tick, max_in_flight, retry_failed))
+    # Backoff does nothing without retries, so the baseline takes the swept one and is only run once
+    baseline = Policy(**{**BASELINE, 'backoff': args.backoff[0]})
+    if baseline not in policies:
+        policies.insert(0, baseline)
+    return policies, baseline
+
+def fit_sites(messages, min_samples, max_attempts, rng):
+    """Fit an outcome model per site and draw the random numbers every policy replays.
+
+    Returns (arrivals, model, u_fail, u_pick) per site, and the arrivals of sites that had no
+    dequeued messages to fit a model to, by site, which the sweep leaves out.
+    """
+    log_end = messages[['arrived', 'dequeued', 'sent', 'status_at']].max().max()
+    sites, unfitted = [], {}
+    for site, site_messages in messages.groupby('site'):
+        attempts = fit_attempts(site_messages, log_end)
+        if len(attempts) == 0:
+            unfitted[site] = len(site_messages)
+            continue
+        model = OutcomeModel(attempts, min_samples)
+        arrivals = np.sort(site_messages['arrived'].to_numpy())
+        sites.append((arrivals, model, rng.random((len(arrivals), max_attempts)), rng.random((len(arrivals), max_attempts))))
+        print(f"Fitted {site or 'site'}: {len(arrivals)} arrivals, {len(attempts)} dequeued, {model.n_calendar} hours")
+    for site, count in unfitted.items():
+        print(f"Left out {site or 'site'}: {count} arrivals but no dequeued messages to fit outcomes to")
+    return sites, unfitted
+
+def describe(policy):
+    backoff = f", backoff {policy.backoff[0]:g}s x{policy.backoff[1]:g} (cap {policy.backoff[2]:g}s)" if policy.retries else ""
+    backoff += ", also after Failed" if policy.retry_failed else ""
+    in_flight = f", max {policy.max_in_flight} in flight" if policy.max_in_flight else ""
+    return f"timeout {policy.timeout:g}s, {policy.retries} retries{backoff}, {policy.per_tick} per {policy.tick:g}s tick{in_flight}"
+
+def report_recorded(messages, title="RECORDED OUTCOMES"):
+    """Print the recorded outcomes the baseline simulation should reproduce."""
+    print(f"\n===== {title} =====")
+    print(f"Messages: {len(messages)}")
+    for name in OUTCOME_NAMES:
+        count = (messages['outcome'] == name).sum()
+        print(f"{name}: {count} ({100 * count / len(messages):.2f}%)")
+    delivered = messages[messages['outcome'] == 'Delivered']
+    latency = (delivered['status_at'] - delivered['arrived']).dropna()
+    if len(latency):
+        print(f"End-to-end delivered latency: p50 {latency.quantile(0.5):.1f}s, p90 {latency.quantile(0.9):.1f}s, p99 {latency.quantile(0.99):.1f}s")
+
+def plot_sweep(results, path):
+    plt.figure(figsize=(10, 6))
+    for retries, group in results.groupby('retries'):
+        plt.scatter(group['p90'], group['gave_up'], label=f"{retries} retries", alpha=0.7)
+    baseline = results[results['baseline']]
+    plt.scatter(baseline['p90'], baseline['gave_up'], color='black', marker='x', s=100, label='Today')
+    plt.title('Predicted Gave Up Rate vs 90th Percentile Delivered Latency by Policy')
+    plt.xlabel('p90 End-to-End Delivered Latency (seconds)')
+    plt.ylabel('Gave Up Trying (%)')
+    plt.legend()
+    plt.savefig(path)
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Simulate timeout, retry and concurrency policies against recorded SMS traffic")
+    parser.add_argument("--log-dir", nargs="+", default=["od_logs"], help="Directories containing SMS log files, one per site, optionally as site=path")
+    parser.add_argument("--timeout", nargs="+", type=float, default=[300, 630, 1200, 1800], help="Seconds to wait for a final status before giving up or retrying")
+    parser.add_argument("--retries", nargs="+", type=int, default=[0, 1, 2, 3], help="Retries after a send failure or timeout")
+    parser.add_argument("--backoff", nargs="+", type=parse_backoff, default=[(30.0, 2.0, 3600.0), (120.0, 2.0, 3600.0), (600.0, 1.0, 3600.0)], help="Backoffs as base,factor[,cap] seconds")
+    parser.add_argument("--tick", nargs="+", type=float, default=[5.0, 1.0], help="Seconds between queue timer ticks")
+    parser.add_argument("--per-tick", nargs="+", type=int, default=[1, 5], help="Messages dequeued per tick")
+    parser.add_argument("--max-in-flight", nargs="+", type=int, default=[0, 20], help="Cap on messages sent and awaiting a status, 0 for none")
+    parser.add_argument("--retry-failed", action="store_true", help="Also sweep policies that retry messages with a Failed delivery status")
+    parser.add_argument("--min-samples", type=int, default=30, help="Fewest sends for an hour to use its own distributions (default: 30)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed shared by every policy")
+    parser.add_argument("--top", type=int, default=15, help="Number of best policies to print (default: 15)")
+    parser.add_argument("--output-dir", default=".", help="Directory to save output files")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    df_deliveries, df_timeouts, df_errors, df_events = load_log_data(args.log_dir)
+    if df_events is None:
+        print("No lifecycle events found in the logs")
+        sys.exit(1)
+
+    messages = recorded_messages(df_events)
+    report_recorded(messages)
+
+    policies, baseline = sweep_policies(args)
+    max_attempts = max(policy.retries for policy in policies) + 1
+    sites, unfitted = fit_sites(messages, args.min_samples, max_attempts, np.random.default_rng(args.seed))
+    if not sites:
+        print("No site has dequeued messages to fit a model to")
+        sys.exit(1)
+    if unfitted:
+        report_recorded(messages[~messages['site'].isin(list(unfitted))], "RECORDED OUTCOMES OF FITTED SITES")
+
+    print(f"\n===== POLICY SWEEP ({len(policies)} policies) =====")
+    started = time.perf_counter()
+    rows = []
+    for policy in policies:
+        rows.append({**policy._asdict(), 'baseline': policy == baseline, **run_policy(sites, policy)})
+    print(f"Simulated in {time.perf_counter() - started:.1f}s")
+
+    results = pd.DataFrame(rows)
+    results['backoff'] = results['backoff'].map(lambda b: ','.join(f"{x:g}" for x in b))
+    today = results[results['baseline']].iloc[0]
+    print(f"\nToday ({describe(baseline)}):")
+    print(f"Delivered {today['delivered']:.2f}%, failed {today['failed']:.2f}%, gave up {today['gave_up']:.2f}%, "
+          f"delivered latency p50 {today['p50']:.1f}s, p90 {today['p90']:.1f}s, p99 {today['p99']:.1f}s")
+
+    ranked = results.sort_values(['gave_up', 'failed', 'p90']).head(args.top)
+    print(f"\nTop {args.top} Policies by Gave Up, then Failed, then p90 Latency:")
+    for _, row in ranked.iterrows():
+        policy = Policy(row['timeout'], row['retries'], parse_backoff(row['backoff']), row['tick'], row['per_tick'], row['max_in_flight'], row['retry_failed'])
+        print(f"{describe(policy)}: delivered {row['delivered']:.2f}%, failed {row['failed']:.2f}%, gave up {row['gave_up']:.2f}%, "
+              f"p50 {row['p50']:.1f}s, p90 {row['p90']:.1f}s, p99 {row['p99']:.1f}s, {row['attempts_per_message']:.2f} attempts/message, "
+              f"{row['duplicates']} possible duplicates")
+
+    results_path = os.path.join(args.output_dir, 'retry_policy_sweep.csv')
+    results.to_csv(results_path, index=False)
+    plot_sweep(results, os.path.join(args.output_dir, 'retry_policy_sweep.png'))
+    print(f"\nSaved all policies to {results_path}")
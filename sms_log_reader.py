@@ -0,0 +1,379 @@
+"""Read SMS_Log_* files from one or more od_logs directories.
+
+Every analysis script reads the same daily JSON-lines logs written by Services/Logger.cs.
+This module holds the shared pieces: finding the daily files, decoding their entries, and
+merging the logs of several sites (practices) into one time-ordered stream.
+
+Closed days may have been compacted by compact_sms_logs.py into SMS_Log_YYYYMMDD.smsa
+archives. The functions here read those transparently, so a day looks the same to the
+analysis scripts whether it is raw or archived.
+"""
+import base64
+import datetime
+import gzip
+import heapq
+import json
+import os
+import re
+from functools import lru_cache
+from itertools import chain, islice
+from operator import itemgetter
+
+import numpy as np
+
+EMPTY_GUID = '00000000-0000-0000-0000-000000000000'
+
+# JustRemotePhone gives up on a message after MESSAGE_TIMEOUT_MS (10.5 minutes)
+MAX_IN_FLIGHT_SECONDS = 630
+ARCHIVE_SUFFIX = '.smsa'
+ARCHIVE_FORMAT = 'sms-log-archive'
+ARCHIVE_VERSION = 1
+
+# Archived timestamps are stored as 100ns ticks since this epoch, like .NET DateTime
+TICKS_EPOCH = datetime.datetime(1970, 1, 1)
+TICKS_PER_SECOND = 10_000_000
+
+# Integer columns are packed little-endian; ticks need 64 bits, dictionary and template IDs 32
+TICKS_DTYPE = '<i8'
+INDEX_DTYPE = '<i4'
+
+# Masked Details values only ever contain word characters, '+', '.' and '-', so they are stored
+# for the whole day in one string joined by a control character
+PARAM_SEPARATOR = '\x1f'
+
+# Variable parts of Details text, most specific first. Masking them turns a Details string into a
+# template that many lines share, plus the parameters that were masked out.
+TEMPLATE_PATTERN = re.compile(
+    r'(?P<GUID>\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b)'
+    r'|(?P<PHONE>\+\d{7,15}\b|\b\d{9,15}\b)'
+    r'|(?P<ID>\b(?=[A-Za-z0-9_-]*\d)(?=[A-Za-z0-9_-]*[A-Za-z])[A-Za-z0-9_-]{12,}\b)'
+    r'|(?P<NUM>\d+(?:\.\d+)*)'
+)
+PLACEHOLDER_PATTERN = re.compile(r'<(?:GUID|PHONE|ID|NUM)>')
+
+# Characters System.Text.Json's default encoder escapes: controls, non-ASCII and HTML-sensitive ones
+DOTNET_ESCAPE_PATTERN = re.compile(r'[^\x20-\x7e]|["\\&\'+<>`]')
+DOTNET_SHORT_ESCAPES = {'"': '\\"', '\\': '\\\\', '\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+
+def get_message_id(log_entry):
+    """Return the message ID of a log entry, from the old MessageId field or SMSBridgeID."""
+    message_id = log_entry.get('MessageId') or log_entry.get('SMSBridgeID') or ''
+    return '' if EMPTY_GUID in message_id else message_id
+
+@lru_cache(maxsize=65536)
+def extract_template(details):
+    """Split Details text into a template with <GUID>/<PHONE>/<ID>/<NUM> placeholders and the masked values."""
+    params = []
+
+    def mask(match):
+        params.append(match.group(0))
+        return f"<{match.lastgroup}>"
+
+    template = TEMPLATE_PATTERN.sub(mask, details)
+    return template, tuple(params)
+
+@lru_cache(maxsize=65536)
+def template_literals(template):
+    """Return the literal text around a template's placeholders, one more piece than placeholders."""
+    return PLACEHOLDER_PATTERN.split(template)
+
+def fill_template(template, params):
+    """Put masked values back into a template, the inverse of extract_template()."""
+    literals = template_literals(template)
+    if len(literals) != len(params) + 1:
+        raise ValueError(f"Template expects {len(literals) - 1} parameters, got {len(params)}")
+    pieces = [literals[0]]
+    for param, literal in zip(params, literals[1:]):
+        pieces.append(param)
+        pieces.append(literal)
+    return ''.join(pieces)
+
+def _escape_char(match):
+    char = match.group(0)
+    escaped = DOTNET_SHORT_ESCAPES.get(char)
+    if escaped is not None:
+        return escaped
+    encoded = char.encode('utf-16-be')
+    return ''.join(f'\\u{encoded[i]:02X}{encoded[i + 1]:02X}' for i in range(0, len(encoded), 2))
+
+def dotnet_escape(text):
+    """Escape a string the way the bridge's JSON serializer writes it inside quotes."""
+    return DOTNET_ESCAPE_PATTERN.sub(_escape_char, text)
+
+def json_unescape(raw):
+    """Decode the text between the quotes of a JSON string."""
+    return json.loads(f'"{raw}"') if '\\' in raw else raw
+
+def format_ticks(ticks):
+    """Format ticks since TICKS_EPOCH as the date, time and 7 fractional digits of a round-trip timestamp."""
+    seconds, fraction = divmod(ticks, TICKS_PER_SECOND)
+    return f"{(TICKS_EPOCH + datetime.timedelta(seconds=seconds)).isoformat()}.{fraction:07d}"
+
+def parse_site(log_dir_arg):
+    """Split a 'site=path' argument into (site, path). A bare path is named after its directory."""
+    if '=' in log_dir_arg and not os.path.isdir(log_dir_arg):
+        site, log_dir = log_dir_arg.split('=', 1)
+        return site, log_dir
+
+    # Every site's directory is called od_logs, so name it after the directory above instead
+    path = os.path.normpath(os.path.abspath(log_dir_arg))
+    name = os.path.basename(path)
+    if name.lower() == 'od_logs':
+        name = os.path.basename(os.path.dirname(path)) or name
+    return name, log_dir_arg
+
+def is_archive(file_path):
+    """Return True if the path is a compacted archive rather than a raw daily log."""
+    return file_path.endswith(ARCHIVE_SUFFIX)
+
+def list_log_files(log_dir):
+    """Return one path per day of SMS_Log_YYYYMMDD files in a directory, oldest first.
+
+    When a day exists both raw and archived (compacted with --keep-raw), the archive is used.
+    """
+    days = {}
+    for f in sorted(os.listdir(log_dir)):
+        if not f.startswith('SMS_Log_'):
+            continue
+        day = os.path.splitext(f)[0]
+        if day not in days or is_archive(f):
+            days[day] = os.path.join(log_dir, f)
+    return [days[day] for day in sorted(days)]
+
+def read_archive(file_path):
+    """Load the header and columns of an archive written by compact_sms_logs.py."""
+    with gzip.open(file_path, 'rt', encoding='utf-8') as f:
+        archive = json.load(f)
+    if archive.get('format') != ARCHIVE_FORMAT or archive.get('version') != ARCHIVE_VERSION:
+        raise ValueError(f"{file_path} is not a version {ARCHIVE_VERSION} SMS log archive")
+    return archive
+
+def pack_ints(values, dtype):
+    """Pack a column of integers as base64 of little-endian binary, for numpy to unpack in one go."""
+    return base64.b64encode(np.asarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+def unpack_ints(text, dtype):
+    """Unpack a column of integers written by pack_ints()."""
+    return np.frombuffer(base64.b64decode(text), dtype=dtype)
+
+def _decode_dictionary_column(column, raw):
+    values = column['values'] if raw else [json_unescape(v) for v in column['values']]
+    return list(map(values.__getitem__, unpack_ints(column['index'], INDEX_DTYPE).tolist()))
+
+def _decode_timestamp_column(column, raw):
+    suffixes = column['suffixes'] if raw else [json_unescape(s) for s in column['suffixes']]
+    suffix_ids = unpack_ints(column['suffix'], INDEX_DTYPE)
+
+    # Verbatim timestamps have a zero delta, so the running total skips over them. numpy formats
+    # nanoseconds; dropping the last two digits leaves the 7 fractional digits .NET writes.
+    ticks = np.cumsum(unpack_ints(column['delta'], TICKS_DTYPE))
+    times = np.datetime_as_string((ticks * 100).astype('datetime64[ns]'), unit='ns').astype('U27').tolist()
+
+    # Verbatim timestamps have suffix -1 and are replaced below; a day of only those has no suffixes
+    if len(suffixes) == 1:
+        decoded = [time + suffixes[0] for time in times]
+    else:
+        decoded = [time + suffixes[suffix] if suffix >= 0 else time for time, suffix in zip(times, suffix_ids.tolist())]
+    for position, text in column['raw']:
+        decoded[position] = text if raw else json_unescape(text)
+    return decoded
+
+def _decode_details_column(column, raw):
+    literals = [template_literals(template) for template in column['templates']]
+    template_ids = unpack_ints(column['template'], INDEX_DTYPE).tolist()
+    params = iter(column['params'].split(PARAM_SEPARATOR)) if column['params'] else iter(())
+    decoded = []
+    for template in template_ids:
+        if template < 0:
+            decoded.append(None)
+            continue
+        pieces = literals[template]
+        count = len(pieces) - 1
+        if count == 0:
+            text = pieces[0]
+        elif count == 1:
+            text = pieces[0] + next(params) + pieces[1]
+        else:
+            text = ''.join(chain.from_iterable(zip(pieces, islice(params, count)))) + pieces[-1]
+        decoded.append(dotnet_escape(text) if raw else text)
+    for position, text in column['raw']:
+        decoded[position] = text if raw else json_unescape(text)
+    return decoded
+
+def _iter_archive(archive, raw):
+    """Yield every row of an archive: the exact line text when raw, otherwise the decoded entry.
+
+    Each column is decoded in one go, with repeated values decoded once. Raw lines keep their
+    line terminator. Lines that could not be structured were stored verbatim; as entries they
+    are decoded with json.loads and skipped if malformed.
+    """
+    column_decoders = {
+        'Timestamp': _decode_timestamp_column,
+        'Details': _decode_details_column
+    }
+    columns = {
+        name: column_decoders.get(name, _decode_dictionary_column)(column, raw)
+        for name, column in archive['columns'].items()
+    }
+    layouts = archive['layouts']
+    newline = archive['newline']
+
+    def build(keys, values):
+        if raw:
+            return '{' + ','.join(f'"{key}":"{value}"' for key, value in zip(keys, values)) + '}' + newline
+        return dict(zip(keys, values))
+
+    # The usual day: every line has the same keys, so the columns zip straight into rows
+    if len(layouts) == 1 and not archive['raw']:
+        keys = layouts[0]
+        rows = zip(*(columns[key] for key in keys))
+        if raw:
+            yield from (build(keys, values) for values in rows)
+        else:
+            yield from (dict(zip(keys, values)) for values in rows)
+        return
+
+    verbatim = dict(archive['raw'])
+    cursors = {name: iter(values) for name, values in columns.items()}
+    for row, layout in enumerate(unpack_ints(archive['layout'], INDEX_DTYPE).tolist()):
+        if layout < 0:
+            line = verbatim[row]
+            if raw:
+                yield line
+            elif line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Skip malformed lines
+            continue
+
+        keys = layouts[layout]
+        yield build(keys, [next(cursors[key]) for key in keys])
+
+def is_columnar(archive):
+    """Return True if every line of an archive has the same keys, so row i is item i of every column."""
+    return len(archive['layouts']) == 1 and not archive['raw']
+
+def archive_ticks(archive):
+    """Return the timestamp of every row as ticks since TICKS_EPOCH, in the time zone it was logged in.
+
+    Timestamps stored verbatim get the ticks of the row before them; they are listed in the
+    Timestamp column's 'raw'.
+    """
+    return np.cumsum(unpack_ints(archive['columns']['Timestamp']['delta'], TICKS_DTYPE))
+
+def iter_archive_rows(archive, rows):
+    """Yield the decoded entries of the given rows of a columnar archive, decoding nothing else.
+
+    Dictionary values are unescaped only when a selected row uses them, and a Details parameter
+    is found by its offset instead of walking the parameters of every row before it.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    keys = archive['layouts'][0]
+    columns = {}
+    for key in keys:
+        column = archive['columns'][key]
+        if key == 'Timestamp':
+            ticks = archive_ticks(archive)[rows]
+            times = np.datetime_as_string((ticks * 100).astype('datetime64[ns]'), unit='ns').astype('U27').tolist()
+            suffixes = [json_unescape(s) for s in column['suffixes']]
+            suffix_ids = unpack_ints(column['suffix'], INDEX_DTYPE)
+            suffix_ids = suffix_ids[rows].tolist() if len(suffixes) > 1 else [0] * len(rows)
+            verbatim = dict(column['raw'])
+            columns[key] = [json_unescape(verbatim[row]) if row in verbatim else time + (suffixes[suffix] if suffix >= 0 else '')
+                            for row, time, suffix in zip(rows.tolist(), times, suffix_ids)]
+        elif key == 'Details':
+            literals = [template_literals(template) for template in column['templates']]
+            template_ids = unpack_ints(column['template'], INDEX_DTYPE)
+            # Rows stored verbatim have template -1, which picks the trailing zero count
+            counts = np.array([len(pieces) - 1 for pieces in literals] + [0], dtype=np.int64)[template_ids]
+            offsets = (np.cumsum(counts) - counts)[rows].tolist()
+            params = column['params'].split(PARAM_SEPARATOR) if column['params'] else []
+            verbatim = dict(column['raw'])
+            decoded = []
+            for row, template, offset in zip(rows.tolist(), template_ids[rows].tolist(), offsets):
+                if template < 0:
+                    decoded.append(json_unescape(verbatim[row]))
+                else:
+                    decoded.append(fill_template(column['templates'][template], params[offset:offset + len(literals[template]) - 1]))
+            columns[key] = decoded
+        else:
+            values = column['values']
+            unescaped = {}
+            decoded = []
+            for value in unpack_ints(column['index'], INDEX_DTYPE)[rows].tolist():
+                if value not in unescaped:
+                    unescaped[value] = json_unescape(values[value])
+                decoded.append(unescaped[value])
+            columns[key] = decoded
+
+    for values in zip(*(columns[key] for key in keys)):
+        yield dict(zip(keys, values))
+
+def read_archive_text(file_path):
+    """Rebuild the exact text of the raw daily log an archive was made from."""
+    return ''.join(_iter_archive(read_archive(file_path), raw=True))
+
+def iter_log_lines(file_path, errors='ignore'):
+    """Yield the text of every line of a raw or archived log file, without line terminators.
+
+    Bytes of a raw file that are not valid UTF-8 are dropped by default, so one corrupt byte
+    does not stop a scan; errors is passed to open() like its namesake.
+    """
+    if is_archive(file_path):
+        for line in _iter_archive(read_archive(file_path), raw=True):
+            yield line.rstrip('\r\n')
+        return
+
+    with open(file_path, 'r', encoding='utf-8', errors=errors) as f:
+        for line in f:
+            yield line.rstrip('\r\n')
+
+def iter_log_entries(file_path, errors='ignore'):
+    """Yield the decoded entries of a raw or archived log file, skipping blank and malformed lines.
+
+    Archived days skip JSON decoding altogether: repeated values are decoded once per archive
+    and Details are rebuilt from their templates. Invalid UTF-8 in a raw file is handled as in
+    iter_log_lines().
+    """
+    if is_archive(file_path):
+        yield from _iter_archive(read_archive(file_path), raw=False)
+        return
+
+    with open(file_path, 'r', encoding='utf-8', errors=errors) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Skip malformed lines
+
+def iter_site_entries(site, log_dir):
+    """Yield (timestamp, site, entry) for every entry of one site, in time order.
+
+    The logger picks the daily file from the same clock it stamps entries with, so the daily
+    files of a site never overlap and chaining them oldest first keeps the site in order.
+    Each entry is tagged with a 'Site' field.
+    """
+    for file_path in list_log_files(log_dir):
+        for log_entry in iter_log_entries(file_path):
+            try:
+                timestamp = datetime.datetime.fromisoformat(log_entry['Timestamp'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if timestamp.tzinfo is None:
+                timestamp = timestamp.astimezone()  # Old entries without an offset were written in local time
+            log_entry['Site'] = site
+            yield timestamp, site, log_entry
+
+def merge_log_sources(log_dir_args):
+    """Merge the logs of several sites into one stream of (timestamp, site, entry) ordered by time.
+
+    This is a streaming k-way heap merge: only the next entry of each site is held in memory,
+    and timestamps are compared with their UTC offsets, so sites in different time zones or
+    either side of a daylight saving change interleave correctly.
+    """
+    sources = [iter_site_entries(*parse_site(arg)) for arg in log_dir_args]
+    return heapq.merge(*sources, key=itemgetter(0))
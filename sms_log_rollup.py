@@ -0,0 +1,507 @@
+"""Build small per-site, per-day partial aggregates of the SMS logs, and merge them centrally.
+
+Each site runs 'build' over its own od_logs and ships the resulting SMS_Rollup_<site>_<day>.json
+files instead of the raw logs. 'merge' combines any set of those files into the delivery time,
+timeout, error, outcome and recipient reports of analyze_sms_logs.py, so central analysis
+scales with sites x days rather than with message volume.
+
+Everything in a partial merges exactly except where noted:
+
+- counts (outcomes, timeouts and errors by provider/hour/level, error signatures) are summed
+- delivery times are kept in a log-bucketed sketch, so merged quantiles are within 1% of the
+  true value while count, mean, standard deviation, min and max stay exact, as do the counts
+  in the fixed distribution buckets of the delivery time report
+- distinct recipients are estimated with a HyperLogLog (about 1.6% standard error), whose
+  registers merge by taking the maximum
+- messages still unfinished at the end of their day are counted as given up at merge time, as
+  sends minus delivered and failed; one finishing after midnight is credited to the next day
+- a message queued before midnight and sent after it is counted on the day it was queued: each
+  partial lists the messages still waiting to be sent at the end of its day, and 'build' leaves
+  those out of the next day's message count
+
+    python sms_log_rollup.py build --log-dir practice_a=od_logs --output-dir rollups
+    python sms_log_rollup.py merge rollups/ other_site_rollups/
+"""
+import argparse
+import base64
+import bisect
+import glob
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from analyze_sms_logs import derive_delivery_latencies, mine_error_signatures, parse_log_file
+from sms_log_reader import list_log_files, parse_site
+
+ROLLUP_FORMAT = 'sms-log-rollup'
+ROLLUP_VERSION = 3
+ROLLUP_PATTERN = 'SMS_Rollup_*.json'
+
+SEND_EVENTS = {'SendSuccess', 'MessageSent'}
+DEQUEUE_EVENTS = {'MessageQueued', 'SendAttempt', 'SendSuccess', 'MessageSent', 'SendFailure', 'SendFailed', 'SendException'}
+SEND_FAILURE_EVENTS = {'SendFailure', 'SendFailed', 'SendException'}
+
+class LatencySketch:
+    """A mergeable quantile sketch: counts of values in logarithmic buckets of relative width 2%.
+
+    Any quantile read back is within RELATIVE_ACCURACY of a value that was added, however many
+    sketches were merged, because merging only adds bucket counts. Values are also counted
+    exactly in the distribution buckets of analyze_sms_logs.py, which log buckets cannot line
+    up with.
+    """
+    RELATIVE_ACCURACY = 0.01
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    MIN_VALUE = 1e-3  # Anything faster than a millisecond counts as zero
+    # Upper bounds of the delivery time report's buckets, right-closed like pd.cut: (0, 1], (1, 2], ...
+    DISTRIBUTION_BOUNDS = (1, 2, 3, 4, 5, 10, 30, 60, 120)
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.zeros = 0
+        self.distribution = [0] * (len(self.DISTRIBUTION_BOUNDS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        if value < self.MIN_VALUE:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value, self.GAMMA))] += 1
+        if value > 0:  # pd.cut leaves out zero, the open end of the first bucket
+            self.distribution[bisect.bisect_left(self.DISTRIBUTION_BOUNDS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.sum_squares += value * value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.distribution = [a + b for a, b in zip(self.distribution, other.distribution)]
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_squares += other.sum_squares
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Return the q quantile, or NaN for an empty sketch."""
+        if self.count == 0:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if rank < seen:
+                value = 2 * self.GAMMA ** key / (self.GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        # Sample standard deviation, like pandas
+        if self.count < 2:
+            return math.nan
+        variance = (self.sum_squares - self.sum * self.sum / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def to_json(self):
+        return {
+            'buckets': {str(key): count for key, count in self.buckets.items()},
+            'zeros': self.zeros, 'distribution': self.distribution, 'count': self.count, 'sum': self.sum, 'sum_squares': self.sum_squares,
+            'min': self.min if self.count else None, 'max': self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        sketch = cls()
+        sketch.buckets = Counter({int(key): count for key, count in data['buckets'].items()})
+        sketch.zeros = data['zeros']
+        sketch.distribution = data['distribution']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        sketch.sum_squares = data['sum_squares']
+        if sketch.count:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        return sketch
+
+class HyperLogLog:
+    """Approximate distinct count in 2^PRECISION one-byte registers, merged by taking the maximum."""
+    PRECISION = 12
+    REGISTERS = 1 << PRECISION
+
+    def __init__(self, registers=None):
+        self.registers = np.zeros(self.REGISTERS, dtype=np.uint8) if registers is None else registers
+
+    def add(self, value):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest(), 'big')
+        index = hashed >> (64 - self.PRECISION)
+        rest = hashed & ((1 << (64 - self.PRECISION)) - 1)
+        rank = (64 - self.PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        m = self.REGISTERS
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(int)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # Linear counting is more accurate for small sets
+        return raw
+
+    def to_json(self):
+        return base64.b64encode(self.registers.tobytes()).decode('ascii')
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(np.frombuffer(base64.b64decode(data), dtype=np.uint8).copy())
+
+def normalise_phone(phone):
+    """Strip the '+' so +6421... and 6421... count as one recipient."""
+    return phone.lstrip('+')
+
+def build_partial(file_path, site, carried_in=()):
+    """Aggregate one day of one site's logs into a partial.
+
+    carried_in is the previous day's carried_over: messages dequeued before midnight but not yet
+    sent, which that day has already counted.
+    """
+    results, timeouts, errors, events = parse_log_file(file_path, site)
+    df_events = pd.DataFrame(events) if events else None
+    df_deliveries = derive_delivery_latencies(pd.DataFrame(results) if results else None, df_events)
+
+    day = re.search(r'SMS_Log_(\d{8})', os.path.basename(file_path)).group(1)
+    source = os.stat(file_path)
+    partial = {
+        'format': ROLLUP_FORMAT,
+        'version': ROLLUP_VERSION,
+        'site': site,
+        'date': f"{day[:4]}-{day[4:6]}-{day[6:]}",
+        'source': os.path.basename(file_path),
+        'source_size': source.st_size,
+        'source_mtime_ns': source.st_mtime_ns,
+        'carried_in': sorted(carried_in),
+    }
+
+    # Delivery times, overall and by hour, and where each one came from
+    overall = LatencySketch()
+    by_hour = {}
+    sources = Counter()
+    if df_deliveries is not None and len(df_deliveries) > 0:
+        for hour, delivery_time, source in zip(df_deliveries['hour'], df_deliveries['delivery_time'], df_deliveries['latency_source']):
+            overall.add(delivery_time)
+            by_hour.setdefault(int(hour), LatencySketch()).add(delivery_time)
+            sources[source] += 1
+    partial['delivery_time'] = overall.to_json()
+    partial['delivery_time_by_hour'] = {str(hour): sketch.to_json() for hour, sketch in by_hour.items()}
+    partial['latency_sources'] = sources
+
+    partial['timeouts'] = {
+        'by_provider': Counter(row['provider'] for row in timeouts),
+        'by_hour': Counter(str(row['hour']) for row in timeouts),
+    }
+
+    df_errors = pd.DataFrame(errors) if errors else None
+    partial['errors'] = {
+        'by_level': Counter(row['level'] for row in errors),
+        'by_provider': Counter(row['provider'] for row in errors),
+        'by_event_type': Counter(row['event_type'] for row in errors),
+        'by_hour': Counter(str(row['hour']) for row in errors),
+        'signatures': [] if df_errors is None else [
+            dict(row, count=int(row['count']), first_seen=row['first_seen'].isoformat(), last_seen=row['last_seen'].isoformat())
+            for row in mine_error_signatures(df_errors).to_dict('records')
+        ],
+    }
+
+    # Outcomes, with the same rules as summarise_message_lifecycles(): delivered wins over failed
+    outcomes = {'messages': 0, 'sent': 0, 'delivered': 0, 'failed': 0}
+    carried_over = set()
+    recipients = HyperLogLog()
+    if df_events is not None:
+        by_type = df_events.groupby('event_type')['message_id'].agg(set)
+
+        def ids(event_types):
+            return set().union(*(by_type.get(t, set()) for t in event_types))
+
+        status_events = df_events[df_events['event_type'] == 'DeliveryStatus']
+        delivered = set(status_events.loc[status_events['status'] == 'Delivered', 'message_id'])
+        failed = (set(status_events.loc[status_events['status'] == 'Failed', 'message_id']) | ids(SEND_FAILURE_EVENTS)) - delivered
+        dequeued = ids(DEQUEUE_EVENTS)
+        carried_over = dequeued - ids(SEND_EVENTS) - ids(SEND_FAILURE_EVENTS)
+        outcomes = {
+            'messages': len(dequeued - set(carried_in)),
+            'sent': len(ids(SEND_EVENTS)),
+            'delivered': len(delivered),
+            'failed': len(failed),
+        }
+        for phone in df_events.loc[df_events['phone_number'] != '', 'phone_number'].unique():
+            recipients.add(normalise_phone(phone))
+    partial['outcomes'] = outcomes
+    partial['carried_over'] = sorted(carried_over)
+    partial['recipients'] = recipients.to_json()
+    return partial
+
+def rollup_path(output_dir, site, date):
+    return os.path.join(output_dir, f"SMS_Rollup_{site}_{date.replace('-', '')}.json")
+
+def build_rollups(log_dir_arg, output_dir):
+    """Write a partial for every day of a site whose log changed since its partial was built.
+
+    A day is also rebuilt when the previous day's carried_over changed, since its message count
+    depends on it.
+    """
+    site, log_dir = parse_site(log_dir_arg)
+    built = skipped = 0
+    carried_in = []
+    for file_path in list_log_files(log_dir):
+        day = re.search(r'SMS_Log_(\d{8})', os.path.basename(file_path)).group(1)
+        path = rollup_path(output_dir, site, f"{day[:4]}-{day[4:6]}-{day[6:]}")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                existing = json.load(f)
+            source = os.stat(file_path)
+            if (existing.get('version') == ROLLUP_VERSION and existing.get('source') == os.path.basename(file_path)
+                    and existing.get('source_size') == source.st_size and existing.get('source_mtime_ns') == source.st_mtime_ns
+                    and existing.get('carried_in') == carried_in):
+                carried_in = existing['carried_over']
+                skipped += 1
+                continue
+
+        partial = build_partial(file_path, site, carried_in)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(partial, f, separators=(',', ':'))
+        carried_in = partial['carried_over']
+        built += 1
+        print(f"Built {os.path.basename(path)} from {partial['source']} ({os.path.getsize(path)} bytes)")
+
+    print(f"Built {built} rollups for {site}, {skipped} already up to date")
+
+def load_partials(paths):
+    """Load every rollup file named or found in the given directories, one per site and day."""
+    files = []
+    for path in paths:
+        files.extend(sorted(glob.glob(os.path.join(path, ROLLUP_PATTERN))) if os.path.isdir(path) else [path])
+
+    partials = {}
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            partial = json.load(f)
+        if partial.get('format') != ROLLUP_FORMAT or partial.get('version') != ROLLUP_VERSION:
+            print(f"Skipping {file_path}: not a version {ROLLUP_VERSION} SMS log rollup")
+            continue
+        key = (partial['site'], partial['date'])
+        if key in partials:
+            print(f"Skipping {file_path}: duplicate rollup for {key[0]} on {key[1]}")
+            continue
+        partials[key] = partial
+    return partials
+
+def sum_counts(partials, *path):
+    """Sum the counters at the same path in every partial."""
+    total = Counter()
+    for partial in partials:
+        value = partial
+        for key in path:
+            value = value[key]
+        total.update(value)
+    return total
+
+def print_counts(title, counts, total, noun, label=''):
+    print(f"\n{title}:")
+    for key, count in counts:
+        print(f"{label}{key}: {count} {noun} ({100 * count / total:.2f}%)")
+
+def report_delivery_times(partials):
+    """Print the delivery time report of analyze_sms_logs.py from merged sketches."""
+    overall = LatencySketch()
+    by_hour = {}
+    by_date = {}
+    for partial in partials:
+        sketch = LatencySketch.from_json(partial['delivery_time'])
+        overall.merge(sketch)
+        by_date.setdefault(partial['date'], LatencySketch()).merge(sketch)
+        for hour, data in partial['delivery_time_by_hour'].items():
+            by_hour.setdefault(int(hour), LatencySketch()).merge(LatencySketch.from_json(data))
+
+    if overall.count == 0:
+        print("No delivery time data found in the rollups")
+        return
+
+    print("\n===== DELIVERY TIME ANALYSIS =====")
+    print(f"Total messages analyzed: {overall.count}")
+    sources = sum_counts(partials, 'latency_sources')
+    print("\nLatency Source:")
+    for source, count in sources.most_common():
+        print(f"{source}: {count} messages ({100 * count / overall.count:.2f}%)")
+
+    print("\nDelivery Time Statistics:")
+    print(f"Mean delivery time: {overall.mean:.2f} seconds")
+    print(f"Median delivery time: {overall.quantile(0.5):.2f} seconds")
+    print(f"Min delivery time: {overall.min:.2f} seconds")
+    print(f"Max delivery time: {overall.max:.2f} seconds")
+    print(f"Standard deviation: {overall.std:.2f} seconds")
+    print(f"95th percentile: {overall.quantile(0.95):.2f} seconds")
+    print(f"99th percentile: {overall.quantile(0.99):.2f} seconds")
+
+    print("\nDistribution of Delivery Times:")
+    labels = ['<1s', '1-2s', '2-3s', '3-4s', '4-5s', '5-10s', '10-30s', '30-60s', '1-2m', '>2m']
+    for label, count in zip(labels, overall.distribution):
+        print(f"{label}: {count} messages ({100 * count / overall.count:.2f}%)")
+
+    def stats_table(sketches, index_name):
+        table = pd.DataFrame({
+            key: {'mean': s.mean, 'median': s.quantile(0.5), 'min': s.min, 'max': s.max, 'count': s.count, 'std': s.std}
+            for key, s in sorted(sketches.items()) if s.count
+        }).T
+        table.index.name = index_name
+        return table
+
+    print("\nDelivery Times by Hour of Day:")
+    print(stats_table(by_hour, 'hour'))
+    print("\nDelivery Times by Date:")
+    print(stats_table(by_date, 'date'))
+
+def report_timeouts(partials):
+    """Print the timeout report of analyze_sms_logs.py from merged counts."""
+    by_provider = sum_counts(partials, 'timeouts', 'by_provider')
+    total = sum(by_provider.values())
+    if total == 0:
+        print("No timeouts found in the rollups")
+        return
+
+    print("\n===== TIMEOUT ANALYSIS =====")
+    print(f"Total timeouts found: {total}")
+    print_counts("Timeouts by Provider", by_provider.most_common(), total, 'timeouts')
+    by_hour = sum_counts(partials, 'timeouts', 'by_hour')
+    print_counts("Timeouts by Hour of Day", sorted(by_hour.items(), key=lambda item: int(item[0])), total, 'timeouts', 'Hour ')
+    by_date = Counter()
+    for partial in partials:
+        by_date[partial['date']] += sum(partial['timeouts']['by_provider'].values())
+    print_counts("Timeouts by Date", sorted((d, c) for d, c in by_date.items() if c), total, 'timeouts', 'Date ')
+
+def merge_signatures(partials, examples_per_signature=3):
+    """Combine the error signatures of every partial into one table."""
+    signatures = {}
+    for partial in partials:
+        for row in partial['errors']['signatures']:
+            merged = signatures.get(row['signature'])
+            if merged is None:
+                signatures[row['signature']] = dict(row, examples=list(row['examples']))
+                continue
+            merged['count'] += row['count']
+            merged['first_seen'] = min(merged['first_seen'], row['first_seen'])
+            merged['last_seen'] = max(merged['last_seen'], row['last_seen'])
+            for example in row['examples']:
+                if len(merged['examples']) < examples_per_signature and example not in merged['examples']:
+                    merged['examples'].append(example)
+    return pd.DataFrame(list(signatures.values()), columns=['signature', 'count', 'first_seen', 'last_seen', 'examples']).sort_values('count', ascending=False)
+
+def report_errors(partials, output_dir):
+    """Print the error report of analyze_sms_logs.py from merged counts and signatures."""
+    by_level = sum_counts(partials, 'errors', 'by_level')
+    total = sum(by_level.values())
+    if total == 0:
+        print("No errors found in the rollups")
+        return
+
+    print("\n===== ERROR ANALYSIS =====")
+    print(f"Total errors found: {total}")
+    print_counts("Errors by Level", by_level.most_common(), total, 'errors')
+    print_counts("Errors by Provider", sum_counts(partials, 'errors', 'by_provider').most_common(), total, 'errors')
+    print_counts("Errors by Event Type", sum_counts(partials, 'errors', 'by_event_type').most_common(), total, 'errors')
+    by_hour = sum_counts(partials, 'errors', 'by_hour')
+    print_counts("Errors by Hour of Day", sorted(by_hour.items(), key=lambda item: int(item[0])), total, 'errors', 'Hour ')
+
+    signatures = merge_signatures(partials)
+    print(f"\nError Signatures ({len(signatures)} distinct):")
+    for _, row in signatures.head(15).iterrows():
+        print(f"{row['count']} errors ({100 * row['count'] / total:.2f}%), {row['first_seen']} to {row['last_seen']}: {row['signature']}")
+        print(f"    e.g. {row['examples'][0]}")
+    signatures_path = os.path.join(output_dir, 'error_signatures.csv')
+    signatures.to_csv(signatures_path, index=False)
+    print(f"Saved error signatures to {signatures_path}")
+
+def report_outcomes(partials):
+    """Print message outcomes and approximate distinct recipients, per site and overall."""
+    print("\n===== OUTCOMES AND RECIPIENTS =====")
+    sites = sorted({partial['site'] for partial in partials})
+    rows = {}
+    for site in sites + ['All sites']:
+        site_partials = [p for p in partials if site in (p['site'], 'All sites')]
+        outcomes = sum_counts(site_partials, 'outcomes')
+        recipients = HyperLogLog()
+        for partial in site_partials:
+            recipients.merge(HyperLogLog.from_json(partial['recipients']))
+        rows[site] = {
+            'days': len(site_partials),
+            'messages': outcomes['messages'],
+            'delivered': outcomes['delivered'],
+            'failed': outcomes['failed'],
+            'gave_up': max(outcomes['messages'] - outcomes['delivered'] - outcomes['failed'], 0),
+            'distinct_recipients': round(recipients.estimate()),
+        }
+    table = pd.DataFrame(rows).T
+    table['delivered_rate'] = (table['delivered'] / table['messages'].where(table['messages'] > 0)).round(4)
+    print(table.to_string())
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Build and merge per-site, per-day SMS log rollups")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Write a rollup file for each day of a site's logs")
+    build.add_argument("--log-dir", default="od_logs", help="Directory containing the site's SMS log files, optionally as site=path")
+    build.add_argument("--output-dir", default="rollups", help="Directory to write rollup files to")
+
+    merge = commands.add_parser("merge", help="Combine rollup files into the analyze_sms_logs.py reports")
+    merge.add_argument("rollups", nargs="+", help="Rollup files, or directories containing them")
+    merge.add_argument("--output-dir", default=".", help="Directory to save output files")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    if args.command == "build":
+        site, log_dir = parse_site(args.log_dir)
+        if not os.path.isdir(log_dir):
+            print(f"Error: Log directory '{log_dir}' not found.")
+            sys.exit(1)
+        os.makedirs(args.output_dir, exist_ok=True)
+        build_rollups(args.log_dir, args.output_dir)
+        sys.exit(0)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    partials = list(load_partials(args.rollups).values())
+    if not partials:
+        print("No rollup files found")
+        sys.exit(1)
+    print(f"Merging {len(partials)} rollups from {len({p['site'] for p in partials})} sites")
+
+    report_delivery_times(partials)
+    report_timeouts(partials)
+    report_errors(partials, args.output_dir)
+    report_outcomes(partials)
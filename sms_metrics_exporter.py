@@ -0,0 +1,287 @@
+"""Export SMS bridge log metrics in the OpenMetrics (Prometheus) text format.
+
+Each refresh reads only the bytes appended to SMS_Log_* files since the previous refresh, from
+byte offsets kept in a state file along with the running counters, so refresh cost follows the
+new log volume rather than the history and counters survive restarts. Only complete lines are
+consumed; a line still being written is picked up whole on the next refresh.
+
+Days that were compacted by compact_sms_logs.py after being partly read are finished from the
+archive, and days that were archived before the exporter first saw them are read once. A raw
+day is closed once it has been read to the end and a later day's log exists, so it is not
+opened again on later refreshes.
+
+    python sms_metrics_exporter.py --log-dir od_logs --output sms_bridge.prom --interval 30
+    python sms_metrics_exporter.py --log-dir a=site_a/od_logs b=site_b/od_logs --port 9464
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sms_log_reader import is_archive, list_log_files, parse_site, read_archive_text
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+STATE_VERSION = 1
+
+# Upper bounds in seconds; the bridge times a message out after 630s (MESSAGE_TIMEOUT_MS)
+DELIVERY_SECONDS_BUCKETS = [1, 2, 5, 10, 15, 30, 60, 120, 300, 630]
+
+# A day that has been read in full, from its archive or from a raw file a later day followed
+DAY_COMPLETE = -1
+
+DELIVERY_TIME_PATTERN = re.compile(r'Delivery Time: (\d+\.\d+|\d+)')
+DELIVERY_STATUS_PATTERN = re.compile(r'Status: (\w+)')
+
+def new_state():
+    """Return empty exporter state."""
+    return {
+        'offsets': {},  # site -> day -> bytes of the raw file consumed, or DAY_COMPLETE
+        'events': Counter(),  # (site, provider, event_type, level) -> lines
+        'deliveries': Counter(),  # (site, provider, status) -> DeliveryStatus lines
+        'delivery_seconds': {},  # (site, provider) -> [bucket counts..., +Inf count, sum]
+        'malformed': Counter(),  # site -> lines that were not JSON
+        'bytes_read': Counter(),  # site -> bytes consumed
+        'last_event': {},  # site -> Unix time of the newest entry
+    }
+
+def load_state(state_path):
+    """Load exporter state, or start fresh if there is none."""
+    state = new_state()
+    if not os.path.exists(state_path):
+        return state
+
+    with open(state_path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    if saved.get('version') != STATE_VERSION:
+        raise ValueError(f"{state_path} is not a version {STATE_VERSION} exporter state file")
+
+    state['offsets'] = saved['offsets']
+    state['events'] = Counter({tuple(row[:-1]): row[-1] for row in saved['events']})
+    state['deliveries'] = Counter({tuple(row[:-1]): row[-1] for row in saved['deliveries']})
+    state['delivery_seconds'] = {tuple(row[:2]): row[2] for row in saved['delivery_seconds']}
+    state['malformed'] = Counter(saved['malformed'])
+    state['bytes_read'] = Counter(saved['bytes_read'])
+    state['last_event'] = saved['last_event']
+    return state
+
+def save_state(state, state_path):
+    """Write exporter state atomically, so a crash mid-write never loses the offsets."""
+    saved = {
+        'version': STATE_VERSION,
+        'offsets': state['offsets'],
+        'events': [list(key) + [count] for key, count in state['events'].items()],
+        'deliveries': [list(key) + [count] for key, count in state['deliveries'].items()],
+        'delivery_seconds': [list(key) + [histogram] for key, histogram in state['delivery_seconds'].items()],
+        'malformed': state['malformed'],
+        'bytes_read': state['bytes_read'],
+        'last_event': state['last_event'],
+    }
+    temp_path = state_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(saved, f)
+    os.replace(temp_path, state_path)
+
+def record_line(state, site, line):
+    """Update the counters with one log line."""
+    line = line.strip()
+    if not line:
+        return
+    try:
+        log_entry = json.loads(line)
+    except json.JSONDecodeError:
+        state['malformed'][site] += 1
+        return
+
+    provider = log_entry.get('Provider', '')
+    event_type = log_entry.get('EventType', '')
+    state['events'][(site, provider, event_type, log_entry.get('Level', ''))] += 1
+
+    try:
+        timestamp = datetime.datetime.fromisoformat(log_entry['Timestamp']).timestamp()
+        state['last_event'][site] = max(state['last_event'].get(site, 0), timestamp)
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    if event_type != 'DeliveryStatus':
+        return
+    details = log_entry.get('Details', '')
+    status_match = DELIVERY_STATUS_PATTERN.search(details)
+    state['deliveries'][(site, provider, status_match.group(1) if status_match else 'Unknown')] += 1
+
+    time_match = DELIVERY_TIME_PATTERN.search(details)
+    if time_match:
+        seconds = float(time_match.group(1))
+        histogram = state['delivery_seconds'].setdefault((site, provider), [0] * (len(DELIVERY_SECONDS_BUCKETS) + 2))
+        bucket = next((i for i, bound in enumerate(DELIVERY_SECONDS_BUCKETS) if seconds <= bound), len(DELIVERY_SECONDS_BUCKETS))
+        histogram[bucket] += 1
+        histogram[-1] += seconds
+
+def read_new_bytes(file_path, offset):
+    """Return the complete lines appended to a raw log after offset, as bytes."""
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read()
+    return data[:data.rfind(b'\n') + 1]
+
+def refresh(state, log_dirs):
+    """Consume everything appended to the logs since the last refresh. Returns the bytes read."""
+    total = 0
+    for site, log_dir in map(parse_site, log_dirs):
+        offsets = state['offsets'].setdefault(site, {})
+        log_files = list_log_files(log_dir)
+        for position, file_path in enumerate(log_files):
+            day = os.path.splitext(os.path.basename(file_path))[0]
+            offset = offsets.get(day, 0)
+            if offset == DAY_COMPLETE:
+                continue
+
+            if is_archive(file_path):
+                # Closed day: finish it from wherever the raw file was left off
+                data = read_archive_text(file_path).encode('utf-8')[offset:]
+                offsets[day] = DAY_COMPLETE
+            else:
+                size = os.path.getsize(file_path)
+                if size < offset:
+                    offset = 0  # The file was replaced or truncated
+                data = read_new_bytes(file_path, offset) if size != offset else b''
+                offsets[day] = offset + len(data)
+                # The logger has moved on to a later day's file, so a fully read earlier day is closed
+                if position < len(log_files) - 1 and offsets[day] == size:
+                    offsets[day] = DAY_COMPLETE
+
+            for line in data.decode('utf-8', errors='replace').splitlines():
+                record_line(state, site, line)
+            state['bytes_read'][site] += len(data)
+            total += len(data)
+    return total
+
+def escape_label(value):
+    """Escape a label value for the text format."""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(**values):
+    """Format a label set, e.g. {site="a",level="INFO"}."""
+    return '{' + ','.join(f'{name}="{escape_label(str(value))}"' for name, value in values.items()) + '}'
+
+def render_metrics(state):
+    """Render the current counters in the OpenMetrics text format."""
+    out = []
+
+    out.append('# TYPE sms_bridge_log_events counter')
+    out.append('# HELP sms_bridge_log_events Log lines written by the bridge.')
+    for (site, provider, event_type, level), count in sorted(state['events'].items()):
+        out.append(f'sms_bridge_log_events_total{labels(site=site, provider=provider, event_type=event_type, level=level)} {count}')
+
+    out.append('# TYPE sms_bridge_delivery_status counter')
+    out.append('# HELP sms_bridge_delivery_status Delivery status reports by status.')
+    for (site, provider, status), count in sorted(state['deliveries'].items()):
+        out.append(f'sms_bridge_delivery_status_total{labels(site=site, provider=provider, status=status)} {count}')
+
+    out.append('# TYPE sms_bridge_delivery_seconds histogram')
+    out.append('# UNIT sms_bridge_delivery_seconds seconds')
+    out.append('# HELP sms_bridge_delivery_seconds Delivery time reported with each delivery status.')
+    for (site, provider), histogram in sorted(state['delivery_seconds'].items()):
+        cumulative = 0
+        for bound, count in zip(DELIVERY_SECONDS_BUCKETS + ['+Inf'], histogram[:-1]):
+            cumulative += count
+            le = bound if bound == '+Inf' else f'{float(bound)}'
+            out.append(f'sms_bridge_delivery_seconds_bucket{labels(site=site, provider=provider, le=le)} {cumulative}')
+        out.append(f'sms_bridge_delivery_seconds_count{labels(site=site, provider=provider)} {cumulative}')
+        out.append(f'sms_bridge_delivery_seconds_sum{labels(site=site, provider=provider)} {histogram[-1]}')
+
+    out.append('# TYPE sms_bridge_log_last_event_timestamp_seconds gauge')
+    out.append('# UNIT sms_bridge_log_last_event_timestamp_seconds seconds')
+    out.append('# HELP sms_bridge_log_last_event_timestamp_seconds Time of the newest log entry read.')
+    for site, timestamp in sorted(state['last_event'].items()):
+        out.append(f'sms_bridge_log_last_event_timestamp_seconds{labels(site=site)} {timestamp}')
+
+    out.append('# TYPE sms_bridge_log_malformed_lines counter')
+    out.append('# HELP sms_bridge_log_malformed_lines Log lines that were not valid JSON.')
+    for site in sorted(state['bytes_read']):
+        out.append(f'sms_bridge_log_malformed_lines_total{labels(site=site)} {state["malformed"][site]}')
+
+    out.append('# TYPE sms_bridge_exporter_read_bytes counter')
+    out.append('# UNIT sms_bridge_exporter_read_bytes bytes')
+    out.append('# HELP sms_bridge_exporter_read_bytes Log bytes consumed by the exporter.')
+    for site, count in sorted(state['bytes_read'].items()):
+        out.append(f'sms_bridge_exporter_read_bytes_total{labels(site=site)} {count}')
+
+    out.append('# EOF')
+    return '\n'.join(out) + '\n'
+
+def write_metrics(text, output_path):
+    """Write the metrics file atomically, so a scraper never reads half of it."""
+    temp_path = output_path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(text)
+    os.replace(temp_path, output_path)
+
+def serve_metrics(port, current):
+    """Serve the latest rendered metrics on /metrics from a background thread."""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = current['text'].encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes every few seconds would drown out the refresh output
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_arguments():
+    """Parse command line arguments"""
+    parser = argparse.ArgumentParser(description="Export SMS log metrics in the OpenMetrics text format")
+    parser.add_argument("--log-dir", nargs="+", default=["od_logs"], help="Directories containing SMS log files, one per site, optionally as site=path")
+    parser.add_argument("--state-file", default="sms_metrics_state.json", help="File keeping read offsets and counters between refreshes")
+    parser.add_argument("--output", help="Metrics file to write on each refresh, e.g. for node_exporter's textfile collector")
+    parser.add_argument("--port", type=int, help="Serve the metrics on this local port at /metrics")
+    parser.add_argument("--interval", type=float, default=30, help="Seconds between refreshes (default: 30)")
+    parser.add_argument("--once", action="store_true", help="Refresh once and exit instead of looping")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_arguments()
+
+    for site, log_dir in map(parse_site, args.log_dir):
+        if not os.path.isdir(log_dir):
+            print(f"Error: Log directory '{log_dir}' not found.")
+            sys.exit(1)
+
+    if not args.output and args.port is None:
+        print("Error: give --output, --port or both.")
+        sys.exit(1)
+
+    state = load_state(args.state_file)
+    current = {'text': render_metrics(state)}
+    if args.port is not None:
+        serve_metrics(args.port, current)
+        print(f"Serving metrics on http://127.0.0.1:{args.port}/metrics")
+
+    while True:
+        started = time.monotonic()
+        read = refresh(state, args.log_dir)
+        if read:
+            save_state(state, args.state_file)
+        current['text'] = render_metrics(state)
+        if args.output:
+            write_metrics(current['text'], args.output)
+        print(f"{datetime.datetime.now():%H:%M:%S} Read {read} new bytes in {time.monotonic() - started:.2f}s")
+
+        if args.once:
+            break
+        time.sleep(max(0, args.interval - (time.monotonic() - started)))
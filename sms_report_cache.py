@@ -0,0 +1,221 @@
+"""Memoize report sections on disk and assemble them into one self-contained HTML report.
+
+A section is a function that prints its findings and writes PNG or CSV files, which it names
+when it is registered. Its cache key is the fingerprint of its inputs (file names, sizes and
+modification times), its parameters, its output files and the source code of the functions it
+runs. On a hit the section's printed text is replayed and its files are written back without
+running it. Entries live as pickles in the cache directory
+and are evicted least recently used first once the directory grows past its size limit.
+
+    report = Report(ReportCache('.report_cache'))
+    report.section('Errors', lambda: analyze_errors(frames), fingerprint_files(paths), code=[analyze_errors],
+                   outputs=['errors_by_hour.png'], prepare=load_frames)
+    report.write_html('sms_report.html', 'SMS Log Report')
+"""
+import base64
+import hashlib
+import html
+import inspect
+import io
+import os
+import pickle
+import sys
+import time
+from contextlib import redirect_stdout
+
+CACHE_SUFFIX = '.pkl'
+DEFAULT_CACHE_BYTES = 1024 ** 3
+
+def fingerprint_files(paths, *extra):
+    """Hash the names, sizes and modification times of the input files, without reading them."""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+    for value in extra:
+        digest.update(repr(value).encode('utf-8'))
+    return digest.hexdigest()
+
+def source_hash(functions):
+    """Hash the source of the functions a section runs, so editing one only invalidates its sections.
+
+    A module can be given instead of a function to hash all of its source, e.g. a shared reader
+    whose functions a section calls indirectly.
+    """
+    digest = hashlib.sha256()
+    for function in functions:
+        try:
+            digest.update(inspect.getsource(function).encode('utf-8'))
+        except (OSError, TypeError):
+            digest.update(function.__name__.encode('utf-8'))
+    return digest.hexdigest()
+
+class ReportCache:
+    """Pickled section results in a directory, evicted least recently used first."""
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """Return the cached result for key, or None. A hit marks the entry as recently used."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                result = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            # Truncated or written by incompatible code, so it is recomputed
+            return None
+        os.utime(path)
+        return result
+
+    def put(self, key, result):
+        """Store a result atomically, then evict old entries beyond the size limit."""
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(CACHE_SUFFIX):
+                entry_path = os.path.join(self.cache_dir, name)
+                stat = os.stat(entry_path)
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if entry_path != keep:
+                os.remove(entry_path)
+                total -= size
+
+class SectionResult:
+    """What a section returned, printed and wrote."""
+
+    def __init__(self, value, text, files):
+        self.value = value
+        self.text = text
+        self.files = files  # path -> bytes
+        self.cached = False
+        self.seconds = 0.0
+
+class Tee(io.StringIO):
+    """Capture printed text while still passing it through to the console."""
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+        return super().write(text)
+
+class Report:
+    """Run sections through the cache and collect them for the HTML report."""
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.sections = []
+
+    def section(self, title, compute, fingerprint, params=None, code=(), prepare=None, outputs=()):
+        """Return the SectionResult of compute(), from the cache when its inputs are unchanged.
+
+        outputs names every file compute() may write. Those it did write on a miss are kept with
+        the result and written back on a hit; a file it skipped, such as a plot that needs more
+        than one day, is left alone. prepare() is called before compute() on a miss, outside the
+        section's captured output, to load whatever compute() needs that a hit can do without.
+        """
+        started = time.perf_counter()
+        outputs = list(outputs)
+        key = hashlib.sha256(repr((title, fingerprint, sorted((params or {}).items()), outputs, source_hash(code))).encode('utf-8')).hexdigest()
+        result = self.cache.get(key) if self.cache else None
+
+        if result is not None:
+            sys.stdout.write(result.text)
+            for path, data in result.files.items():
+                replay_file(path, data)
+            result.cached = True
+        else:
+            if prepare:
+                prepare()
+            before = {path: file_state(path) for path in outputs}
+            tee = Tee(sys.stdout)
+            with redirect_stdout(tee):
+                value = compute()
+            files = {}
+            for path in outputs:
+                state = file_state(path)
+                if state is not None and state != before[path]:
+                    with open(path, 'rb') as f:
+                        files[path] = f.read()
+            result = SectionResult(value, tee.getvalue(), files)
+            if self.cache:
+                self.cache.put(key, result)
+
+        result.seconds = time.perf_counter() - started
+        self.sections.append((title, result))
+        return result
+
+    def write_html(self, path, title):
+        """Write every section's text and images into one HTML file with the PNGs inlined."""
+        parts = [
+            "<!DOCTYPE html>",
+            f"<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title>",
+            "<style>body{font-family:sans-serif;margin:2em}pre{background:#f6f6f6;padding:1em;overflow-x:auto}"
+            "img{max-width:100%;display:block;margin:1em 0}.meta{color:#777;font-size:small}</style></head><body>",
+            f"<h1>{html.escape(title)}</h1>",
+            f"<p class=\"meta\">Generated {time.strftime('%Y-%m-%d %H:%M:%S')}</p>",
+        ]
+        for section_title, result in self.sections:
+            source = 'cached' if result.cached else 'computed'
+            parts.append(f"<h2>{html.escape(section_title)}</h2>")
+            parts.append(f"<p class=\"meta\">{source} in {result.seconds:.2f}s</p>")
+            if result.text.strip():
+                parts.append(f"<pre>{html.escape(result.text.strip())}</pre>")
+            for file_path, data in result.files.items():
+                name = html.escape(os.path.basename(file_path))
+                if file_path.lower().endswith('.png'):
+                    encoded = base64.b64encode(data).decode('ascii')
+                    parts.append(f"<img alt=\"{name}\" src=\"data:image/png;base64,{encoded}\">")
+                else:
+                    parts.append(f"<p class=\"meta\">Wrote {name} ({len(data)} bytes)</p>")
+        parts.append("</body></html>")
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(parts))
+
+    def summary(self):
+        cached = sum(result.cached for _, result in self.sections)
+        return f"{cached} of {len(self.sections)} report sections reused from the cache"
+
+def file_state(path):
+    """Size and modification time of a file, or None if it does not exist."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def replay_file(path, data):
+    """Write a cached output file back unless it is already there with the same contents."""
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
@@ -0,0 +1,108 @@
+"""Shared fixtures: a few days of generated SMS_Log_* files in the format Services/Logger.cs writes."""
+import datetime
+import os
+import random
+import shutil
+import sys
+import uuid
+
+import pytest
+
+# The analysis scripts live at the top of the repository and import each other by module name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compact_sms_logs import compact_file
+from sms_log_reader import EMPTY_GUID, dotnet_escape
+
+LOG_DAYS = [datetime.date(2025, 3, 1), datetime.date(2025, 3, 2), datetime.date(2025, 3, 3)]
+LOCAL_OFFSET = datetime.timezone(datetime.timedelta(hours=13))
+# Delivery times the bridge logs with one decimal place, including the report's bucket edges
+EDGE_DELIVERY_TIMES = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 10.0, 30.0, 60.0, 120.0]
+
+def log_line(moment, level, event_type, details, bridge_id=EMPTY_GUID, provider_id=EMPTY_GUID, **extra):
+    """Return one log line, escaped and ordered like the bridge's serializer writes it."""
+    # .NET's round-trip format has 7 fractional digits before the offset
+    timestamp = moment.isoformat(timespec='microseconds')
+    fields = {
+        'Timestamp': timestamp[:26] + '0' + timestamp[26:],
+        'Level': level,
+        'Provider': 'JustRemotePhone',
+        'EventType': event_type,
+        'Details': details,
+        'SMSBridgeID': f'SmsBridgeId {{ Value = {bridge_id} }}',
+        'ProviderMessageID': f'ProviderMessageId {{ Value = {provider_id} }}',
+        **extra,
+    }
+    return '{' + ','.join(f'"{key}":"{dotnet_escape(value)}"' for key, value in fields.items()) + '}'
+
+def day_lines(day, rng, messages=120):
+    """Generate the time-ordered lines of one day: sends, status checks, deliveries, failures and timeouts."""
+    lines = []
+    phones = ['+6421%07d' % rng.randrange(10 ** 7) for _ in range(40)]
+    start = datetime.datetime.combine(day, datetime.time(8), LOCAL_OFFSET)
+    for i in range(messages):
+        queued_at = start + datetime.timedelta(seconds=30 * i + rng.uniform(0, 20))
+        bridge_id, provider_id, phone = str(uuid.UUID(int=rng.getrandbits(128))), str(uuid.UUID(int=rng.getrandbits(128))), rng.choice(phones)
+        sent_at = queued_at + datetime.timedelta(seconds=rng.uniform(0, 5))
+        lines.append((queued_at, log_line(queued_at, 'INFO', 'MessageQueued', f'SMS queued for {phone}', bridge_id)))
+        lines.append((sent_at, log_line(sent_at, 'INFO', 'SendAttempt', f'PhoneNumber: {phone}, Message: Hi <b> & é', bridge_id)))
+
+        outcome = rng.random()
+        if outcome < 0.05:
+            lines.append((sent_at, log_line(sent_at, 'ERROR', 'SendFailure', f'PhoneNumber: {phone}, Error: Timeout connecting to 10.0.0.{rng.randint(1, 9)}', bridge_id)))
+            continue
+        lines.append((sent_at, log_line(sent_at, 'INFO', 'SendSuccess', f'PhoneNumber: {phone}', bridge_id, provider_id)))
+        for check in range(rng.randint(0, 3)):
+            checked_at = sent_at + datetime.timedelta(seconds=10 * (check + 1))
+            lines.append((checked_at, log_line(checked_at, 'INFO', 'StatusCheck', 'Timer exists: True, Status exists: True', bridge_id)))
+
+        delivery_time = EDGE_DELIVERY_TIMES[i % len(EDGE_DELIVERY_TIMES)] if i % 3 == 0 else round(rng.lognormvariate(1.5, 1.0), 1)
+        finished_at = sent_at + datetime.timedelta(seconds=delivery_time)
+        if outcome < 0.1:
+            timed_out_at = sent_at + datetime.timedelta(seconds=630)
+            lines.append((timed_out_at, log_line(timed_out_at, 'ERROR', 'Timeout', f'Message timed out after 10.5 minutes. Numbers: {phone}', bridge_id, provider_id)))
+        elif outcome < 0.15:
+            lines.append((finished_at, log_line(finished_at, 'INFO', 'DeliveryStatus', f'Number: {phone}, Status: Failed, Delivery Time: {delivery_time:.1f} seconds', bridge_id, provider_id)))
+        elif outcome < 0.25:
+            lines.append((finished_at, log_line(finished_at, 'INFO', 'DeliveryStatus', f'Number: {phone}, Status: Delivered', bridge_id, provider_id)))
+        elif outcome < 0.95:
+            lines.append((finished_at, log_line(finished_at, 'INFO', 'DeliveryStatus', f'Number: {phone}, Status: Delivered, Delivery Time: {delivery_time:.1f} seconds', bridge_id, provider_id)))
+    lines.sort(key=lambda item: item[0])
+    return [line for _, line in lines]
+
+def write_logs(log_dir, seed=1):
+    """Write one SMS_Log_YYYYMMDD.log per day in LOG_DAYS, with CRLF line endings like the bridge.
+
+    The second day also has the lines an archive has to keep verbatim or in a second layout:
+    an extra field, a line without a Timestamp, a malformed line, a blank line and an LF ending.
+    """
+    rng = random.Random(seed)
+    os.makedirs(log_dir, exist_ok=True)
+    for day in LOG_DAYS:
+        lines = day_lines(day, rng)
+        if day == LOG_DAYS[1]:
+            noon = datetime.datetime.combine(day, datetime.time(12), LOCAL_OFFSET)
+            lines.insert(10, log_line(noon, 'WARN', 'ConfigReload', 'Settings changed', Source='install-settings.json'))
+            lines.insert(20, '{"Level":"INFO","Provider":"JustRemotePhone","EventType":"StatusCheck","Details":"Status: Delivered"}')
+            lines.insert(30, '{"Timestamp":"2025-03-02T12:00:01.0000000+13:00","Level":"INFO","Det')
+            lines.insert(40, '')
+        text = '\r\n'.join(lines) + '\r\n'
+        if day == LOG_DAYS[1]:
+            text += log_line(datetime.datetime.combine(day, datetime.time(23, 59), LOCAL_OFFSET), 'INFO', 'Heartbeat', 'Alive') + '\n'
+        with open(os.path.join(log_dir, f'SMS_Log_{day:%Y%m%d}.log'), 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+    return log_dir
+
+@pytest.fixture
+def log_dir(tmp_path):
+    """A site's od_logs directory of raw daily logs."""
+    return write_logs(str(tmp_path / 'raw' / 'od_logs'))
+
+@pytest.fixture
+def archived_log_dir(tmp_path, log_dir):
+    """The same logs with every day compacted into an archive."""
+    archived = str(tmp_path / 'archived' / 'od_logs')
+    shutil.copytree(log_dir, archived)
+    for name in sorted(os.listdir(archived)):
+        compact_file(os.path.join(archived, name))
+    return archived
@@ -0,0 +1,36 @@
+"""Inbound messages must be followed to their own outcome, and webhooks sorted by what happened to them."""
+import datetime
+
+from conftest import LOCAL_OFFSET, log_line
+from analyze_inbound_latency import trace_inbound_messages
+from sms_log_reader import EMPTY_GUID
+
+def test_trace_inbound_messages(tmp_path):
+    log_dir = tmp_path / 'clinic' / 'od_logs'
+    log_dir.mkdir(parents=True)
+    start = datetime.datetime(2025, 3, 1, 9, tzinfo=LOCAL_OFFSET)
+    first, second = '11111111-2222-3333-4444-000000000001', '11111111-2222-3333-4444-000000000002'
+    events = [
+        (0, 'SMSReceived', 'From: +6421000001, Contact: A, Message: Yes', first),
+        # Two more from the same number logged with the empty GUID, so their outcomes cannot be matched
+        (1, 'SMSReceived', 'From: +6421000001, Contact: A, Message: Yes', EMPTY_GUID),
+        (2, 'SMSReceived', 'From: +6421000001, Contact: A, Message: No', EMPTY_GUID),
+        (3, 'PrincipleInboundResolve', 'Store lookup for +6421000001: found=True', EMPTY_GUID),
+        (4, 'PrincipleInboundSmsCreated', 'Created', first),
+        (5, 'PrincipleInboundSmsUnmatched', 'Unmatched', EMPTY_GUID),
+        (6, 'SMSReceived', 'From: +6421000002, Contact: B, Message: Stop', second),
+        (7, 'PrincipleInboundSmsFailed', 'Principle API error', second),
+        (8, 'PrincipleWebhook', 'Principle webhook received but Principle integration is disabled', EMPTY_GUID),
+        (9, 'PrincipleWebhook', 'Principle webhook received from 10.0.0.1', EMPTY_GUID),
+        (10, 'PrincipleWebhook', 'Principle webhook rejected: invalid signature from 10.0.0.1', EMPTY_GUID),
+        (11, 'PrincipleWebhook', 'Principle webhook duplicate: message id 7 already processed', EMPTY_GUID),
+    ]
+    with open(log_dir / 'SMS_Log_20250301.log', 'w', encoding='utf-8', newline='') as f:
+        for seconds, event_type, details, bridge_id in events:
+            f.write(log_line(start + datetime.timedelta(seconds=seconds), 'INFO', event_type, details, bridge_id) + '\r\n')
+
+    df, webhooks = trace_inbound_messages([str(log_dir)])
+    assert df['outcome'].tolist() == ['Created', 'No outcome logged', 'No outcome logged', 'Failed']
+    assert df['lookup_at'].notna().tolist() == [True, False, False, False]
+    assert [t.second for t in df['finished_at'].dropna()] == [4, 7]
+    assert webhooks['kind'].tolist() == ['disabled', 'received', 'rejected', 'duplicate']
@@ -0,0 +1,93 @@
+"""The sweep line must give the same queue and in-flight depth as counting the open intervals directly,
+and the streaming missing delivery pass must report each send once."""
+import csv
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from conftest import LOCAL_OFFSET, log_line
+from analyze_sms_logs import MAX_IN_FLIGHT_SECONDS, depth_at, load_log_data, reconstruct_load, stream_missing_deliveries, summarise_message_lifecycles
+from sms_log_reader import EMPTY_GUID
+
+def open_intervals(starts, ends, times):
+    """Count the [start, end) intervals that contain each time, one time at a time."""
+    starts = starts.to_numpy(dtype='datetime64[ns]')
+    ends = ends.to_numpy(dtype='datetime64[ns]')
+    return np.array([np.count_nonzero((starts <= t) & (ends > t)) for t in times])
+
+def test_reconstruct_load_matches_brute_force(log_dir):
+    df_events = load_log_data([log_dir])[3]
+    lifecycles = summarise_message_lifecycles(df_events)
+    load = reconstruct_load(lifecycles)
+
+    cap = pd.Timedelta(seconds=MAX_IN_FLIGHT_SECONDS)
+    queued = lifecycles.dropna(subset=['queued_at'])
+    queued_end = queued['dequeued_at'].fillna(queued['queued_at'] + cap).clip(lower=queued['queued_at'])
+    in_flight = lifecycles.dropna(subset=['sent_at'])
+    flight_end = in_flight['finished_at'].fillna(in_flight['sent_at'] + cap).clip(lower=in_flight['sent_at'])
+
+    # Every boundary, and a moment either side of it
+    times = np.unique(load.index.to_numpy())
+    times = np.unique(np.concatenate([times, times - np.timedelta64(1, 'ms'), times + np.timedelta64(1, 'ms')]))
+    depth = depth_at(load, times)
+
+    assert load['in_flight'].max() > 1
+    np.testing.assert_array_equal(depth['queued'].to_numpy(), open_intervals(queued['queued_at'], queued_end, times))
+    np.testing.assert_array_equal(depth['in_flight'].to_numpy(), open_intervals(in_flight['sent_at'], flight_end, times))
+
+def test_depth_before_the_first_event_is_zero(log_dir):
+    lifecycles = summarise_message_lifecycles(load_log_data([log_dir])[3])
+    load = reconstruct_load(lifecycles)
+    depth = depth_at(load, [load.index[0] - pd.Timedelta(seconds=1)])
+    assert depth.iloc[0].tolist() == [0, 0]
+
+def test_entries_without_a_timestamp_are_skipped():
+    from analyze_sms_logs import parse_log_entries
+
+    sent = {'Timestamp': '2025-03-01T08:00:00.0000000+13:00', 'EventType': 'SendSuccess', 'Details': 'PhoneNumber: +6421000',
+            'SMSBridgeID': 'SmsBridgeId { Value = 11111111-2222-3333-4444-555555555555 }'}
+    untimed = {'EventType': 'DeliveryStatus', 'Details': 'Number: +6421000, Status: Delivered',
+               'SMSBridgeID': 'SmsBridgeId { Value = 11111111-2222-3333-4444-666666666666 }'}
+
+    # First in a file, and after an entry whose time and ID must not be borrowed
+    for entries in ([untimed, sent], [sent, untimed]):
+        results, timeouts, errors, events = parse_log_entries(entries)
+        assert [e['event_type'] for e in events] == ['SendSuccess']
+        assert (results, timeouts, errors) == ([], [], [])
+
+def test_stream_missing_deliveries_emits_after_the_watermark(tmp_path, capsys):
+    log_dir = tmp_path / 'clinic' / 'od_logs'
+    log_dir.mkdir(parents=True)
+    start = datetime.datetime(2025, 3, 1, 8, tzinfo=LOCAL_OFFSET)
+    ids = {name: f'11111111-2222-3333-4444-{n:012d}' for n, name in enumerate('ABC', 1)}
+
+    def at(minutes, event_type, details, name=None):
+        bridge_id = ids[name] if name else EMPTY_GUID
+        return log_line(start + datetime.timedelta(minutes=minutes), 'INFO', event_type, details, bridge_id)
+
+    lines = [
+        at(0, 'SendSuccess', 'PhoneNumber: +6421000001', 'A'),
+        at(5, 'SendSuccess', 'PhoneNumber: +6421000002', 'B'),
+        at(10, 'DeliveryStatus', 'Number: +6421000001, Status: Delivered', 'A'),
+        # An hour after B was sent, it is written out as missing
+        at(90, 'StatusCheck', 'Timer exists: True, Status exists: True'),
+        # Logged again and delivered late: neither counted as a new send nor matched
+        at(95, 'SendSuccess', 'PhoneNumber: +6421000002', 'B'),
+        at(100, 'DeliveryStatus', 'Number: +6421000002, Status: Delivered', 'B'),
+        at(120, 'SendSuccess', 'PhoneNumber: +6421000003', 'C'),
+    ]
+    (log_dir / 'SMS_Log_20250301.log').write_text('\r\n'.join(lines) + '\r\n', encoding='utf-8', newline='')
+    output_path = str(tmp_path / 'missing.csv')
+
+    assert stream_missing_deliveries([str(log_dir)], 1, output_path) == 1
+    with open(output_path, newline='', encoding='utf-8') as f:
+        rows = [(row['message_id'], row['phone'], row['site'], row['status']) for row in csv.DictReader(f)]
+    assert rows == [(f'SmsBridgeId {{ Value = {ids["B"]} }}', '+6421000002', 'clinic', 'missing'),
+                    (f'SmsBridgeId {{ Value = {ids["C"]} }}', '+6421000003', 'clinic', 'pending')]
+
+    out = capsys.readouterr().out
+    assert 'Total messages sent: 3' in out
+    assert 'Messages with delivery confirmation inside the watermark: 1' in out
+    assert 'Deliveries with no pending send (late or sent before the first log): 1' in out
+    assert 'Sends logged again after being reported missing (not counted twice): 1' in out
@@ -0,0 +1,50 @@
+"""Queries must return the same entries from raw and archived logs, whatever is pushed down."""
+import datetime
+
+import pytest
+
+from query_sms_logs import Query, run_query, scan_file
+from sms_log_reader import iter_log_entries, list_log_files
+
+QUERIES = [
+    dict(),
+    dict(levels=['ERROR']),
+    dict(event_types=['DeliveryStatus', 'Timeout'], providers=['JustRemotePhone']),
+    dict(event_types=['ConfigReload']),
+    dict(phones=['+6421']),
+    dict(contains='Status: Failed'),
+    dict(regex=r'Delivery Time: (?:1|10)\.0 '),
+    dict(since=datetime.datetime(2025, 3, 2, 8, 20), until=datetime.datetime(2025, 3, 2, 8, 40), event_types=['SendSuccess']),
+    dict(since=datetime.datetime(2025, 3, 2, 12), until=datetime.datetime(2025, 3, 3)),
+]
+
+@pytest.mark.parametrize('filters', QUERIES)
+def test_query_matches_on_raw_and_archived_logs(log_dir, archived_log_dir, filters):
+    def query(log_dirs):
+        stats = {'files': 0, 'pruned': 0, 'bytes': 0, 'lines': 0, 'decoded': 0, 'matched': 0}
+        return [{k: v for k, v in entry.items() if k != 'Site'} for entry in run_query(log_dirs, Query(**filters), stats)]
+
+    # Every entry the exact filter accepts, decoded without any pushed-down checks
+    expected_query = Query(**filters)
+    expected = [entry for path in list_log_files(log_dir) for entry in iter_log_entries(path) if expected_query.matches(entry)]
+
+    assert expected
+    assert query([log_dir]) == expected
+    assert query([archived_log_dir]) == expected
+
+def test_query_by_id_decodes_only_that_message(archived_log_dir):
+    archive_path = list_log_files(archived_log_dir)[2]
+    entry = next(e for e in iter_log_entries(archive_path) if e['EventType'] == 'SendSuccess')
+    bridge_id = entry['SMSBridgeID'].split()[-2]
+    stats = {'files': 0, 'pruned': 0, 'bytes': 0, 'lines': 0, 'decoded': 0, 'matched': 0}
+
+    found = list(scan_file(archive_path, Query(ids=[bridge_id[:13]]).prepare(), stats))
+    assert {e['EventType'] for e in found} >= {'MessageQueued', 'SendAttempt', 'SendSuccess'}
+    assert all(bridge_id in e['SMSBridgeID'] for e in found)
+    assert stats['decoded'] == len(found) < stats['lines']
+
+def test_phone_filter_matches_a_prefix_not_a_substring():
+    query = Query(phones=['+6421'])
+    assert query.matches({'Details': 'PhoneNumber: +64211234567'})
+    assert query.matches({'Details': 'SMS queued for 64211234567'})
+    assert not query.matches({'Details': 'PhoneNumber: +64964211234'})
@@ -0,0 +1,50 @@
+"""Replaying the recorded arrivals under today's policy must reproduce the recorded outcomes."""
+import datetime
+
+import numpy as np
+import pytest
+
+from conftest import LOCAL_OFFSET, log_line
+from analyze_sms_logs import load_log_data
+from simulate_retry_policy import BASELINE, fit_sites, parse_arguments, recorded_messages, run_policy, sweep_policies
+
+@pytest.fixture
+def default_args(monkeypatch):
+    monkeypatch.setattr('sys.argv', ['simulate_retry_policy.py'])
+    return parse_arguments()
+
+def test_baseline_is_swept_once(default_args):
+    assert BASELINE['backoff'] not in default_args.backoff
+    policies, baseline = sweep_policies(default_args)
+    assert policies.count(baseline) == 1
+    assert [p for p in policies if p.retries == 0 and p.timeout == baseline.timeout and p.tick == baseline.tick
+            and p.per_tick == baseline.per_tick and p.max_in_flight == baseline.max_in_flight] == [baseline]
+
+def test_baseline_reproduces_recorded_outcomes(log_dir, default_args):
+    messages = recorded_messages(load_log_data([log_dir])[3])
+    policies, baseline = sweep_policies(default_args)
+    sites, unfitted = fit_sites(messages, default_args.min_samples, max(p.retries for p in policies) + 1, np.random.default_rng(0))
+    assert unfitted == {}
+
+    predicted = run_policy(sites, baseline)
+    recorded = messages['outcome'].value_counts(normalize=True) * 100
+    assert predicted['delivered'] == pytest.approx(recorded['Delivered'], abs=3)
+    assert predicted['failed'] == pytest.approx(recorded['Failed'], abs=3)
+    assert predicted['gave_up'] == pytest.approx(recorded['Gave up trying'], abs=3)
+    assert predicted['attempts_per_message'] == 1
+    assert predicted['duplicates'] == 0
+
+def test_sites_with_nothing_dequeued_are_reported(tmp_path, log_dir, capsys):
+    branch_dir = tmp_path / 'branch' / 'od_logs'
+    branch_dir.mkdir(parents=True)
+    start = datetime.datetime(2025, 3, 1, 9, tzinfo=LOCAL_OFFSET)
+    with open(branch_dir / 'SMS_Log_20250301.log', 'w', encoding='utf-8', newline='') as f:
+        for i in range(4):
+            f.write(log_line(start + datetime.timedelta(minutes=i), 'INFO', 'MessageQueued', 'SMS queued for +6421000001',
+                             f'22222222-2222-3333-4444-{i:012d}') + '\r\n')
+
+    messages = recorded_messages(load_log_data([log_dir, str(branch_dir)])[3])
+    sites, unfitted = fit_sites(messages, 30, 1, np.random.default_rng(0))
+    assert len(sites) == 1
+    assert unfitted == {'branch': 4}
+    assert 'Left out branch: 4 arrivals but no dequeued messages to fit outcomes to' in capsys.readouterr().out
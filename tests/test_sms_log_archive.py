@@ -0,0 +1,84 @@
+"""Compacted archives must read back exactly like the raw daily logs they replace."""
+import os
+
+import pytest
+
+from compact_sms_logs import compact_file, expand_file
+from sms_log_reader import is_archive, iter_log_entries, iter_log_lines, list_log_files
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_compact_then_expand_is_byte_exact(log_dir):
+    for file_path in list_log_files(log_dir):
+        original = read_bytes(file_path)
+        archive_path = compact_file(file_path)
+        assert not os.path.exists(file_path)
+        assert read_bytes(expand_file(archive_path)) == original
+
+def test_archive_is_smaller_than_raw_log(log_dir):
+    for file_path in list_log_files(log_dir):
+        raw_size = os.path.getsize(file_path)
+        assert os.path.getsize(compact_file(file_path, keep_raw=True)) < raw_size / 3
+
+def test_archived_entries_match_raw_entries(log_dir, archived_log_dir):
+    raw_files = list_log_files(log_dir)
+    archived_files = list_log_files(archived_log_dir)
+    assert [is_archive(path) for path in archived_files] == [True] * len(raw_files)
+
+    for raw_path, archive_path in zip(raw_files, archived_files):
+        raw_entries = list(iter_log_entries(raw_path))
+        assert raw_entries, raw_path
+        assert list(iter_log_entries(archive_path)) == raw_entries
+        assert list(iter_log_lines(archive_path)) == list(iter_log_lines(raw_path))
+
+def test_list_log_files_prefers_the_archive(log_dir):
+    compact_file(list_log_files(log_dir)[0], keep_raw=True)
+    assert [is_archive(path) for path in list_log_files(log_dir)] == [True, False, False]
+
+def test_iter_log_lines_skips_invalid_utf8(log_dir):
+    file_path = list_log_files(log_dir)[0]
+    with open(file_path, 'ab') as f:
+        f.write(b'{"Details":"bad \xff byte"}\r\n')
+    assert list(iter_log_lines(file_path))[-1] == '{"Details":"bad  byte"}'
+    with pytest.raises(UnicodeDecodeError):
+        list(iter_log_lines(file_path, errors='strict'))
+
+def test_compact_empty_day(tmp_path):
+    file_path = tmp_path / 'SMS_Log_20250301.log'
+    file_path.write_bytes(b'')
+    archive_path = compact_file(str(file_path))
+    assert list(iter_log_entries(archive_path)) == []
+    assert read_bytes(expand_file(archive_path)) == b''
+
+def test_compact_day_with_every_timestamp_verbatim(tmp_path):
+    # Six fractional digits do not round-trip through ticks, so every timestamp is stored as written
+    text = ''.join(f'{{"Timestamp":"2025-03-01T08:00:0{i}.123456+13:00","Level":"INFO","EventType":"StatusCheck"}}\r\n' for i in range(3))
+    file_path = tmp_path / 'SMS_Log_20250301.log'
+    file_path.write_text(text, encoding='utf-8', newline='')
+
+    archive_path = compact_file(str(file_path))
+    assert [e['Timestamp'] for e in iter_log_entries(archive_path)] == [f'2025-03-01T08:00:0{i}.123456+13:00' for i in range(3)]
+    assert read_bytes(expand_file(archive_path)) == text.encode('utf-8')
+    assert sorted(os.listdir(tmp_path)) == ['SMS_Log_20250301.log', 'SMS_Log_20250301.smsa']
+
+def test_failed_compaction_leaves_no_temp_file(tmp_path, monkeypatch):
+    import compact_sms_logs
+
+    file_path = tmp_path / 'SMS_Log_20250301.log'
+    file_path.write_text('{"Level":"INFO"}\r\n', encoding='utf-8', newline='')
+    monkeypatch.setattr(compact_sms_logs, 'read_archive_text', lambda path: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        compact_file(str(file_path))
+    assert os.listdir(tmp_path) == ['SMS_Log_20250301.log']
+
+def test_compact_command_reports_empty_day(tmp_path):
+    import subprocess
+    import sys
+
+    (tmp_path / 'SMS_Log_20250301.log').write_bytes(b'')
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'compact_sms_logs.py')
+    result = subprocess.run([sys.executable, script, '--log-dir', str(tmp_path)], capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'Compacted SMS_Log_20250301.log' in result.stdout
@@ -0,0 +1,38 @@
+"""Reading raw days tolerantly, and merging several sites into one time-ordered stream."""
+import datetime
+import os
+
+import pytest
+
+from conftest import log_line
+from sms_log_reader import iter_log_entries, iter_log_lines, list_log_files, merge_log_sources
+
+def test_iter_log_entries_drops_invalid_utf8_like_iter_log_lines(log_dir):
+    file_path = list_log_files(log_dir)[0]
+    entries = list(iter_log_entries(file_path))
+    with open(file_path, 'ab') as f:
+        f.write(b'{"Level":"INFO","Details":"bad \xff byte"}\r\n')
+
+    assert list(iter_log_entries(file_path)) == entries + [{'Level': 'INFO', 'Details': 'bad  byte'}]
+    assert list(iter_log_lines(file_path))[-1] == '{"Level":"INFO","Details":"bad  byte"}'
+    with pytest.raises(UnicodeDecodeError):
+        list(iter_log_entries(file_path, errors='strict'))
+
+def write_site(directory, offset_hours, minutes):
+    """Write one day for a site whose clock is offset_hours from UTC, one line per given minute past 08:00."""
+    os.makedirs(directory, exist_ok=True)
+    zone = datetime.timezone(datetime.timedelta(hours=offset_hours))
+    start = datetime.datetime(2025, 3, 1, 8, tzinfo=zone)
+    with open(os.path.join(directory, 'SMS_Log_20250301.log'), 'w', encoding='utf-8', newline='') as f:
+        for minute in minutes:
+            f.write(log_line(start + datetime.timedelta(minutes=minute), 'INFO', 'StatusCheck', f'minute {minute}') + '\r\n')
+
+def test_merge_log_sources_interleaves_sites_in_different_time_zones(tmp_path):
+    # 08:00 at +13:00 is 07:00 at +12:00, so wall-clock order is not time order across sites
+    write_site(str(tmp_path / 'auckland'), 13, [0, 30, 60])
+    write_site(str(tmp_path / 'fiji'), 12, [-45, -15])
+
+    merged = list(merge_log_sources([f"akl={tmp_path / 'auckland'}", f"fji={tmp_path / 'fiji'}"]))
+    assert [entry['Details'] for _, _, entry in merged] == ['minute 0', 'minute -45', 'minute 30', 'minute -15', 'minute 60']
+    assert [site for _, site, _ in merged] == ['akl', 'fji', 'akl', 'fji', 'akl']
+    assert [entry['Site'] for _, _, entry in merged] == ['akl', 'fji', 'akl', 'fji', 'akl']
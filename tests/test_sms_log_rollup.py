@@ -0,0 +1,121 @@
+"""Merged rollups must reproduce the reports of analyze_sms_logs.py from the raw logs."""
+import datetime
+import os
+import random
+
+import numpy as np
+import pytest
+
+from conftest import LOCAL_OFFSET, log_line
+from analyze_sms_logs import analyze_delivery_times, load_log_data
+from sms_log_rollup import HyperLogLog, LatencySketch, build_partial, build_rollups, load_partials, sum_counts
+from sms_log_reader import list_log_files
+
+def report_block(text, title):
+    """Return the lines of one titled block of a printed report, up to the next blank line."""
+    lines = text.splitlines()
+    start = lines.index(title) + 1
+    end = next((i for i in range(start, len(lines)) if not lines[i].strip()), len(lines))
+    return lines[start:end]
+
+def test_merged_distribution_matches_analyze_sms_logs(log_dir, tmp_path, monkeypatch, capsys):
+    from sms_log_rollup import report_delivery_times
+
+    monkeypatch.chdir(tmp_path)  # analyze_delivery_times saves its plots to the working directory
+    analyze_delivery_times(load_log_data([log_dir])[0])
+    exact = capsys.readouterr().out
+
+    report_delivery_times([build_partial(path, 'site') for path in list_log_files(log_dir)])
+    merged = capsys.readouterr().out
+
+    title = 'Distribution of Delivery Times:'
+    assert report_block(merged, title) == report_block(exact, title)
+    assert report_block(merged, 'Delivery Time Statistics:')[0] == report_block(exact, 'Delivery Time Statistics:')[0]
+
+def test_sketch_distribution_is_right_closed():
+    sketch = LatencySketch()
+    for value in [0.0, 0.5, 1.0, 1.05, 2.0, 10.0, 10.1, 120.0, 121.0]:
+        sketch.add(value)
+    # (0, 1], (1, 2], (2, 3], (3, 4], (4, 5], (5, 10], (10, 30], (30, 60], (60, 120], (120, inf); zero is left out
+    assert sketch.distribution == [2, 2, 0, 0, 0, 1, 1, 0, 1, 1]
+
+def test_merged_sketches_match_one_sketch_of_everything():
+    rng = random.Random(3)
+    values = [round(rng.lognormvariate(1.5, 1.0), 1) for _ in range(5000)]
+
+    whole = LatencySketch()
+    parts = [LatencySketch() for _ in range(7)]
+    for i, value in enumerate(values):
+        whole.add(value)
+        parts[i % len(parts)].add(value)
+    merged = LatencySketch()
+    for part in parts:
+        merged.merge(LatencySketch.from_json(part.to_json()))
+
+    assert merged.buckets == whole.buckets
+    assert merged.distribution == whole.distribution
+    assert (merged.count, merged.min, merged.max) == (len(values), min(values), max(values))
+    assert merged.mean == pytest.approx(np.mean(values))
+    assert merged.std == pytest.approx(np.std(values, ddof=1))
+    for q in (0.5, 0.95, 0.99):
+        assert merged.quantile(q) == pytest.approx(np.quantile(values, q, method='lower'), rel=2 * LatencySketch.RELATIVE_ACCURACY)
+
+def test_merged_hyperloglog_estimates_distinct_count():
+    phones = [f'6421{i:07d}' for i in range(20000)]
+    merged = HyperLogLog()
+    for start in range(0, len(phones), 5000):
+        part = HyperLogLog()
+        # Overlapping parts: every phone is added to two of them
+        for phone in phones[start:start + 10000]:
+            part.add(phone)
+        merged.merge(HyperLogLog.from_json(part.to_json()))
+
+    assert merged.estimate() == pytest.approx(len(phones), rel=0.05)
+
+def write_midnight_logs(log_dir):
+    """Two days where one message is queued just before midnight and sent just after it."""
+    midnight = datetime.datetime(2025, 3, 2, tzinfo=LOCAL_OFFSET)
+    lifecycles = {
+        '11111111-2222-3333-4444-000000000001': [(-120, 'MessageQueued'), (-118, 'SendSuccess'), (-110, 'DeliveryStatus')],
+        '11111111-2222-3333-4444-000000000002': [(-2, 'MessageQueued'), (3, 'SendAttempt'), (4, 'SendSuccess'), (9, 'DeliveryStatus')],
+        '11111111-2222-3333-4444-000000000003': [(60, 'MessageQueued'), (62, 'SendSuccess')],
+    }
+    days = {}
+    for bridge_id, events in lifecycles.items():
+        for seconds, event_type in events:
+            moment = midnight + datetime.timedelta(seconds=seconds)
+            details = 'Number: +6421000001, Status: Delivered' if event_type == 'DeliveryStatus' else 'PhoneNumber: +6421000001'
+            days.setdefault(moment.date(), []).append((moment, log_line(moment, 'INFO', event_type, details, bridge_id)))
+    for day, lines in days.items():
+        with open(os.path.join(log_dir, f'SMS_Log_{day:%Y%m%d}.log'), 'w', encoding='utf-8', newline='') as f:
+            f.write(''.join(line + '\r\n' for _, line in sorted(lines)))
+
+def test_message_sent_after_midnight_is_counted_once(tmp_path):
+    log_dir, output_dir = tmp_path / 'od_logs', tmp_path / 'rollups'
+    log_dir.mkdir()
+    output_dir.mkdir()
+    write_midnight_logs(str(log_dir))
+
+    build_rollups(f'clinic={log_dir}', str(output_dir))
+    partials = load_partials([str(output_dir)])
+    assert [partials[('clinic', day)]['outcomes']['messages'] for day in ('2025-03-01', '2025-03-02')] == [2, 1]
+    outcomes = sum_counts(partials.values(), 'outcomes')
+    assert (outcomes['messages'], outcomes['sent'], outcomes['delivered']) == (3, 3, 2)
+
+def test_rollup_is_rebuilt_when_the_log_changes_at_the_same_size(tmp_path, capsys):
+    log_dir, output_dir = tmp_path / 'od_logs', tmp_path / 'rollups'
+    log_dir.mkdir()
+    output_dir.mkdir()
+    write_midnight_logs(str(log_dir))
+    build_rollups(f'clinic={log_dir}', str(output_dir))
+    build_rollups(f'clinic={log_dir}', str(output_dir))
+    assert 'Built 0 rollups for clinic, 2 already up to date' in capsys.readouterr().out
+
+    # Same size, different content: a status that was Delivered is now Failed
+    log_path = log_dir / 'SMS_Log_20250302.log'
+    log_path.write_bytes(log_path.read_bytes().replace(b'Status: Delivered', b'Status: Failed   '))
+    stat = os.stat(log_path)
+    os.utime(log_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    build_rollups(f'clinic={log_dir}', str(output_dir))
+    assert 'Built 1 rollups for clinic, 1 already up to date' in capsys.readouterr().out
+    assert load_partials([str(output_dir)])[('clinic', '2025-03-02')]['outcomes']['failed'] == 1
@@ -0,0 +1,96 @@
+"""The exporter must render the OpenMetrics text format and count each log line once across refreshes."""
+import datetime
+
+from conftest import LOCAL_OFFSET, log_line
+from compact_sms_logs import compact_file
+from sms_log_reader import list_log_files
+from sms_metrics_exporter import load_state, new_state, refresh, render_metrics, save_state
+
+def write_day(log_dir, lines, name='SMS_Log_20250301.log', mode='w'):
+    with open(log_dir / name, mode, encoding='utf-8', newline='') as f:
+        f.write(''.join(line + '\r\n' for line in lines))
+
+def day_one():
+    start = datetime.datetime(2025, 3, 1, 8, tzinfo=LOCAL_OFFSET)
+    return [
+        log_line(start, 'INFO', 'StatusCheck', 'Timer exists: True, Status exists: True'),
+        log_line(start, 'INFO', 'DeliveryStatus', 'Number: +6421000001, Status: Delivered, Delivery Time: 1.0 seconds'),
+        log_line(start, 'INFO', 'DeliveryStatus', 'Number: +6421000002, Status: Delivered, Delivery Time: 4.2 seconds'),
+        log_line(start + datetime.timedelta(minutes=1), 'INFO', 'DeliveryStatus', 'Number: +6421000003, Status: Failed, Delivery Time: 700.0 seconds'),
+        '{"Timestamp":"2025-03-01T08:02:00.0000000+13:00","Level":"INFO","Det',
+    ]
+
+EXPECTED = '''\
+# TYPE sms_bridge_log_events counter
+# HELP sms_bridge_log_events Log lines written by the bridge.
+sms_bridge_log_events_total{site="clinic",provider="JustRemotePhone",event_type="DeliveryStatus",level="INFO"} 3
+sms_bridge_log_events_total{site="clinic",provider="JustRemotePhone",event_type="StatusCheck",level="INFO"} 1
+# TYPE sms_bridge_delivery_status counter
+# HELP sms_bridge_delivery_status Delivery status reports by status.
+sms_bridge_delivery_status_total{site="clinic",provider="JustRemotePhone",status="Delivered"} 2
+sms_bridge_delivery_status_total{site="clinic",provider="JustRemotePhone",status="Failed"} 1
+# TYPE sms_bridge_delivery_seconds histogram
+# UNIT sms_bridge_delivery_seconds seconds
+# HELP sms_bridge_delivery_seconds Delivery time reported with each delivery status.
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="1.0"} 1
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="2.0"} 1
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="5.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="10.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="15.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="30.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="60.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="120.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="300.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="630.0"} 2
+sms_bridge_delivery_seconds_bucket{site="clinic",provider="JustRemotePhone",le="+Inf"} 3
+sms_bridge_delivery_seconds_count{site="clinic",provider="JustRemotePhone"} 3
+sms_bridge_delivery_seconds_sum{site="clinic",provider="JustRemotePhone"} 705.2
+# TYPE sms_bridge_log_last_event_timestamp_seconds gauge
+# UNIT sms_bridge_log_last_event_timestamp_seconds seconds
+# HELP sms_bridge_log_last_event_timestamp_seconds Time of the newest log entry read.
+sms_bridge_log_last_event_timestamp_seconds{site="clinic"} 1740769260.0
+# TYPE sms_bridge_log_malformed_lines counter
+# HELP sms_bridge_log_malformed_lines Log lines that were not valid JSON.
+sms_bridge_log_malformed_lines_total{site="clinic"} 1
+# TYPE sms_bridge_exporter_read_bytes counter
+# UNIT sms_bridge_exporter_read_bytes bytes
+# HELP sms_bridge_exporter_read_bytes Log bytes consumed by the exporter.
+sms_bridge_exporter_read_bytes_total{site="clinic"} {bytes_read}
+# EOF
+'''
+
+def test_render_metrics_exposition(tmp_path):
+    log_dir = tmp_path / 'clinic' / 'od_logs'
+    log_dir.mkdir(parents=True)
+    write_day(log_dir, day_one())
+
+    state = new_state()
+    bytes_read = refresh(state, [str(log_dir)])
+    assert bytes_read == (log_dir / 'SMS_Log_20250301.log').stat().st_size
+    assert render_metrics(state) == EXPECTED.replace('{bytes_read}', str(bytes_read))
+
+def test_refresh_reads_each_line_once(tmp_path):
+    log_dir = tmp_path / 'clinic' / 'od_logs'
+    log_dir.mkdir(parents=True)
+    lines = day_one()
+    write_day(log_dir, lines[:2])
+    # A line still being written is left for the next refresh
+    with open(log_dir / 'SMS_Log_20250301.log', 'a', encoding='utf-8', newline='') as f:
+        f.write(lines[2][:40])
+
+    state_path = str(tmp_path / 'state.json')
+    state = new_state()
+    refresh(state, [str(log_dir)])
+    save_state(state, state_path)
+
+    with open(log_dir / 'SMS_Log_20250301.log', 'a', encoding='utf-8', newline='') as f:
+        f.write(lines[2][40:] + '\r\n')
+    write_day(log_dir, lines[3:], mode='a')
+    state = load_state(state_path)
+    refresh(state, [str(log_dir)])
+    # Nothing new, and the day is then compacted after being read in full
+    assert refresh(state, [str(log_dir)]) == 0
+    compact_file(list_log_files(str(log_dir))[0])
+    assert refresh(state, [str(log_dir)]) == 0
+
+    assert render_metrics(state) == EXPECTED.replace('{bytes_read}', str(state['bytes_read']['clinic']))
@@ -0,0 +1,62 @@
+"""Cached sections must replay exactly the files they declared, and parsed days must be reused a day at a time."""
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+import analyze_sms_logs
+from analyze_sms_logs import load_log_data
+from sms_log_reader import list_log_files
+from sms_report_cache import Report, ReportCache
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_section_keeps_only_the_declared_files_it_wrote(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'untouched.csv').write_text('old')
+    runs = []
+
+    def compute():
+        runs.append(1)
+        print('Plotted')
+        (tmp_path / 'plot.png').write_bytes(b'png')
+        (tmp_path / 'unrelated.log').write_text('not an output')
+        return 42
+
+    def section():
+        return Report(ReportCache(str(tmp_path / 'cache'))).section('Plots', compute, 'inputs', outputs=['plot.png', 'untouched.csv', 'skipped.png'])
+
+    result = section()
+    assert (result.value, result.text, result.files, result.cached) == (42, 'Plotted\n', {'plot.png': b'png'}, False)
+
+    os.remove('plot.png')
+    capsys.readouterr()
+    result = section()
+    assert result.cached and len(runs) == 1
+    assert capsys.readouterr().out == 'Plotted\n'
+    assert (tmp_path / 'plot.png').read_bytes() == b'png'
+    assert not (tmp_path / 'skipped.png').exists()
+
+def test_load_log_data_parses_only_changed_days(log_dir, tmp_path, monkeypatch):
+    cache = ReportCache(str(tmp_path / 'cache'))
+    first = load_log_data([log_dir], cache)
+
+    parsed = []
+    iter_log_entries = analyze_sms_logs.iter_log_entries
+    monkeypatch.setattr(analyze_sms_logs, 'iter_log_entries', lambda path: parsed.append(os.path.basename(path)) or iter_log_entries(path))
+    last_day = list_log_files(log_dir)[-1]
+    with open(last_day, 'a', encoding='utf-8', newline='') as f:
+        f.write('{"Level":"INFO","EventType":"Heartbeat"}\r\n')
+
+    second = load_log_data([log_dir], cache)
+    assert parsed == [os.path.basename(last_day)]
+    for before, after in zip(first, second):
+        pd.testing.assert_frame_equal(before, after)
+
+def test_message_summary_requires_the_csv(tmp_path):
+    script = os.path.join(REPO, 'logs', 'analyse_message_summary.py')
+    result = subprocess.run([sys.executable, script, 'missing.csv', 'out'], cwd=tmp_path, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "Error: Message summary 'missing.csv' not found." in result.stdout
+    assert os.listdir(tmp_path) == []